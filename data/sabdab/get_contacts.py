@@ -1,5 +1,8 @@
+import time
+_import_start = time.perf_counter()
 from pandaprot import PandaProt
 from biopandas.pdb import PandasPdb
+from pipeline_metrics import StructureMetrics, append_record
 import os, re
 import pandas as pd
 import tempfile
@@ -12,7 +15,10 @@ from contextlib import redirect_stdout
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_epitope_residues_pandaprot(pdb_file, h_chain_id, l_chain_id, antigen_ids):
+## Time spent importing PandaProt and BioPandas (paid once per get_contacts.py process)
+IMPORT_SECONDS = time.perf_counter() - _import_start
+
+def get_epitope_residues_pandaprot(pdb_file, h_chain_id, l_chain_id, antigen_ids, metrics=None):
     """
     Extracts epitope residues from a PDB file using PandaProt.
     Args:
@@ -20,17 +26,22 @@ def get_epitope_residues_pandaprot(pdb_file, h_chain_id, l_chain_id, antigen_ids
         h_chain_id: str, heavy chain identifier (e.g., 'H').
         l_chain_id: str, light chain identifier (e.g., 'L').
         antigen_ids: list of str, identifiers for antigen chains (e.g., ['A', 'B', 'C']).
+        metrics: StructureMetrics, optional timers and counters.
     Returns:
         list of str: epitope residues in the format 'A:ARG 176',
     """
+    metrics = metrics or StructureMetrics(pdb_file)
     try:
         logger.info("1. Running PandaProt analysis...")
         chains = [h_chain_id, l_chain_id] + antigen_ids
         ## Make the PandaProt stuff quiet
         with open(os.devnull, 'w') as fnull:
             with redirect_stdout(fnull):
-                analyzer = PandaProt(pdb_file, chains=chains)
-                interactions = analyzer.map_interactions()
+                with metrics.stage("pandaprot_load"):
+                    analyzer = PandaProt(pdb_file, chains=chains)
+                with metrics.stage("interaction_mapping"):
+                    interactions = analyzer.map_interactions()
+        metrics.count("interactions", sum(len(v) for v in interactions.values()))
 
 
         epitope_residues = []
@@ -51,9 +62,11 @@ def get_epitope_residues_pandaprot(pdb_file, h_chain_id, l_chain_id, antigen_ids
                         relevant_interactions.append((interaction_type, interaction))
                     ## Ignores antigen-antigen interactions
 
+        metrics.count("antibody_antigen_interactions", len(relevant_interactions))
         return sorted(set(epitope_residues))
     except Exception as e:
         print(f"Error processing {pdb_file}: {e}")
+        metrics.count("pandaprot_errors")
         return []
 
 def build_resnum_to_seq_idx_map(pdb_df: PandasPdb, chain_id: str) -> dict:
@@ -107,7 +120,7 @@ def highlight_epitope_in_sequence(sequence, chain_id, epitope_residues, resnum_t
     return highlighted_seq
 
 
-def find_contacts(pdb_id, pdb_file, h_chain_id, l_chain_id, antigen_ids, antigen_seqs, output_file):
+def find_contacts(pdb_id, pdb_file, h_chain_id, l_chain_id, antigen_ids, antigen_seqs, output_file, metrics=None):
     """
     Extracts epitope residues from a PDB file using PandaProt and highlights them in the antigen sequence.
     Args:
@@ -115,27 +128,36 @@ def find_contacts(pdb_id, pdb_file, h_chain_id, l_chain_id, antigen_ids, antigen
         h_chain_id: str, heavy chain identifier (e.g., 'H').
         l_chain_id: str, light chain identifier (e.g., 'L').
         antigen_ids: list of str, identifiers for antigen chains (e.g., ['A', 'B', 'C']).
+        metrics: StructureMetrics, optional timers (decompress, parse, pandaprot_load, interaction_mapping,
+            highlight, write) and counters (bytes, atoms, chains, epitope residues, ...).
     Returns:
         str: message indicating processing status and results.
     """
+    metrics = metrics or StructureMetrics(pdb_id)
+    metrics.count("bytes", os.path.getsize(pdb_file))
+
     ## If .gz, unzip to a temp file
     if pdb_file.endswith('.gz'):
-        with tempfile.NamedTemporaryFile(suffix='.pdb', mode='wb', delete=False) as temp_file:
-        ## Open the .gz file in binary read mode
-            with gzip.open(pdb_file, 'rb') as f:
-                # Copy the unzipped content from the .gz file to the temporary file
-                shutil.copyfileobj(f, temp_file)
+        with metrics.stage("decompress"):
+            with tempfile.NamedTemporaryFile(suffix='.pdb', mode='wb', delete=False) as temp_file:
+            ## Open the .gz file in binary read mode
+                with gzip.open(pdb_file, 'rb') as f:
+                    # Copy the unzipped content from the .gz file to the temporary file
+                    shutil.copyfileobj(f, temp_file)
 
         pdb_file = temp_file.name
         logger.info(f"Unzipped input PDB to temporary file {temp_file.name}")
     else:
         pdb_file = pdb_file
 
-    pdb_df = PandasPdb().read_pdb(pdb_file)
+    with metrics.stage("parse"):
+        pdb_df = PandasPdb().read_pdb(pdb_file)
     
     ## Get available chains and check if required chains are present
     available_chains = set(str(c).strip() for c in pdb_df.df['ATOM']['chain_id'].unique())
     required_chains = {h_chain_id, l_chain_id} | set(antigen_ids)
+    metrics.count("atoms", len(pdb_df.df['ATOM']))
+    metrics.count("chains", len(available_chains))
     
     ## Only use chains that are present
     h_chain_id = h_chain_id if h_chain_id in available_chains else None
@@ -143,12 +165,16 @@ def find_contacts(pdb_id, pdb_file, h_chain_id, l_chain_id, antigen_ids, antigen
     antigen_ids = [c for c in antigen_ids if c in available_chains]
 
     if not h_chain_id or not l_chain_id or not antigen_ids:
+        metrics.status = "skipped"
         return logger.warning(f"Skipping {pdb_file}: Required chains ({required_chains}) not found. Available: ({available_chains})")
     
     # pdb_id = os.path.splitext(os.path.basename(pdb_file))[0]
-    residues = get_epitope_residues_pandaprot(pdb_file, h_chain_id, l_chain_id, antigen_ids)
+    metrics.count("antigen_chains", len(antigen_ids))
+    residues = get_epitope_residues_pandaprot(pdb_file, h_chain_id, l_chain_id, antigen_ids, metrics=metrics)
+    metrics.count("epitope_residues", len(residues))
 
     chain_list, seq_list, res_list = [], [], []
+    highlight_start = time.perf_counter()
     for i, antigen_chain in enumerate(antigen_ids):
         antigen_sequence = antigen_seqs[i] if i < len(antigen_seqs) else None
         if antigen_sequence and antigen_sequence != 'nan':
@@ -174,11 +200,14 @@ def find_contacts(pdb_id, pdb_file, h_chain_id, l_chain_id, antigen_ids, antigen
             'epitope_residues': '|'.join(res_list)
         }]
 
+    metrics.stages["highlight"] = time.perf_counter() - highlight_start
+
     ## Create DataFrame and merge with original
     highlight_df = pd.DataFrame(combined_results)
 
     ## Write to CSV if output file is specified
-    highlight_df.to_csv(output_file, index=False)
+    with metrics.stage("write"):
+        highlight_df.to_csv(output_file, index=False)
     return logger.info(f"DONE: {pdb_id} processed. Results saved to {output_file}")
 
 
@@ -190,6 +219,7 @@ if __name__ == "__main__":
     parser.add_argument("--antigen_ids", type=str, required=True, help="List of |-delimited antigen chain identifiers (e.g., 'A|B|C').")
     parser.add_argument("--antigen_seqs", type=str, required=True, help="List of |-delimited antigen sequences.")
     parser.add_argument("--output_file", type=str, required=True, help="Output .csv file to save results.")
+    parser.add_argument("--metrics_file", type=str, default=None, help="Optional .jsonl to append this structure's timings and counters to (see pipeline_metrics.py).")
     
     args = parser.parse_args()
 
@@ -203,9 +233,20 @@ if __name__ == "__main__":
     antigen_seqs = args.antigen_seqs.split('|')
     output_file = args.output_file
 
+    metrics = StructureMetrics(pdb_id)
+    metrics.stages["imports"] = IMPORT_SECONDS
+
     ## Check if output file exists. If so, skip processing
-    if os.path.exists(output_file):
-        logger.warning(f"Output file {output_file} already exists. Skipping processing for {pdb_id}.")
-    else:
-        logger.info(f"Starting contact extraction for {pdb_id}...")
-        find_contacts(pdb_id, pdb_file, h_chain_id, l_chain_id, antigen_ids, antigen_seqs, output_file)
\ No newline at end of file
+    try:
+        if os.path.exists(output_file):
+            logger.warning(f"Output file {output_file} already exists. Skipping processing for {pdb_id}.")
+            metrics.status = "exists"
+        else:
+            logger.info(f"Starting contact extraction for {pdb_id}...")
+            find_contacts(pdb_id, pdb_file, h_chain_id, l_chain_id, antigen_ids, antigen_seqs, output_file, metrics=metrics)
+    except Exception as e:
+        metrics.status, metrics.error = "error", f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if args.metrics_file:
+            append_record(args.metrics_file, metrics.record())
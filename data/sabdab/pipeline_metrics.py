@@ -0,0 +1,210 @@
+from contextlib import contextmanager
+import statistics
+import resource
+import json
+import time
+import sys, os
+
+"""
+Lightweight instrumentation for the contact-extraction pipeline: per-stage timers, counters and
+peak RSS for each structure, appended as one JSON line per structure to a metrics file, and
+aggregated into a run summary (.json) and a Prometheus-style text file (for node_exporter's
+textfile collector or a quick look with grep).
+
+Each get_contacts.py job runs in its own process, so the peak RSS of a record is that structure's peak.
+"""
+
+STAGES = ["imports", "decompress", "parse", "pandaprot_load", "interaction_mapping", "highlight", "write"]
+
+
+def peak_rss_mb() -> float:
+    ## ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+class StructureMetrics:
+    """
+    Timers and counters for one structure.
+    Usage:
+        metrics = StructureMetrics(pdb_id)
+        with metrics.stage("parse"):
+            ...
+        metrics.count("atoms", len(atom_df))
+        append_record(metrics_file, metrics.record())
+    """
+    def __init__(self, pdb_id: str):
+        self.pdb_id = pdb_id
+        self.status = "ok"
+        self.error = None
+        self.stages = {}
+        self.counters = {}
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name: str, value: int=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self) -> dict:
+        return {
+            "pdb_id": self.pdb_id,
+            "status": self.status,
+            "error": self.error,
+            "total_s": time.perf_counter() - self.start + self.stages.get("imports", 0.0),
+            **{f"{name}_s": seconds for name, seconds in self.stages.items()},
+            **self.counters,
+            "peak_rss_mb": peak_rss_mb(),
+            "pid": os.getpid(),
+            "timestamp": time.time()
+        }
+
+
+def append_record(path: str, record: dict):
+    """
+    Appends a record as one JSON line. The line is written with a single append-mode write,
+    so records from parallel jobs do not interleave.
+    """
+    line = (json.dumps(record) + "\n").encode()
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def read_records(path: str) -> list:
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def _quantile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(records: list, wall_time: float=None) -> dict:
+    """
+    Aggregates per-structure records into a run summary: counts by status, the time spent in each
+    stage (total, mean, p50, p95, max and share of all stage time), counter totals and peak RSS.
+    """
+    status_counts = {}
+    for record in records:
+        status_counts[record["status"]] = status_counts.get(record["status"], 0) + 1
+    processed = [r for r in records if r["status"] in ("ok", "error")]
+
+    stage_names = [s for s in STAGES if any(f"{s}_s" in r for r in processed)]
+    stage_names += sorted({k[:-2] for r in processed for k in r if k.endswith("_s") and k != "total_s"} - set(stage_names))
+    all_stage_time = sum(r.get(f"{s}_s", 0.0) for r in processed for s in stage_names)
+    stages = {}
+    for name in stage_names:
+        values = [r[f"{name}_s"] for r in processed if f"{name}_s" in r]
+        stages[name] = {
+            "count": len(values),
+            "total_s": sum(values),
+            "mean_s": statistics.mean(values),
+            "p50_s": _quantile(values, 0.5),
+            "p95_s": _quantile(values, 0.95),
+            "max_s": max(values),
+            "share": sum(values) / all_stage_time if all_stage_time > 0 else 0.0
+        }
+
+    reserved = {"pdb_id", "status", "error", "pid", "timestamp", "peak_rss_mb"}
+    counters = {}
+    for record in processed:
+        for key, value in record.items():
+            if key not in reserved and not key.endswith("_s") and isinstance(value, (int, float)):
+                counters[key] = counters.get(key, 0) + value
+
+    total_times = [r["total_s"] for r in processed]
+    summary = {
+        "structures": len(records),
+        "status": status_counts,
+        "wall_time_s": wall_time,
+        "structures_per_min": 60 * len(processed) / wall_time if wall_time else None,
+        "total_s": sum(total_times),
+        "mean_total_s": statistics.mean(total_times) if total_times else 0.0,
+        "p95_total_s": _quantile(total_times, 0.95) if total_times else 0.0,
+        "peak_rss_mb": max((r["peak_rss_mb"] for r in records), default=0.0),
+        "stages": stages,
+        "counters": counters,
+        "slowest": [
+            {"pdb_id": r["pdb_id"], "total_s": r["total_s"], "atoms": r.get("atoms")}
+            for r in sorted(processed, key=lambda r: r["total_s"], reverse=True)[:10]
+        ]
+    }
+    return summary
+
+
+def to_prometheus(summary: dict, prefix: str="peleke_contacts") -> str:
+    """
+    Renders a run summary in the Prometheus text exposition format.
+    """
+    lines = [
+        f"# HELP {prefix}_structures_total Structures processed, by status.",
+        f"# TYPE {prefix}_structures_total counter"
+    ]
+    lines += [f'{prefix}_structures_total{{status="{status}"}} {count}' for status, count in summary["status"].items()]
+
+    lines += [
+        f"# HELP {prefix}_stage_seconds Seconds per structure spent in each stage.",
+        f"# TYPE {prefix}_stage_seconds summary"
+    ]
+    for name, stage in summary["stages"].items():
+        lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="0.5"}} {stage["p50_s"]:.6f}')
+        lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="0.95"}} {stage["p95_s"]:.6f}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["total_s"]:.6f}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+
+    for name, value in summary["counters"].items():
+        lines += [f"# TYPE {prefix}_{name}_total counter", f"{prefix}_{name}_total {value}"]
+
+    lines += [
+        f"# HELP {prefix}_peak_rss_bytes Largest peak resident set size of a structure job.",
+        f"# TYPE {prefix}_peak_rss_bytes gauge",
+        f"{prefix}_peak_rss_bytes {int(summary['peak_rss_mb'] * 2**20)}"
+    ]
+    if summary["wall_time_s"] is not None:
+        lines += [f"# TYPE {prefix}_run_seconds gauge", f"{prefix}_run_seconds {summary['wall_time_s']:.3f}"]
+    return "\n".join(lines) + "\n"
+
+
+def write_summary(metrics_file: str, summary_file: str, prometheus_file: str=None, wall_time: float=None) -> dict:
+    """
+    Aggregates a metrics file into a summary .json (and optionally a Prometheus .prom file).
+    """
+    summary = summarize(read_records(metrics_file), wall_time=wall_time)
+    with open(summary_file, 'w') as f:
+        json.dump(summary, f, indent=2)
+    if prometheus_file:
+        ## Written to a temporary file and renamed, so a collector never reads a partial file
+        with open(f"{prometheus_file}.partial", 'w') as f:
+            f.write(to_prometheus(summary))
+        os.replace(f"{prometheus_file}.partial", prometheus_file)
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Summarize a get_contacts.py metrics file.")
+    parser.add_argument("--metrics_file", type=str, required=True, help="Per-structure metrics (.jsonl) written with --metrics_file.")
+    parser.add_argument("--summary_file", type=str, default="contacts_summary.json", help="Run summary .json.")
+    parser.add_argument("--prometheus_file", type=str, default="contacts_metrics.prom", help="Prometheus text file.")
+    parser.add_argument("--wall_time", type=float, default=None, help="Wall time of the run in seconds (for throughput).")
+    args = parser.parse_args()
+
+    summary = write_summary(args.metrics_file, args.summary_file, args.prometheus_file, args.wall_time)
+    print(f"{summary['structures']} structures {summary['status']}, mean {summary['mean_total_s']:.2f} s, peak RSS {summary['peak_rss_mb']:.0f} MB")
+    for name, stage in summary["stages"].items():
+        print(f"  {name:<20} {stage['total_s']:10.1f} s total  {stage['mean_s']:8.3f} s mean  {stage['p95_s']:8.3f} s p95  {stage['share']:6.1%}")
@@ -0,0 +1,111 @@
+from collections import Counter, defaultdict
+import pandas as pd
+import torch
+import json
+import logging
+
+"""
+N-gram draft model for speculative decoding of peleke completions (`HEAVY|LIGHT<|im_end|>`).
+Antibody Fv chains are close to germline outside the CDRs, so the next token is usually predictable
+from the last few tokens. The draft is trained on the `antibody_fv_seqs` column of the training set,
+tokenized with the peleke tokenizer, and proposes the most frequent continuation of each context
+(backing off to shorter contexts when a context was never seen).
+"""
+
+logger = logging.getLogger(__name__)
+
+END_TOKEN = "<|im_end|>"
+COMPLETION_PREFIX = "Antibody:"
+
+
+class NGramDraftModel:
+    """
+    Deterministic token n-gram model over peleke completions.
+    Args:
+        order: int, n-gram order (the context is the last order - 1 tokens).
+        table: dict mapping context tuples (of length 0 to order - 1) to the most frequent next token.
+    """
+    def __init__(self, order: int=6, table: dict=None):
+        self.order = order
+        self.table = table or {}
+
+    @classmethod
+    def train(cls, tokenizer, sequences: list, order: int=6):
+        """
+        Counts the n-grams of the tokenized completions (` {antibody_fv_seqs}<|im_end|>`, as in the fine-tuning text).
+        Args:
+            tokenizer: the peleke tokenizer.
+            sequences: list of str, `HEAVY|LIGHT` Fv sequences.
+            order: int, n-gram order.
+        """
+        prefix_length = len(tokenizer(COMPLETION_PREFIX, add_special_tokens=False)["input_ids"])
+        texts = [f"{COMPLETION_PREFIX} {seq}{END_TOKEN}" for seq in sequences]
+        counts = defaultdict(Counter)
+        for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]:
+            completion = ids[prefix_length:]
+            for i, token_id in enumerate(completion):
+                for n in range(order):
+                    if i - n < 0:
+                        break
+                    counts[tuple(completion[i - n:i])][token_id] += 1
+        table = {context: counter.most_common(1)[0][0] for context, counter in counts.items()}
+        logger.info(f"Trained a {order}-gram draft model on {len(sequences)} sequences ({len(table)} contexts).")
+        return cls(order, table)
+
+    @classmethod
+    def from_csv(cls, tokenizer, csv_file: str, order: int=6, column: str="antibody_fv_seqs"):
+        """
+        Trains the draft model on a column of `HEAVY|LIGHT` sequences (e.g., data/sabdab/sabdab_training_dataset.csv).
+        """
+        sequences = pd.read_csv(csv_file)[column].dropna().drop_duplicates().tolist()
+        return cls.train(tokenizer, sequences, order=order)
+
+    @classmethod
+    def from_file(cls, tokenizer, path: str, order: int=6):
+        """
+        Loads a saved draft model (.json) or trains one on a training-set .csv.
+        """
+        if path.endswith(".json"):
+            return cls.load(path)
+        return cls.from_csv(tokenizer, path, order=order)
+
+    def save(self, path: str):
+        table = [[list(context), token_id] for context, token_id in self.table.items()]
+        with open(path, 'w') as f:
+            json.dump({"order": self.order, "table": table}, f)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["order"], {tuple(context): token_id for context, token_id in data["table"]})
+
+    def next_token(self, history: list) -> int:
+        """
+        Returns the most frequent continuation of the longest known suffix of history.
+        """
+        for n in range(min(self.order - 1, len(history)), -1, -1):
+            token_id = self.table.get(tuple(history[len(history) - n:]))
+            if token_id is not None:
+                return token_id
+        return 0
+
+    def propose(self, histories: list, num_tokens: int) -> torch.Tensor:
+        """
+        Proposes the next num_tokens tokens for every row.
+        Args:
+            histories: list of list of int, the completion tokens generated so far for each row.
+            num_tokens: int, number of draft tokens.
+        Returns:
+            torch.Tensor: (batch, num_tokens) draft token IDs.
+        """
+        drafts = []
+        for history in histories:
+            history = list(history[-(self.order - 1):]) if self.order > 1 else []
+            draft = []
+            for _ in range(num_tokens):
+                token_id = self.next_token(history)
+                draft.append(token_id)
+                history.append(token_id)
+            drafts.append(draft)
+        return torch.tensor(drafts, dtype=torch.long)
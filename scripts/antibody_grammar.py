@@ -0,0 +1,182 @@
+from transformers import LogitsProcessor
+import torch
+import re
+import logging
+
+"""
+Grammar-constrained decoding for peleke completions of the form `HEAVY|LIGHT<|im_end|>`.
+Only amino-acid tokens, a single `|` separator and `<|im_end|>` can be generated, each chain is kept
+within length bounds, and a sequence ends as soon as its light chain is complete.
+"""
+
+logger = logging.getLogger(__name__)
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+END_TOKEN = "<|im_end|>"
+
+## Token classes
+OTHER, RESIDUES, LEADING_RESIDUES, SEPARATOR, END = 0, 1, 2, 3, 4
+
+## Grammar states
+HEAVY, LIGHT, DONE = 0, 1, 2
+
+
+class AntibodyGrammar:
+    """
+    Token-level grammar over a tokenizer's vocabulary.
+    Args:
+        tokenizer: the peleke tokenizer.
+        min_heavy, max_heavy: int, heavy chain length bounds (in residues).
+        min_light, max_light: int, light chain length bounds (in residues).
+    """
+    def __init__(
+            self,
+            tokenizer,
+            min_heavy: int=90,
+            max_heavy: int=150,
+            min_light: int=90,
+            max_light: int=130
+            ):
+        self.min_heavy = min_heavy
+        self.max_heavy = max_heavy
+        self.min_light = min_light
+        self.max_light = max_light
+
+        residues_pattern = re.compile(rf"^(\s?)([{AMINO_ACIDS}]+)$")
+        candidate_ids, token_classes, token_residues = [], [], []
+        single_residues = set()
+        for token, token_id in tokenizer.get_vocab().items():
+            text = tokenizer.convert_tokens_to_string([token])
+            m = residues_pattern.match(text)
+            if m:
+                if not m.group(1) and len(m.group(2)) == 1:
+                    single_residues.add(m.group(2))
+                candidate_ids.append(token_id)
+                ## A leading space is only allowed on the first heavy chain token (right after "Antibody:")
+                token_classes.append(LEADING_RESIDUES if m.group(1) else RESIDUES)
+                token_residues.append(len(m.group(2)))
+            elif text == "|":
+                candidate_ids.append(token_id)
+                token_classes.append(SEPARATOR)
+                token_residues.append(0)
+
+        end_token_id = tokenizer.convert_tokens_to_ids(END_TOKEN)
+        if end_token_id is None or end_token_id == tokenizer.unk_token_id:
+            end_token_id = tokenizer.eos_token_id
+        candidate_ids.append(end_token_id)
+        token_classes.append(END)
+        token_residues.append(0)
+
+        if SEPARATOR not in token_classes:
+            raise ValueError("The tokenizer has no `|` token.")
+        if len(single_residues) < len(AMINO_ACIDS):
+            logger.warning(f"Only {len(single_residues)} single amino acid tokens found; length bounds may not be exactly reachable.")
+
+        self.end_token_id = end_token_id
+        self.candidate_ids = torch.tensor(candidate_ids)
+        self.candidate_classes = torch.tensor(token_classes)
+        self.candidate_residues = torch.tensor(token_residues)
+
+        ## Lookup tables from vocabulary ID to candidate class/residue count
+        vocab_size = max(max(tokenizer.get_vocab().values()) + 1, len(tokenizer))
+        self.token_classes = torch.full((vocab_size,), OTHER, dtype=torch.long)
+        self.token_classes[self.candidate_ids] = self.candidate_classes
+        self.token_residues = torch.zeros(vocab_size, dtype=torch.long)
+        self.token_residues[self.candidate_ids] = self.candidate_residues
+
+        logger.info(f"Antibody grammar: {len(candidate_ids)} candidate tokens out of {vocab_size}.")
+
+    @property
+    def max_new_tokens(self) -> int:
+        """
+        Upper bound on the completion length in tokens (one residue per token, plus separator and end token).
+        """
+        return self.max_heavy + self.max_light + 2
+
+    def to(self, device):
+        for name in ["candidate_ids", "candidate_classes", "candidate_residues", "token_classes", "token_residues"]:
+            setattr(self, name, getattr(self, name).to(device))
+        return self
+
+    def initial_state(self, batch_size: int, device=None) -> tuple:
+        """
+        Returns:
+            tuple: (phase, chain_length) tensors of shape (batch,).
+        """
+        phase = torch.full((batch_size,), HEAVY, dtype=torch.long, device=device)
+        chain_length = torch.zeros(batch_size, dtype=torch.long, device=device)
+        return phase, chain_length
+
+    def allowed_candidates(self, phase: torch.Tensor, chain_length: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            phase, chain_length: grammar state of each row.
+        Returns:
+            torch.Tensor: (batch, n_candidates) boolean mask of the candidate tokens allowed next.
+        """
+        classes = self.candidate_classes[None, :]
+        next_length = chain_length[:, None] + self.candidate_residues[None, :]
+        is_residues = (classes == RESIDUES) | ((classes == LEADING_RESIDUES) & (chain_length[:, None] == 0))
+        in_heavy = (phase == HEAVY)[:, None]
+        in_light = (phase == LIGHT)[:, None]
+
+        heavy_allowed = (is_residues & (next_length <= self.max_heavy)) | ((classes == SEPARATOR) & (chain_length[:, None] >= self.min_heavy))
+        light_allowed = ((classes == RESIDUES) & (next_length <= self.max_light)) | ((classes == END) & (chain_length[:, None] >= self.min_light))
+        done_allowed = classes == END
+
+        allowed = torch.where(in_heavy, heavy_allowed, torch.where(in_light, light_allowed, done_allowed))
+        ## Never leave a row without options: fall back to closing the current chain
+        stuck = ~allowed.any(dim=-1, keepdim=True)
+        closing = torch.where(in_heavy, classes == SEPARATOR, classes == END)
+        return allowed | (stuck & closing)
+
+    def advance(self, phase: torch.Tensor, chain_length: torch.Tensor, tokens: torch.Tensor):
+        """
+        Updates the grammar state in place with the tokens just generated.
+        """
+        classes = self.token_classes[tokens]
+        chain_length += self.token_residues[tokens]
+        separated = (classes == SEPARATOR) & (phase == HEAVY)
+        phase[separated] = LIGHT
+        chain_length[separated] = 0
+        phase[classes == END] = DONE
+
+    def mask_logits(self, scores: torch.Tensor, phase: torch.Tensor, chain_length: torch.Tensor) -> torch.Tensor:
+        """
+        Masks full-vocabulary logits to the allowed candidates (for use inside model.generate()).
+        """
+        masked = torch.full_like(scores, float('-inf'))
+        allowed = self.allowed_candidates(phase, chain_length)
+        candidate_scores = scores[:, self.candidate_ids].masked_fill(~allowed, float('-inf'))
+        masked[:, self.candidate_ids] = candidate_scores
+        return masked
+
+    def candidate_logits(self, logits: torch.Tensor, phase: torch.Tensor, chain_length: torch.Tensor) -> torch.Tensor:
+        """
+        Gathers the logits of the candidate tokens only, with disallowed candidates masked.
+        Sampling from the result runs the softmax over the small candidate set instead of the full vocabulary.
+        Returns:
+            torch.Tensor: (batch, n_candidates) logits. Map sampled indices back with candidate_ids.
+        """
+        allowed = self.allowed_candidates(phase, chain_length)
+        return logits[:, self.candidate_ids].masked_fill(~allowed, float('-inf'))
+
+
+class AntibodyGrammarLogitsProcessor(LogitsProcessor):
+    """
+    Applies an AntibodyGrammar inside model.generate(). Create a new processor for every generate() call.
+    Args:
+        grammar: AntibodyGrammar.
+        prompt_length: int, length of the (padded) prompt, so the state only tracks generated tokens.
+    """
+    def __init__(self, grammar: AntibodyGrammar, prompt_length: int):
+        self.grammar = grammar
+        self.prompt_length = prompt_length
+        self.state = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self.state is None:
+            self.state = self.grammar.initial_state(input_ids.shape[0], device=input_ids.device)
+        if input_ids.shape[1] > self.prompt_length:
+            self.grammar.advance(*self.state, input_ids[:, -1])
+        return self.grammar.mask_logits(scores, *self.state)
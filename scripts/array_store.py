@@ -0,0 +1,154 @@
+import numpy as np
+import logging
+import json
+import os
+
+"""
+Append-only on-disk array store: a raw binary file of fixed-shape rows, memory-mapped for reading,
+with a JSONL index mapping each ID to its rows (offset, length) and any metadata.
+Entries are written incrementally, so a run can be interrupted and resumed; rows written after the
+last index line (an interrupted append) are dropped when the store is reopened.
+
+Layout of a store directory:
+    meta.json    {"row_shape": [...], "dtype": "...", ...}
+    data.bin     rows, concatenated in append order
+    index.jsonl  {"id": ..., "offset": ..., "length": ..., ...} per entry
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class ArrayStore:
+    """
+    Args:
+        directory: str, store directory. An existing store is reopened (row_shape and dtype are read from it).
+        row_shape: tuple, shape of one row (required for a new store).
+        dtype: str, numpy dtype of the rows.
+        **meta: extra metadata saved in meta.json for a new store (e.g., layers, heads, pooling).
+    """
+    def __init__(self, directory: str, row_shape: tuple=None, dtype: str="float32", **meta):
+        self.directory = directory
+        self.data_file = os.path.join(directory, "data.bin")
+        self.index_file = os.path.join(directory, "index.jsonl")
+        meta_file = os.path.join(directory, "meta.json")
+
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                self.meta = json.load(f)
+        else:
+            if row_shape is None:
+                raise ValueError(f"{directory} is not an array store; row_shape is needed to create one.")
+            os.makedirs(directory, exist_ok=True)
+            self.meta = {"row_shape": list(row_shape), "dtype": np.dtype(dtype).name, **meta}
+            with open(meta_file, 'w') as f:
+                json.dump(self.meta, f, indent=2)
+        self.row_shape = tuple(self.meta["row_shape"])
+        self.dtype = np.dtype(self.meta["dtype"])
+        self.row_nbytes = int(np.prod(self.row_shape, dtype=np.int64)) * self.dtype.itemsize
+
+        self.index = {}
+        self.n_rows = 0
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break
+                    entry = json.loads(line)
+                    self.index[entry["id"]] = entry
+                    self.n_rows = max(self.n_rows, entry["offset"] + entry["length"])
+        self._repair()
+        self._data = open(self.data_file, 'ab')
+        self._index = open(self.index_file, 'a')
+        self._memmap = None
+
+    def _repair(self):
+        """
+        Truncates rows and index lines left by an interrupted append.
+        """
+        if os.path.exists(self.data_file) and os.path.getsize(self.data_file) > self.n_rows * self.row_nbytes:
+            logger.warning(f"Dropping rows of an interrupted append in {self.data_file}.")
+            os.truncate(self.data_file, self.n_rows * self.row_nbytes)
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'rb+') as f:
+                content = f.read()
+                if content and not content.endswith(b"\n"):
+                    f.truncate(content.rfind(b"\n") + 1)
+
+    def __contains__(self, entry_id) -> bool:
+        return entry_id in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def ids(self) -> list:
+        return list(self.index)
+
+    def append(self, entry_id, rows: np.ndarray, **meta):
+        """
+        Appends an entry of one or more rows. The data is flushed before its index line is written.
+        Args:
+            entry_id: JSON-serializable ID (e.g., an antigen or sequence ID).
+            rows: np.ndarray, (n_rows, *row_shape) array.
+            **meta: JSON-serializable metadata stored in the entry's index line.
+        """
+        rows = np.ascontiguousarray(rows, dtype=self.dtype).reshape((-1, *self.row_shape))
+        if entry_id in self.index:
+            raise ValueError(f"{entry_id} is already in the store.")
+        self._data.write(rows.tobytes())
+        self._data.flush()
+        entry = {"id": entry_id, "offset": self.n_rows, "length": len(rows), **meta}
+        self._index.write(json.dumps(entry) + "\n")
+        self._index.flush()
+        self.index[entry_id] = entry
+        self.n_rows += len(rows)
+        self._memmap = None
+
+    def extend(self, entry_ids: list, rows: np.ndarray):
+        """
+        Appends one single-row entry per ID (e.g., a batch of embeddings) with one flush.
+        Args:
+            entry_ids: list of JSON-serializable IDs.
+            rows: np.ndarray, (len(entry_ids), *row_shape) array.
+        """
+        rows = np.ascontiguousarray(rows, dtype=self.dtype).reshape((-1, *self.row_shape))
+        if len(rows) != len(entry_ids):
+            raise ValueError(f"Got {len(entry_ids)} IDs for {len(rows)} rows.")
+        duplicates = [entry_id for entry_id in entry_ids if entry_id in self.index]
+        if duplicates or len(set(entry_ids)) != len(entry_ids):
+            raise ValueError(f"Duplicate IDs: {duplicates[:5]}")
+        self._data.write(rows.tobytes())
+        self._data.flush()
+        entries = [{"id": entry_id, "offset": self.n_rows + i, "length": 1} for i, entry_id in enumerate(entry_ids)]
+        self._index.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        self._index.flush()
+        self.index.update((entry["id"], entry) for entry in entries)
+        self.n_rows += len(rows)
+        self._memmap = None
+
+    def array(self) -> np.ndarray:
+        """
+        Returns all rows as a read-only memory map of shape (n_rows, *row_shape).
+        """
+        if self._memmap is None:
+            if self.n_rows == 0:
+                return np.empty((0, *self.row_shape), dtype=self.dtype)
+            self._memmap = np.memmap(self.data_file, dtype=self.dtype, mode='r', shape=(self.n_rows, *self.row_shape))
+        return self._memmap
+
+    def get(self, entry_id) -> np.ndarray:
+        """
+        Returns the rows of one entry (a view into the memory map).
+        """
+        entry = self.index[entry_id]
+        return self.array()[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,235 @@
+from peleke_generator import PelekeGenerator, format_prompt, PROMPT_END_TOKEN
+from array_store import ArrayStore
+from transformers import AttentionInterface
+from transformers.modeling_utils import ALL_ATTENTION_FUNCTIONS
+import pandas as pd
+import argparse
+import logging
+import torch
+import re
+
+"""
+Epitope-antibody attention analysis over an antigen panel (replaces scripts/old/analyze.py).
+Each generated antibody is teacher-forced after its antigen prompt, and for the selected layers and heads only,
+the attention of the antibody tokens (queries) to the epitope tokens (keys, the residues inside <epi></epi>)
+is computed from the query and key states inside a hook on the attention function. The full
+(layers x heads x seq x seq) attention tensors of output_attentions=True are never materialized.
+(In a causal model the epitope tokens come first, so the antibody tokens attend to them, not the other way round.)
+
+Per antigen, the attention is averaged over the tokens of each chain and over that antigen's sequences, and written
+to an ArrayStore with one row per epitope token of shape (2 chains, n_layers, n_heads).
+
+Usage:
+    python attention_analysis.py --model_name silicobio/peleke-phi-4 --sequences_file ../tests/generated_antibody_sequences.csv --layers -1 -2 --heads 0 1 2 3 --output_dir attention_maps
+"""
+
+## Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CAPTURE_ATTENTION = "peleke_capture"
+EPITOPE_PATTERN = re.compile(r'<epi>(.*?)</epi>')
+
+
+def epitope_token_positions(offsets: list, prompt: str) -> list:
+    """
+    Returns the indices of the tokens that overlap an epitope residue (the text inside <epi></epi>).
+    Args:
+        offsets: list of (start, end) character offsets of each token (tokenizer offset_mapping).
+        prompt: str, the formatted prompt.
+    """
+    spans = [m.span(1) for m in EPITOPE_PATTERN.finditer(prompt)]
+    return [i for i, (start, end) in enumerate(offsets) if end > start and any(start < span_end and end > span_start for span_start, span_end in spans)]
+
+
+class AttentionCapture:
+    """
+    Context manager that routes the model's attention through a wrapper around its attention implementation.
+    For the selected layers, the wrapper computes the attention probabilities of the selected heads for the
+    query rows and key columns set with select(), and keeps only those slices.
+    Args:
+        model: the (PEFT) causal LM.
+        layers: list of int, layer indices (negative indices count from the last layer).
+        heads: list of int, attention head indices (None for all heads).
+    """
+    def __init__(self, model, layers: list, heads: list=None):
+        self.model = model
+        config = model.config
+        n_layers = config.num_hidden_layers
+        self.layers = [layer % n_layers for layer in layers]
+        self.heads = heads if heads is not None else list(range(config.num_attention_heads))
+        self.selection = None
+        self.captured = {}
+
+    def select(self, attention_mask: torch.Tensor, query_positions: list, key_positions: list):
+        """
+        Sets the slices to keep for the next forward pass.
+        Args:
+            attention_mask: torch.Tensor, (batch, seq) padding mask of the batch.
+            query_positions: list of torch.Tensor, query (antibody token) positions of each row.
+            key_positions: list of torch.Tensor, key (epitope token) positions of each row.
+        """
+        self.selection = (attention_mask, query_positions, key_positions)
+        self.captured = {}
+
+    def _capture(self, module, query: torch.Tensor, key: torch.Tensor, scaling: float):
+        attention_mask, query_positions, key_positions = self.selection
+        heads = torch.tensor(self.heads, device=query.device)
+        kv_heads = heads // (query.shape[1] // key.shape[1])
+        scaling = scaling if scaling is not None else query.shape[-1] ** -0.5
+        slices = []
+        for row, (q_pos, k_pos) in enumerate(zip(query_positions, key_positions)):
+            q = query[row, heads][:, q_pos].float()
+            k = key[row, kv_heads].float()
+            scores = torch.einsum("hqd,hkd->hqk", q, k) * scaling
+            ## Causal and padding mask over all keys, so the softmax normalizes over the full context
+            allowed = (torch.arange(key.shape[2], device=key.device)[None, :] <= q_pos[:, None]) & attention_mask[row].bool()[None, :]
+            probs = scores.masked_fill(~allowed[None], float('-inf')).softmax(dim=-1)
+            slices.append(probs[:, :, k_pos])
+        self.captured[module.layer_idx] = slices
+
+    def __enter__(self):
+        self.original = self.model.config._attn_implementation
+        attention_function = ALL_ATTENTION_FUNCTIONS[self.original] if self.original in ALL_ATTENTION_FUNCTIONS else ALL_ATTENTION_FUNCTIONS["sdpa"]
+
+        def capture_attention(module, query, key, value, attention_mask, scaling=None, **kwargs):
+            if self.selection is not None and module.layer_idx in self.layers:
+                self._capture(module, query, key, scaling)
+            return attention_function(module, query, key, value, attention_mask, scaling=scaling, **kwargs)
+
+        AttentionInterface.register(CAPTURE_ATTENTION, capture_attention)
+        self._set_implementation(CAPTURE_ATTENTION)
+        return self
+
+    def __exit__(self, *exc):
+        self._set_implementation(self.original)
+
+    def _set_implementation(self, name: str):
+        if hasattr(self.model, "set_attn_implementation"):
+            self.model.set_attn_implementation(name)
+        else:
+            self.model.config._attn_implementation = name
+
+
+class EpitopeAttentionAnalyzer:
+    """
+    Runs the capture over batches of (antigen, antibody) pairs and aggregates per antigen.
+    Args:
+        generator: PelekeGenerator, the loaded model.
+        layers, heads: see AttentionCapture.
+    """
+    def __init__(self, generator: PelekeGenerator, layers: list, heads: list=None):
+        self.generator = generator
+        self.capture = AttentionCapture(generator.model, layers, heads)
+        self.separator_ids = set(generator.tokenizer("|", add_special_tokens=False)["input_ids"])
+
+    def epitope_tokens(self, antigen_sequence: str) -> list:
+        """
+        Returns the text of the epitope tokens of an antigen prompt (the rows of its attention map).
+        """
+        prompt = format_prompt(antigen_sequence)
+        encoding = self.generator.tokenizer(prompt, return_offsets_mapping=True)
+        return [prompt[start:end] for start, end in (encoding["offset_mapping"][i] for i in epitope_token_positions(encoding["offset_mapping"], prompt))]
+
+    @torch.no_grad()
+    def analyze_batch(self, antigen_sequences: list, antibody_sequences: list) -> list:
+        """
+        Args:
+            antigen_sequences: list of str, epitope-tagged antigen sequences.
+            antibody_sequences: list of str, `HEAVY|LIGHT` sequences.
+        Returns:
+            list of np.ndarray: (n_epitope_tokens, 2, n_layers, n_heads) mean attention of the heavy and light chain
+            tokens to each epitope token, for each pair.
+        """
+        tokenizer = self.generator.tokenizer
+        prompts = [format_prompt(antigen) for antigen in antigen_sequences]
+        texts = [f"{prompt} {antibody}{PROMPT_END_TOKEN}" for prompt, antibody in zip(prompts, antibody_sequences)]
+        inputs = tokenizer(texts, return_tensors="pt", padding=True, return_offsets_mapping=True)
+        offsets = inputs.pop("offset_mapping").tolist()
+        prompt_lengths = [len(ids) for ids in tokenizer(prompts)["input_ids"]]
+        seq_length = inputs["input_ids"].shape[1]
+
+        query_positions, key_positions, chain_masks = [], [], []
+        for row, prompt_length in enumerate(prompt_lengths):
+            n_pad = seq_length - int(inputs["attention_mask"][row].sum())
+            key_positions.append(torch.tensor([n_pad + i for i in epitope_token_positions(offsets[row][n_pad:n_pad + prompt_length], prompts[row])], dtype=torch.long))
+            ## Antibody tokens: everything after the prompt, up to (not including) the final <|im_end|>
+            positions = torch.arange(n_pad + prompt_length, seq_length - 1)
+            ids = inputs["input_ids"][row, positions].tolist()
+            separator = next((i for i, token_id in enumerate(ids) if token_id in self.separator_ids), len(ids))
+            query_positions.append(positions)
+            chain_masks.append(torch.arange(len(ids)) < separator)
+
+        device = self.generator.device
+        inputs = {k: v.to(device) for k, v in inputs.items()}
+        position_ids = (inputs["attention_mask"].long().cumsum(dim=-1) - 1).clamp(min=0)
+        self.capture.select(inputs["attention_mask"], [p.to(device) for p in query_positions], [p.to(device) for p in key_positions])
+        with self.capture:
+            self.generator.model(**inputs, position_ids=position_ids, use_cache=False)
+
+        maps = []
+        for row, is_heavy in enumerate(chain_masks):
+            ## (n_layers, n_heads, n_query, n_epitope) -> (n_epitope, 2, n_layers, n_heads)
+            attention = torch.stack([self.capture.captured[layer][row] for layer in self.capture.layers]).cpu()
+            heavy = attention[:, :, is_heavy].mean(dim=2) if is_heavy.any() else torch.zeros_like(attention[:, :, 0])
+            light = attention[:, :, ~is_heavy].mean(dim=2) if (~is_heavy).any() else torch.zeros_like(attention[:, :, 0])
+            maps.append(torch.stack([heavy, light]).permute(3, 0, 1, 2).numpy())
+        self.capture.selection = None
+        return maps
+
+    def run(self, pairs: pd.DataFrame, store: ArrayStore, batch_size: int=8):
+        """
+        Analyzes every antigen in pairs that is not yet in the store, and appends its aggregated map.
+        Args:
+            pairs: pd.DataFrame with `antigen`, `antigen_epitope_dict` and `generated_seq` columns.
+            store: ArrayStore with row shape (2, n_layers, n_heads).
+            batch_size: int, number of sequences per forward pass.
+        """
+        pairs = pairs[~pairs['antigen'].isin(store.ids)].copy()
+        pairs['length'] = pairs['antigen_epitope_dict'].str.len() + pairs['generated_seq'].str.len()
+        remaining = pairs['antigen'].value_counts().to_dict()
+        sums = {}
+        ## Sorted by length so that batches need little padding
+        pairs = pairs.sort_values('length')
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs.iloc[start:start + batch_size]
+            maps = self.analyze_batch(batch['antigen_epitope_dict'].tolist(), batch['generated_seq'].tolist())
+            for antigen_id, antigen_sequence, attention in zip(batch['antigen'], batch['antigen_epitope_dict'], maps):
+                sums[antigen_id] = sums.get(antigen_id, 0) + attention
+                remaining[antigen_id] -= 1
+                if remaining[antigen_id] == 0:
+                    n_sequences = int((pairs['antigen'] == antigen_id).sum())
+                    epitope_tokens = self.epitope_tokens(antigen_sequence)
+                    store.append(antigen_id, sums.pop(antigen_id) / n_sequences, n_sequences=n_sequences, epitope_tokens=epitope_tokens)
+                    logger.info(f"{antigen_id}: {n_sequences} sequences, {len(epitope_tokens)} epitope tokens.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Epitope-antibody attention maps for an antigen panel.")
+    parser.add_argument("--model_name", type=str, default="silicobio/peleke-phi-4", help="Hugging Face ID or path of the peleke adapter.")
+    parser.add_argument("--device", type=str, default="auto", help="Device to run the model on ('auto', 'cpu', 'cuda', ...).")
+    parser.add_argument("--sequences_file", type=str, default="../tests/generated_antibody_sequences.csv", help="A .csv with `antigen`, `antigen_epitope_dict` and `generated_seq` columns.")
+    parser.add_argument("--layers", type=int, nargs="+", default=[-1], help="Layers to capture (negative indices count from the last layer).")
+    parser.add_argument("--heads", type=int, nargs="+", default=None, help="Attention heads to capture (default: all).")
+    parser.add_argument("--batch_size", type=int, default=8, help="Sequences per forward pass.")
+    parser.add_argument("--output_dir", type=str, default="attention_maps", help="Array store directory (resumed if it exists).")
+    args = parser.parse_args()
+
+    generator = PelekeGenerator(args.model_name, device=args.device)
+    analyzer = EpitopeAttentionAnalyzer(generator, args.layers, args.heads)
+    pairs = pd.read_csv(args.sequences_file).dropna(subset=['generated_seq'])
+    with ArrayStore(
+        args.output_dir,
+        row_shape=(2, len(analyzer.capture.layers), len(analyzer.capture.heads)),
+        dtype="float32",
+        axes=["epitope_token", "chain (heavy, light)", "layer", "head"],
+        layers=analyzer.capture.layers,
+        heads=analyzer.capture.heads,
+        model_name=args.model_name
+    ) as store:
+        analyzer.run(pairs, store, batch_size=args.batch_size)
+        logger.info(f"{len(store)} antigens in {args.output_dir}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+from peleke_generator import PelekeGenerator, format_prompt
+from inference_backend import configure_cpu_backend
+import pandas as pd
+import argparse
+import logging
+import json
+import time
+import torch
+
+"""
+CPU inference benchmark: weights dtype / int8 quantization against intra-op thread counts.
+For every configuration, reports the prefill latency of one prompt, the latency of one full sequence,
+and the decode throughput (tokens/sec) of a batch. Works with a tiny model, e.g.:
+    python benchmark_cpu.py --model_name path/to/tiny-model --precisions float32 bfloat16 int8 --threads 1 4 --max_new_tokens 32
+"""
+
+## Set up logging
+logging.basicConfig(level=logging.INFO)
+
+PRECISIONS = {
+    "float32": (torch.float32, None),
+    "bfloat16": (torch.bfloat16, None),
+    "int8": (torch.float32, "int8"),
+}
+
+
+@torch.no_grad()
+def benchmark_config(generator: PelekeGenerator, antigens: list, batch_size: int, max_new_tokens: int, repeats: int) -> dict:
+    """
+    Times prefill, single-sequence latency and batched decode throughput with a loaded generator.
+    Every sequence runs for exactly max_new_tokens so configurations generate the same work.
+    """
+    generator.model.generation_config.min_new_tokens = max_new_tokens
+    inputs = generator.tokenizer(format_prompt(antigens[0]), return_tensors="pt").to(generator.device)
+
+    prefill_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        generator.model(**inputs, use_cache=True)
+        prefill_times.append(time.perf_counter() - start)
+
+    latency_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        generator.generate_batch([antigens[0]], n=1, max_new_tokens=max_new_tokens)
+        latency_times.append(time.perf_counter() - start)
+
+    batch = (antigens * batch_size)[:batch_size]
+    start = time.perf_counter()
+    for _ in range(repeats):
+        generator.generate_batch(batch, n=1, max_new_tokens=max_new_tokens)
+    batch_seconds = (time.perf_counter() - start) / repeats
+
+    return {
+        "prefill_ms": 1000 * min(prefill_times),
+        "sequence_latency_s": min(latency_times),
+        "single_stream_tok_s": max_new_tokens / min(latency_times),
+        "batch_tok_s": batch_size * max_new_tokens / batch_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Benchmark CPU inference settings.")
+    parser.add_argument("--model_name", type=str, default="silicobio/peleke-phi-4", help="Hugging Face ID or path of the peleke adapter (or a tiny test model).")
+    parser.add_argument("--antigens_file", type=str, default="../tests/generated_antibody_sequences.csv", help="A .csv with an `antigen_epitope_dict` column.")
+    parser.add_argument("--precisions", type=str, nargs="+", default=["bfloat16", "int8"], choices=list(PRECISIONS), help="Weight precisions to compare.")
+    parser.add_argument("--threads", type=int, nargs="+", default=[torch.get_num_threads()], help="Intra-op thread counts to compare.")
+    parser.add_argument("--num_interop_threads", type=int, default=None, help="CPU inter-op threads (fixed for the whole run).")
+    parser.add_argument("--numa_node", type=int, default=None, help="Pin the process to this NUMA node's CPUs.")
+    parser.add_argument("--batch_size", type=int, default=8, help="Batch size for the throughput measurement.")
+    parser.add_argument("--max_new_tokens", type=int, default=64, help="Number of new tokens per sequence.")
+    parser.add_argument("--repeats", type=int, default=3, help="Repeats per measurement.")
+    parser.add_argument("--output_file", type=str, default=None, help="Optional .json file for the results.")
+    args = parser.parse_args()
+
+    antigens = pd.read_csv(args.antigens_file)['antigen_epitope_dict'].drop_duplicates().tolist()
+
+    results = []
+    for precision in args.precisions:
+        torch_dtype, quantization = PRECISIONS[precision]
+        configure_cpu_backend(args.threads[0], args.num_interop_threads, args.numa_node)
+        generator = PelekeGenerator(args.model_name, device="cpu", torch_dtype=torch_dtype, quantization=quantization)
+        ## Warm up
+        generator.generate_batch([antigens[0]], n=1, max_new_tokens=2)
+        for num_threads in args.threads:
+            torch.set_num_threads(num_threads)
+            result = {"precision": precision, "num_threads": num_threads}
+            result.update(benchmark_config(generator, antigens, args.batch_size, args.max_new_tokens, args.repeats))
+            results.append(result)
+            print(
+                f"{precision:>9} | {num_threads:>3} threads | prefill {result['prefill_ms']:8.1f} ms | "
+                f"sequence {result['sequence_latency_s']:7.2f} s ({result['single_stream_tok_s']:7.1f} tok/s) | "
+                f"batch of {args.batch_size}: {result['batch_tok_s']:8.1f} tok/s"
+            )
+        del generator
+
+    if args.output_file:
+        with open(args.output_file, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+from peleke_generator import PelekeGenerator, cache_nbytes, fork_cache
+from sequence_trie import SequenceTrie
+from antibody_draft import NGramDraftModel
+from transformers import DynamicCache
+import pandas as pd
+import argparse
+import logging
+import time
+import torch
+
+"""
+Benchmarks for the generation engine. Works on CPU with a tiny model, e.g.:
+    python benchmark_generation.py --model_name path/to/tiny-model --device cpu --n_antigens 4 --n_per_antigen 4 --max_new_tokens 32
+Modes:
+    - loop: batched, length-bucketed generation (KV cache on) against the one-antigen-at-a-time loop from generate.ipynb.
+      Reports sequences/sec for each method and the speedup of the batched engine.
+    - shared_prefix: per-antigen latency and peak memory of the shared-prefix KV fork against plain num_return_sequences,
+      and the fork's KV-cache size after prefill and after the first decode step (when the streams stop sharing it).
+    - speculative: shared-prefix sampling with and without the n-gram draft model (--draft_file); reports tokens/sec,
+      draft acceptance rate, tokens per forward pass and the speedup.
+    - crop: full antigen prompts against prompts cropped around the epitope (--crop_flank, --prompt_token_budget);
+      reports prompt tokens, prefill time and shared-prefix generation time per antigen.
+    - dedup: shared-prefix sampling with and without restarting streams that repeat an earlier sample;
+      reports distinct antibodies per second (and per CPU-second) and the duplicate rate.
+"""
+
+## Set up logging
+logging.basicConfig(level=logging.INFO)
+
+
+@torch.no_grad()
+def generate_loop(generator: PelekeGenerator, antigens: dict, n_per_antigen: int, max_new_tokens: int, temperature: float) -> int:
+    """
+    The generate.ipynb loop: one prompt and one sample per generate() call, with the KV cache off.
+    Returns:
+        int: number of sequences generated.
+    """
+    n_sequences = 0
+    for antigen in antigens.values():
+        inputs = generator.tokenizer(generator.format_prompt(antigen), return_tensors="pt")
+        inputs = {k: v.to(generator.device) for k, v in inputs.items()}
+        for _ in range(n_per_antigen):
+            generator.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=True,
+                temperature=temperature,
+                pad_token_id=generator.pad_token_id,
+                use_cache=False,
+            )
+            n_sequences += 1
+    return n_sequences
+
+
+def time_method(fn, device: str) -> float:
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    fn()
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def peak_memory_mb(device: str) -> float:
+    if device.startswith("cuda"):
+        return torch.cuda.max_memory_allocated() / 2**20
+    return float('nan')
+
+
+def reset_peak_memory(device: str):
+    if device.startswith("cuda"):
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats()
+
+
+@torch.no_grad()
+def compare_shared_prefix(generator: PelekeGenerator, antigens: dict, n_per_antigen: int, max_new_tokens: int, temperature: float, device: str):
+    """
+    Times each antigen with num_return_sequences and with the shared-prefix fork, and reports peak memory
+    (CUDA only) and the KV-cache size of the fork after prefill and after the first decode step.
+    The fork saves prefill compute; its memory is only shared until each stream appends a token.
+    """
+    print(f"{'antigen':<12} {'prompt_tokens':>13} {'nrs_s':>8} {'shared_s':>8} {'nrs_peak_mb':>11} {'shared_peak_mb':>14} {'prefill_kv_mb':>13} {'step1_kv_mb':>11}")
+    for antigen_id, antigen in antigens.items():
+        reset_peak_memory(device)
+        nrs_seconds = time_method(lambda: generator.generate_batch([antigen], n=n_per_antigen, max_new_tokens=max_new_tokens, temperature=temperature), device)
+        nrs_peak = peak_memory_mb(device)
+
+        reset_peak_memory(device)
+        shared_seconds = time_method(lambda: generator.generate_shared_prefix(antigen, n=n_per_antigen, max_new_tokens=max_new_tokens, temperature=temperature), device)
+        shared_peak = peak_memory_mb(device)
+
+        ## KV cache of the fork: one prompt copy after prefill, one per stream once DynamicCache appends the first token
+        inputs = generator.tokenizer(generator.format_prompt(antigen), return_tensors="pt").to(generator.device)
+        outputs = generator.model(**inputs, past_key_values=DynamicCache(), use_cache=True)
+        prefill_kv_mb = cache_nbytes(outputs.past_key_values) / 2**20
+        past_key_values = fork_cache(outputs.past_key_values, n_per_antigen)
+        attention_mask = torch.cat([inputs["attention_mask"], inputs["attention_mask"].new_ones((1, 1))], dim=-1).expand(n_per_antigen, -1)
+        outputs = generator.model(
+            input_ids=outputs.logits[:, -1, :].argmax(dim=-1, keepdim=True).expand(n_per_antigen, -1),
+            attention_mask=attention_mask,
+            position_ids=attention_mask.long().sum(dim=-1, keepdim=True) - 1,
+            past_key_values=past_key_values,
+            use_cache=True
+        )
+        step1_kv_mb = cache_nbytes(outputs.past_key_values) / 2**20
+
+        print(f"{str(antigen_id):<12} {inputs['input_ids'].shape[1]:>13} {nrs_seconds:>8.2f} {shared_seconds:>8.2f} {nrs_peak:>11.1f} {shared_peak:>14.1f} {prefill_kv_mb:>13.2f} {step1_kv_mb:>11.2f}")
+
+
+@torch.no_grad()
+def compare_speculative(generator: PelekeGenerator, antigens: dict, n_per_antigen: int, max_new_tokens: int, temperature: float, device: str):
+    """
+    Times each antigen with plain shared-prefix sampling and with speculative decoding.
+    Both sample from the same distribution, so throughput is compared in generated tokens per second.
+    """
+    def count_tokens(chains: list) -> int:
+        return sum(len(ids) + 1 for ids in generator.tokenizer([f"{h}|{l}" for h, l in chains], add_special_tokens=False)["input_ids"])
+
+    totals = {"plain": [0, 0.0], "speculative": [0, 0.0]}
+    print(f"{'antigen':<12} {'plain_tok_s':>11} {'spec_tok_s':>10} {'acceptance':>10} {'tok_per_step':>12} {'speedup':>7}")
+    for antigen_id, antigen in antigens.items():
+        tokens_per_second = {}
+        generator.speculative_stats = {key: 0 for key in generator.speculative_stats}
+        for method in ["plain", "speculative"]:
+            chains = []
+            seconds = time_method(lambda: chains.extend(generator.generate_shared_prefix(
+                antigen, n=n_per_antigen, max_new_tokens=max_new_tokens, temperature=temperature, speculative=method == "speculative"
+            )), device)
+            n_tokens = count_tokens(chains)
+            tokens_per_second[method] = n_tokens / seconds
+            totals[method][0] += n_tokens
+            totals[method][1] += seconds
+        report = generator.speculative_report()
+        print(f"{str(antigen_id):<12} {tokens_per_second['plain']:>11.1f} {tokens_per_second['speculative']:>10.1f} {report['acceptance_rate']:>10.2f} {report['tokens_per_step']:>12.2f} {tokens_per_second['speculative'] / tokens_per_second['plain']:>6.2f}x")
+
+    plain_rate, speculative_rate = (totals[m][0] / totals[m][1] for m in ["plain", "speculative"])
+    print(f"Overall: {plain_rate:.1f} -> {speculative_rate:.1f} tok/s ({speculative_rate / plain_rate:.2f}x)")
+
+
+@torch.no_grad()
+def compare_crop(generator: PelekeGenerator, antigens: dict, n_per_antigen: int, max_new_tokens: int, temperature: float, device: str, crop_flank: int, prompt_token_budget: int):
+    """
+    Times the prompt prefill and shared-prefix generation of each antigen with the full and the cropped prompt.
+    Generations run to max_new_tokens (stop tokens are masked), so only the prompt length differs.
+    """
+    print(f"{'antigen':<12} {'full_tokens':>11} {'crop_tokens':>11} {'full_prefill_s':>14} {'crop_prefill_s':>14} {'full_gen_s':>10} {'crop_gen_s':>10}")
+    totals = {"full_tokens": 0, "crop_tokens": 0, "full_prefill": 0.0, "crop_prefill": 0.0, "full_gen": 0.0, "crop_gen": 0.0}
+    for antigen_id, antigen in antigens.items():
+        row = {}
+        for method, (flank, budget) in [("full", (None, None)), ("crop", (crop_flank, prompt_token_budget))]:
+            generator.crop_flank, generator.prompt_token_budget = flank, budget
+            inputs = generator.tokenizer(generator.format_prompt(antigen), return_tensors="pt").to(generator.device)
+            row[f"{method}_tokens"] = inputs["input_ids"].shape[1]
+            row[f"{method}_prefill"] = time_method(lambda: generator.model(**inputs, past_key_values=DynamicCache(), use_cache=True), device)
+            row[f"{method}_gen"] = time_method(lambda: generator.generate_shared_prefix(antigen, n=n_per_antigen, max_new_tokens=max_new_tokens, temperature=temperature, min_new_tokens=max_new_tokens), device)
+        for key, value in row.items():
+            totals[key] += value
+        print(f"{str(antigen_id):<12} {row['full_tokens']:>11} {row['crop_tokens']:>11} {row['full_prefill']:>14.3f} {row['crop_prefill']:>14.3f} {row['full_gen']:>10.2f} {row['crop_gen']:>10.2f}")
+
+    print(f"Prompt tokens: {totals['full_tokens']} -> {totals['crop_tokens']} ({1 - totals['crop_tokens'] / totals['full_tokens']:.0%} shorter)")
+    print(f"Prefill: {totals['full_prefill']:.3f} -> {totals['crop_prefill']:.3f} s ({1 - totals['crop_prefill'] / totals['full_prefill']:.0%} less); "
+          f"generation: {totals['full_gen']:.2f} -> {totals['crop_gen']:.2f} s ({1 - totals['crop_gen'] / totals['full_gen']:.0%} less)")
+
+
+@torch.no_grad()
+def compare_dedup(generator: PelekeGenerator, antigens: dict, n_per_antigen: int, max_new_tokens: int, temperature: float, device: str):
+    """
+    Samples n_per_antigen antibodies per antigen with plain shared-prefix sampling (duplicates removed
+    afterwards) and with trie deduplication, and compares the distinct antibodies per second.
+    """
+    totals = {method: {"unique": 0, "seconds": 0.0, "cpu_seconds": 0.0} for method in ["plain", "dedup"]}
+    print(f"{'antigen':<12} {'plain_unique':>12} {'plain_s':>8} {'dedup_unique':>12} {'dedup_s':>8} {'restarts':>8} {'speedup':>7}")
+    for antigen_id, antigen in antigens.items():
+        row = {}
+        generator.dedup_stats = {key: 0 for key in generator.dedup_stats}
+        for method in ["plain", "dedup"]:
+            chains = []
+            cpu_start = time.process_time()
+            seconds = time_method(lambda: chains.extend(generator.generate_shared_prefix(
+                antigen, n=n_per_antigen, max_new_tokens=max_new_tokens, temperature=temperature, trie=SequenceTrie() if method == "dedup" else None
+            )), device)
+            totals[method]["cpu_seconds"] += time.process_time() - cpu_start
+            totals[method]["seconds"] += seconds
+            totals[method]["unique"] += len(set(chains))
+            row[method] = (len(set(chains)), seconds)
+        speedup = (row["dedup"][0] / row["dedup"][1]) / (row["plain"][0] / row["plain"][1])
+        print(f"{str(antigen_id):<12} {row['plain'][0]:>12} {row['plain'][1]:>8.2f} {row['dedup'][0]:>12} {row['dedup'][1]:>8.2f} {generator.dedup_stats['restarts']:>8} {speedup:>6.2f}x")
+
+    for method, total in totals.items():
+        print(f"{method}: {total['unique']} unique in {total['seconds']:.2f} s = {total['unique'] / total['seconds']:.2f} unique/s "
+              f"({total['unique'] / total['cpu_seconds']:.2f} per CPU-second)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Benchmark batched generation against the sequential loop.")
+    parser.add_argument("--mode", type=str, default="loop", choices=["loop", "shared_prefix", "speculative", "crop", "dedup"], help="Which comparison to run.")
+    parser.add_argument("--model_name", type=str, default="silicobio/peleke-phi-4", help="Hugging Face ID or path of the peleke adapter (or a tiny test model).")
+    parser.add_argument("--device", type=str, default="auto", help="Device to run generation on ('auto', 'cpu', 'cuda', ...).")
+    parser.add_argument("--antigens_file", type=str, default="../tests/generated_antibody_sequences.csv", help="A .csv with `antigen` and `antigen_epitope_dict` columns.")
+    parser.add_argument("--n_antigens", type=int, default=4, help="Number of antigens from the file to benchmark.")
+    parser.add_argument("--n_per_antigen", type=int, default=4, help="Number of antibodies to generate per antigen.")
+    parser.add_argument("--batch_size", type=int, default=16, help="Maximum number of sequences decoded together.")
+    parser.add_argument("--max_new_tokens", type=int, default=64, help="Maximum number of new tokens to generate.")
+    parser.add_argument("--temperature", type=float, default=0.7, help="Temperature for sampling.")
+    parser.add_argument("--skip_loop", action="store_true", help="Only time the batched engine.")
+    parser.add_argument("--draft_file", type=str, default=None, help="Speculative mode: saved draft model (.json) or training .csv with `antibody_fv_seqs`.")
+    parser.add_argument("--draft_order", type=int, default=6, help="N-gram order of a draft model trained from a .csv.")
+    parser.add_argument("--num_draft_tokens", type=int, default=4, help="Draft tokens verified per forward pass.")
+    parser.add_argument("--crop_flank", type=int, default=16, help="Crop mode: residues kept on either side of each epitope residue.")
+    parser.add_argument("--prompt_token_budget", type=int, default=None, help="Crop mode: narrow the flank until each prompt fits this many tokens.")
+    args = parser.parse_args()
+
+    antigens_df = pd.read_csv(args.antigens_file)[['antigen', 'antigen_epitope_dict']].drop_duplicates(subset='antigen')
+    antigens = dict(zip(antigens_df['antigen'], antigens_df['antigen_epitope_dict']))
+    antigens = dict(list(antigens.items())[:args.n_antigens])
+    n_sequences = len(antigens) * args.n_per_antigen
+
+    generator = PelekeGenerator(args.model_name, device=args.device, num_draft_tokens=args.num_draft_tokens)
+    if args.draft_file:
+        generator.draft_model = NGramDraftModel.from_file(generator.tokenizer, args.draft_file, order=args.draft_order)
+
+    ## Warm up
+    generator.generate_batch([next(iter(antigens.values()))], n=1, max_new_tokens=2)
+
+    if args.mode == "shared_prefix":
+        compare_shared_prefix(generator, antigens, args.n_per_antigen, args.max_new_tokens, args.temperature, generator.device)
+        return
+    if args.mode == "crop":
+        compare_crop(generator, antigens, args.n_per_antigen, args.max_new_tokens, args.temperature, generator.device, args.crop_flank, args.prompt_token_budget)
+        return
+    if args.mode == "dedup":
+        compare_dedup(generator, antigens, args.n_per_antigen, args.max_new_tokens, args.temperature, generator.device)
+        return
+    if args.mode == "speculative":
+        compare_speculative(generator, antigens, args.n_per_antigen, args.max_new_tokens, args.temperature, generator.device)
+        return
+
+    ## The same number of tokens is generated by both methods so the comparison is fair
+    generator.model.generation_config.min_new_tokens = args.max_new_tokens
+
+    batched_seconds = time_method(lambda: generator.generate_many(
+        antigens,
+        n_per_antigen=args.n_per_antigen,
+        batch_size=args.batch_size,
+        max_new_tokens=args.max_new_tokens,
+        temperature=args.temperature
+    ), generator.device)
+    print(f"Batched (KV cache):  {n_sequences} sequences in {batched_seconds:.2f}s = {n_sequences / batched_seconds:.2f} seq/s")
+
+    if not args.skip_loop:
+        loop_seconds = time_method(lambda: generate_loop(
+            generator, antigens, args.n_per_antigen, args.max_new_tokens, args.temperature
+        ), generator.device)
+        print(f"Loop (no KV cache):  {n_sequences} sequences in {loop_seconds:.2f}s = {n_sequences / loop_seconds:.2f} seq/s")
+        print(f"Speedup: {loop_seconds / batched_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import logging
+import json
+import uuid
+import csv
+import os
+
+"""
+Append-only JSONL writer for generation campaigns.
+Every generated antibody is written (and flushed) as soon as its batch completes, and a checkpoint line
+marks each (model, antigen) pair whose sequences are all on disk. After a crash, reopening the file skips the
+checkpointed antigens; records of an antigen that was interrupted before its checkpoint are ignored
+when reading, because every line carries the ID of the run that wrote it.
+
+Line types:
+    {"type": "sequence", "run": ..., "antigen": ..., "generated_seq_id": ..., "h_chain": ..., "l_chain": ..., "params": {...}, "timings": {...}, ...}
+    {"type": "checkpoint", "run": ..., "model": ..., "antigen": ..., "n": ...}
+"""
+
+logger = logging.getLogger(__name__)
+
+CSV_COLUMNS = ['antigen', 'antigen_epitope_dict', 'model', 'generated_seq_id', 'generated_seq', 'h_chain', 'l_chain']
+
+
+def _read_lines(output_file: str):
+    """
+    Yields the parsed lines of a campaign file one at a time, skipping a truncated last line.
+    """
+    with open(output_file) as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            yield json.loads(line)
+
+
+def completed_runs(output_file: str) -> dict:
+    """
+    Returns a mapping of checkpointed (model, antigen ID) pairs to the run that completed them.
+    """
+    completed = {}
+    if os.path.exists(output_file):
+        for record in _read_lines(output_file):
+            if record["type"] == "checkpoint":
+                completed[(record["model"], record["antigen"])] = record["run"]
+    return completed
+
+
+def iter_records(output_file: str):
+    """
+    Streams the sequence records of checkpointed antigens (interrupted, partial antigens are skipped).
+    Only the (model, antigen) -> run map is held in memory.
+    """
+    completed = completed_runs(output_file)
+    for record in _read_lines(output_file):
+        if record["type"] == "sequence" and completed.get((record["model"], record["antigen"])) == record["run"]:
+            yield record
+
+
+def export_csv(output_file: str, csv_file: str) -> int:
+    """
+    Streams a campaign file into a .csv with the columns of tests/generated_antibody_sequences.csv (plus h_chain and l_chain).
+    Returns:
+        int: number of rows written.
+    """
+    n_rows = 0
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        for record in iter_records(output_file):
+            writer.writerow(record)
+            n_rows += 1
+    return n_rows
+
+
+class CampaignWriter:
+    """
+    Append-only, resumable campaign file.
+    Args:
+        output_file: str, path to the .jsonl file. An existing file is resumed.
+    """
+    def __init__(self, output_file: str):
+        self.output_file = output_file
+        self.run_id = uuid.uuid4().hex[:12]
+        self.completed = set(completed_runs(output_file))
+        self._truncate_partial_line()
+        self.file = open(output_file, 'a')
+        if self.completed:
+            logger.info(f"Resuming {output_file}: {len(self.completed)} (model, antigen) pairs already completed.")
+
+    def _truncate_partial_line(self):
+        """
+        Drops a half-written last line left by a crash, so new lines start on a fresh line.
+        """
+        if not os.path.exists(self.output_file):
+            return
+        with open(self.output_file, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            position = size
+            while position > 0:
+                f.seek(position - 1)
+                if f.read(1) == b"\n":
+                    break
+                position -= 1
+            if position < size:
+                logger.warning(f"Dropping a truncated last line of {self.output_file}.")
+                f.truncate(position)
+
+    def is_done(self, model: str, antigen_id) -> bool:
+        return (model, antigen_id) in self.completed
+
+    def write(self, records: list):
+        """
+        Appends sequence records and flushes them to the OS.
+        """
+        for record in records:
+            self.file.write(json.dumps({"type": "sequence", "run": self.run_id, **record}) + "\n")
+        self.file.flush()
+
+    def checkpoint(self, model: str, antigen_id, n_records: int):
+        """
+        Marks an antigen as complete for a model. The file is fsynced first, so a checkpoint never precedes its records on disk.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.write(json.dumps({"type": "checkpoint", "run": self.run_id, "model": model, "antigen": antigen_id, "n": n_records}) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.completed.add((model, antigen_id))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,128 @@
+from peleke_generator import PelekeGenerator
+from array_store import ArrayStore
+import pandas as pd
+import argparse
+import hashlib
+import logging
+import time
+
+"""
+Embeds antibody heavy/light pairs with a peleke model for diversity analysis and clustering.
+Each sequence is stored as a (2, hidden_size) float16 row (mean-pooled heavy and light chain hidden states)
+in a memory-mapped ArrayStore with an ID index. The input .csv is read in chunks and sequences already in
+the store are skipped, so 100k+ sequence sets can be embedded incrementally and resumed.
+IDs must be unique per sequence: a file whose ID column maps one ID to different sequences is rejected
+(e.g., `pdb_id` in the SAbDab dataset, which has several antibody pairs per entry; the sequence itself can serve as ID).
+
+Usage:
+    python embed.py --sequences_file ../tests/generated_antibody_sequences.csv --output_dir embeddings/generated
+    python embed.py --sequences_file ../data/sabdab/sabdab_training_dataset.csv --id_column antibody_fv_seqs --sequence_column antibody_fv_seqs --output_dir embeddings/training
+
+Reading the vectors back:
+    store = ArrayStore("embeddings/generated")
+    vectors = store.array()   # (n_sequences, 2, hidden_size) memory map, in store.ids order
+"""
+
+## Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def find_conflicting_ids(sequences_file: str, id_column: str, sequence_column: str, chunk_size: int=10000) -> dict:
+    """
+    Finds IDs that label more than one distinct sequence (rows repeating the same ID and sequence are fine).
+    The .csv is streamed in chunks and only a digest of each ID's sequence is kept, not the sequences.
+    Returns:
+        dict: number of distinct sequences of each conflicting ID.
+    """
+    if id_column == sequence_column:
+        return {}
+    digests, conflicts = {}, {}
+    for chunk in pd.read_csv(sequences_file, usecols=list(dict.fromkeys([id_column, sequence_column])), chunksize=chunk_size):
+        chunk = chunk.dropna()
+        for seq_id, sequence in zip(chunk[id_column], chunk[sequence_column]):
+            digest = hashlib.sha1(sequence.encode()).digest()
+            first = digests.setdefault(seq_id, digest)
+            if first != digest:
+                conflicts.setdefault(seq_id, {first}).add(digest)
+    return {seq_id: len(seen) for seq_id, seen in conflicts.items()}
+
+
+def embed_file(
+        generator: PelekeGenerator,
+        sequences_file: str,
+        store: ArrayStore,
+        id_column: str="generated_seq_id",
+        sequence_column: str="generated_seq",
+        batch_size: int=32,
+        chunk_size: int=10000,
+        layer: int=None
+        ) -> int:
+    """
+    Embeds every sequence of a .csv that is not yet in the store.
+    Each chunk of rows is sorted by sequence length and embedded in batches, and each batch is appended
+    to the store before the next one runs.
+    Returns:
+        int: number of sequences embedded by this call.
+    Raises:
+        ValueError: if an ID labels more than one sequence (see find_conflicting_ids()).
+    """
+    conflicts = find_conflicting_ids(sequences_file, id_column, sequence_column, chunk_size=chunk_size)
+    if len(conflicts):
+        examples = ', '.join(f"{seq_id} ({n} sequences)" for seq_id, n in list(conflicts.items())[:5])
+        logger.error(f"{len(conflicts)} IDs in {id_column} label more than one sequence, e.g. {examples}.")
+        raise ValueError(f"{id_column} is not a unique sequence ID in {sequences_file}; choose another --id_column.")
+    n_embedded, start = 0, time.perf_counter()
+    for chunk in pd.read_csv(sequences_file, usecols=list(dict.fromkeys([id_column, sequence_column])), chunksize=chunk_size):
+        chunk = chunk.dropna().drop_duplicates(subset=id_column)
+        chunk = chunk[~chunk[id_column].isin(store.ids)]
+        chunk = chunk.assign(length=chunk[sequence_column].str.len()).sort_values('length')
+        for batch_start in range(0, len(chunk), batch_size):
+            batch = chunk.iloc[batch_start:batch_start + batch_size]
+            embeddings = generator.embed_batch(batch[sequence_column].tolist(), layer=layer).numpy()
+            store.extend(batch[id_column].tolist(), embeddings)
+            n_embedded += len(batch)
+        if n_embedded:
+            logger.info(f"{len(store)} sequences in the store ({n_embedded / (time.perf_counter() - start):.1f} seq/s).")
+    return n_embedded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Embed antibody sequences into a memory-mapped vector store.")
+    parser.add_argument("--model_name", type=str, default="silicobio/peleke-phi-4", help="Hugging Face ID or path of the peleke adapter.")
+    parser.add_argument("--device", type=str, default="auto", help="Device to run the model on ('auto', 'cpu', 'cuda', ...).")
+    parser.add_argument("--sequences_file", type=str, required=True, help="A .csv with an ID column and a `HEAVY|LIGHT` sequence column.")
+    parser.add_argument("--id_column", type=str, default="generated_seq_id", help="Column with unique sequence IDs.")
+    parser.add_argument("--sequence_column", type=str, default="generated_seq", help="Column with `HEAVY|LIGHT` sequences.")
+    parser.add_argument("--layer", type=int, default=None, help="Decoder layer to pool (default: the final hidden states).")
+    parser.add_argument("--batch_size", type=int, default=32, help="Sequences per forward pass.")
+    parser.add_argument("--chunk_size", type=int, default=10000, help="Rows of the .csv read (and length-sorted) at a time.")
+    parser.add_argument("--output_dir", type=str, required=True, help="Array store directory (resumed if it exists).")
+    args = parser.parse_args()
+
+    generator = PelekeGenerator(args.model_name, device=args.device)
+    hidden_size = generator.model.config.hidden_size
+    with ArrayStore(
+        args.output_dir,
+        row_shape=(2, hidden_size),
+        dtype="float16",
+        axes=["chain (heavy, light)", "hidden"],
+        pooling="mean",
+        layer=args.layer,
+        model_name=args.model_name
+    ) as store:
+        n_embedded = embed_file(
+            generator,
+            args.sequences_file,
+            store,
+            id_column=args.id_column,
+            sequence_column=args.sequence_column,
+            batch_size=args.batch_size,
+            chunk_size=args.chunk_size,
+            layer=args.layer
+        )
+        logger.info(f"Embedded {n_embedded} new sequences; {len(store)} in {args.output_dir}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+from inference_backend import add_backend_arguments, configure_cpu_backend, resolve_device
+from peleke_generator import PelekeGenerator
+from antibody_draft import NGramDraftModel
+from generation_cache import GenerationCache
+from campaign_writer import CampaignWriter, export_csv
+import pandas as pd
+import argparse
+import logging
+import time
+
+"""
+Generate antibody sequences for one or more antigens with a single loaded peleke model.
+Inputs:
+    - antigen:str A single antigen sequence with epitope residues surrounded by [square brackets]
+    - antigens_file:str A .csv with `antigen` (ID) and `antigen_epitope_dict` (sequence) columns
+Outputs:
+    - A .csv in the format of tests/generated_antibody_sequences.csv (plus h_chain and l_chain columns), or
+    - A .jsonl campaign file with one record per sequence (including sampling parameters and timings).
+      Records are written as each batch completes, and rerunning the same command resumes an interrupted
+      campaign. A .csv output is streamed through a `.jsonl` file next to it in the same way.
+"""
+
+## Set up logging
+logging.basicConfig(level=logging.INFO)
+
+
+def load_antigens(antigens_file: str) -> dict:
+    """
+    Reads an antigen panel from a .csv file. Duplicate rows (e.g., from a previous campaign's output) are dropped.
+    Args:
+        antigens_file: str, path to a .csv with `antigen` and `antigen_epitope_dict` columns.
+    Returns:
+        dict: mapping of antigen IDs to epitope-tagged sequences.
+    """
+    antigens_df = pd.read_csv(antigens_file)
+    antigens_df = antigens_df[['antigen', 'antigen_epitope_dict']].drop_duplicates(subset='antigen')
+    return dict(zip(antigens_df['antigen'], antigens_df['antigen_epitope_dict']))
+
+
+def generate_campaign(
+        generator: PelekeGenerator,
+        antigens: dict,
+        output_file: str,
+        n_per_antigen: int=1,
+        batch_size: int=16,
+        seed: int=None,
+        generation_kwargs: dict=None,
+        sampling_params: dict=None,
+        adapter: str=None
+        ) -> int:
+    """
+    Generates a campaign batch by batch, appending each batch's records to a resumable .jsonl file
+    (see campaign_writer.py) and checkpointing every antigen. Antigens completed by an earlier run with the same model are skipped,
+    and only one batch of results is held in memory at a time.
+    Args:
+        generator: PelekeGenerator.
+        antigens: dict mapping antigen IDs to epitope-tagged sequences.
+        output_file: str, the .jsonl campaign file.
+        n_per_antigen, batch_size: see PelekeGenerator.generate_many().
+        seed: int, base seed; each antigen is seeded from it and its prompt (see generate_many()),
+            so resumed campaigns draw the same samples for the remaining antigens.
+        generation_kwargs: dict, other generate_many() options (share_prefix, speculative, dedup).
+        sampling_params: dict, sampling parameters (max_new_tokens, temperature, top_p, top_k, constrained).
+        adapter: str, label of the loaded adapter to generate with (defaults to the active one).
+    Returns:
+        int: number of sequences written by this run.
+    """
+    generation_kwargs = generation_kwargs or {}
+    sampling_params = sampling_params or {}
+    if adapter is not None:
+        generator.set_adapter(adapter)
+    model_label = generator.active_adapter or generator.model_name.rstrip('/').split('/')[-1]
+    params = {**sampling_params, **generation_kwargs, "n_per_antigen": n_per_antigen, "seed": seed,
+              "crop_flank": generator.crop_flank, "prompt_token_budget": generator.prompt_token_budget}
+
+    ## Same length-sorted batches as PelekeGenerator.generate_many(), fixed across restarts
+    antigen_ids = list(antigens.keys())
+    lengths = generator.prompt_lengths([antigens[antigen_id] for antigen_id in antigen_ids])
+    sorted_ids = [antigen_id for _, antigen_id in sorted(zip(lengths, antigen_ids), key=lambda x: x[0])]
+    antigens_per_batch = max(1, batch_size // n_per_antigen)
+
+    n_written = 0
+    n_unique = 0
+    total_seconds = 0.0
+    total_cpu_seconds = 0.0
+    with CampaignWriter(output_file) as writer:
+        for start in range(0, len(sorted_ids), antigens_per_batch):
+            batch_ids = [antigen_id for antigen_id in sorted_ids[start:start + antigens_per_batch] if not writer.is_done(model_label, antigen_id)]
+            if not batch_ids:
+                continue
+            batch_start = time.perf_counter()
+            cpu_start = time.process_time()
+            results = generator.generate_many(
+                {antigen_id: antigens[antigen_id] for antigen_id in batch_ids},
+                n_per_antigen=n_per_antigen,
+                batch_size=batch_size,
+                seed=seed,
+                model_label=model_label,
+                **generation_kwargs,
+                **sampling_params
+            )
+            batch_seconds = time.perf_counter() - batch_start
+            batch_cpu_seconds = time.process_time() - cpu_start
+            ## Distinct antibodies per antigen, the yield that matters downstream
+            batch_unique = len({(result["antigen"], result["generated_seq"]) for result in results})
+            timings = {
+                "batch_seconds": batch_seconds,
+                "seconds_per_sequence": batch_seconds / len(results),
+                "batch_antigens": len(batch_ids),
+                "batch_unique": batch_unique,
+                "unique_per_second": batch_unique / batch_seconds,
+                "unique_per_cpu_second": batch_unique / batch_cpu_seconds if batch_cpu_seconds > 0 else None
+            }
+            writer.write([{**result, "params": params, "timings": timings} for result in results])
+            for antigen_id in batch_ids:
+                writer.checkpoint(model_label, antigen_id, n_per_antigen)
+            n_written += len(results)
+            n_unique += batch_unique
+            total_seconds += batch_seconds
+            total_cpu_seconds += batch_cpu_seconds
+            n_done = sum(writer.is_done(model_label, antigen_id) for antigen_id in antigen_ids)
+            logging.info(f"{model_label}: {n_done}/{len(antigen_ids)} antigens done ({batch_seconds:.1f}s for this batch, {batch_unique}/{len(results)} unique).")
+    if n_written:
+        ## On GPU the wall time is the GPU time; on CPU, process time counts every core used
+        logging.info(f"{model_label}: {n_unique} unique of {n_written} sequences, {n_unique / total_seconds:.2f} unique/s "
+                     f"({n_unique / total_cpu_seconds if total_cpu_seconds > 0 else float('nan'):.2f} unique per CPU-second).")
+        if generator.dedup_stats["completed"]:
+            report = generator.dedup_report()
+            logging.info(f"{model_label}: deduplication restarted {report['restarts']} streams "
+                         f"({report['duplicate_rate']:.0%} of completions were repeats, {report['wasted_token_fraction']:.0%} of sampled tokens).")
+    return n_written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Generate antibody sequences from antigen sequences.")
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument("--antigen", type=str, help="The input antigen sequence with epitope residues surrounded by [square brackets].")
+    input_group.add_argument("--antigens_file", type=str, help="A .csv with `antigen` and `antigen_epitope_dict` columns.")
+    parser.add_argument("--model_name", type=str, default="silicobio/peleke-phi-4", help="Hugging Face ID or path of the peleke adapter (or merged model).")
+    parser.add_argument("--base_model_path", type=str, default=None, help="Override the base model recorded in the adapter config.")
+    parser.add_argument("--sweep_adapters", type=str, nargs="+", default=None, help="More adapters on the same base model (e.g., training checkpoints). The panel is generated with --model_name and each of them, loading the base model once.")
+    parser.add_argument("--device", type=str, default="auto", help="Device to run generation on ('auto', 'cpu', 'cuda', ...).")
+    add_backend_arguments(parser)
+    parser.add_argument("--n_per_antigen", type=int, default=1, help="Number of antibodies to generate per antigen.")
+    parser.add_argument("--batch_size", type=int, default=16, help="Maximum number of sequences decoded together.")
+    parser.add_argument("--share_prefix", action="store_true", help="Prefill each antigen prompt once and fork its KV cache into the sampling streams.")
+    parser.add_argument("--dedup", action="store_true", help="Restart sampling streams that repeat an earlier antibody for the same antigen (implies --share_prefix).")
+    parser.add_argument("--speculative", action="store_true", help="Speculative decoding with an n-gram draft model (requires --draft_file).")
+    parser.add_argument("--draft_file", type=str, default=None, help="Saved draft model (.json) or training .csv with an `antibody_fv_seqs` column.")
+    parser.add_argument("--draft_order", type=int, default=6, help="N-gram order of a draft model trained from a .csv.")
+    parser.add_argument("--num_draft_tokens", type=int, default=4, help="Draft tokens verified per forward pass.")
+    parser.add_argument("--constrained", action="store_true", help="Restrict decoding to amino acids, one `|` and <|im_end|>, with chain length bounds.")
+    parser.add_argument("--crop_flank", type=int, default=None, help="Crop antigens to windows of this many residues on either side of the [epitope] residues.")
+    parser.add_argument("--prompt_token_budget", type=int, default=None, help="Narrow the crop (see --crop_flank) until each prompt fits this many tokens.")
+    parser.add_argument("--max_new_tokens", type=int, default=1000, help="Maximum number of new tokens to generate.")
+    parser.add_argument("--top_p", type=float, default=1.0, help="Top-p sampling parameter.")
+    parser.add_argument("--temperature", type=float, default=0.7, help="Temperature for sampling.")
+    parser.add_argument("--top_k", type=int, default=50, help="Top-k sampling parameter.")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed. Seeded runs are reproducible and can be served from --cache_dir.")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Directory of the on-disk generation cache (used with --seed).")
+    parser.add_argument("--cache_max_mb", type=int, default=1024, help="Size bound of the on-disk generation cache in MB.")
+    parser.add_argument("--output_file", type=str, default=None, help="Output .csv or .jsonl file (resumed if the run is interrupted). If not given, results are printed.")
+
+    args = parser.parse_args()
+    if args.speculative and not args.draft_file:
+        parser.error("--speculative requires --draft_file.")
+    if args.speculative and args.dedup:
+        parser.error("--dedup does not work with --speculative.")
+
+    if args.antigen:
+        antigens = {"antigen": args.antigen}
+    else:
+        antigens = load_antigens(args.antigens_file)
+
+    cache = GenerationCache(args.cache_dir, max_disk_bytes=args.cache_max_mb * 2**20) if args.cache_dir else None
+    if resolve_device(args.device) == "cpu":
+        configure_cpu_backend(args.num_threads, args.num_interop_threads, args.numa_node)
+    generator = PelekeGenerator(args.model_name, base_model_path=args.base_model_path, device=args.device, quantization=args.quantization, cache=cache, num_draft_tokens=args.num_draft_tokens,
+                                crop_flank=args.crop_flank, prompt_token_budget=args.prompt_token_budget)
+    if args.crop_flank is not None or args.prompt_token_budget is not None:
+        full_lengths = generator.prompt_lengths(list(antigens.values()), crop=False)
+        cropped_lengths = generator.prompt_lengths(list(antigens.values()))
+        logging.info(f"Cropped prompts around the epitope: {sum(full_lengths)} -> {sum(cropped_lengths)} tokens "
+                     f"({1 - sum(cropped_lengths) / sum(full_lengths):.0%} shorter, longest {max(full_lengths)} -> {max(cropped_lengths)}).")
+    if args.speculative:
+        generator.draft_model = NGramDraftModel.from_file(generator.tokenizer, args.draft_file, order=args.draft_order)
+    for adapter_path in args.sweep_adapters or []:
+        generator.load_adapter(adapter_path)
+    adapters = list(generator.adapters) or [None]
+    generation_kwargs = {"share_prefix": args.share_prefix, "speculative": args.speculative, "dedup": args.dedup}
+    sampling_params = {
+        "max_new_tokens": args.max_new_tokens,
+        "top_p": args.top_p,
+        "temperature": args.temperature,
+        "top_k": args.top_k,
+        "constrained": args.constrained
+    }
+
+    if args.output_file:
+        campaign_file = args.output_file if args.output_file.endswith(".jsonl") else f"{args.output_file}.jsonl"
+        n_written = sum(generate_campaign(
+            generator,
+            antigens,
+            campaign_file,
+            n_per_antigen=args.n_per_antigen,
+            batch_size=args.batch_size,
+            seed=args.seed,
+            generation_kwargs=generation_kwargs,
+            sampling_params=sampling_params,
+            adapter=adapter
+        ) for adapter in adapters)
+        logging.info(f"Wrote {n_written} new sequences to {campaign_file}")
+        if campaign_file != args.output_file:
+            n_rows = export_csv(campaign_file, args.output_file)
+            logging.info(f"Wrote {n_rows} sequences to {args.output_file}")
+    else:
+        results = generator.sweep(
+            antigens,
+            n_per_antigen=args.n_per_antigen,
+            batch_size=args.batch_size,
+            seed=args.seed,
+            **generation_kwargs,
+            **sampling_params
+        )
+        for result in results:
+            print(f"{result['generated_seq_id']}: {result['generated_seq']}")
+
+    if cache is not None:
+        logging.info(f"Generation cache stats: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
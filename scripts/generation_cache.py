@@ -0,0 +1,149 @@
+from collections import OrderedDict
+import hashlib
+import sqlite3
+import logging
+import json
+import glob
+import time
+import os
+
+"""
+Cache of seeded generation results, keyed by (adapter hash, prompt, sampling parameters, seed).
+An in-memory LRU sits in front of a size-bounded SQLite store on disk, so reruns of the same
+campaign (e.g., to redo folding or scoring) return the earlier sequences without touching the model.
+"""
+
+logger = logging.getLogger(__name__)
+
+WEIGHT_PATTERNS = ["adapter_model.safetensors", "adapter_model.bin", "*.safetensors", "*.bin"]
+
+
+def adapter_fingerprint(model_name: str) -> str:
+    """
+    Returns a hash identifying the weights of a local or Hugging Face adapter/model.
+    Adapter weight files are hashed by content; large full-model shards by name, size and modification time.
+    Hub IDs are resolved to their cached snapshot (whose path contains the commit hash) when available.
+    Args:
+        model_name: str, path or Hugging Face ID passed to PelekeGenerator.
+    Returns:
+        str: hex digest.
+    """
+    model_dir = model_name
+    if not os.path.isdir(model_dir):
+        try:
+            from huggingface_hub import snapshot_download
+            model_dir = snapshot_download(model_name, local_files_only=True)
+        except Exception:
+            logger.warning(f"Could not resolve {model_name} locally; using its name as the cache fingerprint.")
+            return hashlib.sha256(model_name.encode()).hexdigest()
+
+    digest = hashlib.sha256()
+    weight_files = sorted({f for pattern in WEIGHT_PATTERNS for f in glob.glob(os.path.join(model_dir, pattern))})
+    for weight_file in weight_files:
+        digest.update(os.path.basename(weight_file).encode())
+        if os.path.basename(weight_file).startswith("adapter_model"):
+            with open(weight_file, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        else:
+            stat = os.stat(weight_file)
+            digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    if not weight_files:
+        digest.update(os.path.realpath(model_dir).encode())
+    return digest.hexdigest()
+
+
+def cache_key(adapter_hash: str, prompt: str, params: dict, seed: int) -> str:
+    """
+    Builds the cache key for one antigen's samples.
+    """
+    payload = json.dumps({"adapter": adapter_hash, "prompt": prompt, "params": params, "seed": seed}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class GenerationCache:
+    """
+    Two-level cache: an in-memory LRU in front of an on-disk SQLite store bounded in bytes.
+    Args:
+        cache_dir: str, directory of the on-disk store. If None, only the in-memory layer is used.
+        max_memory_entries: int, number of entries kept in memory.
+        max_disk_bytes: int, size bound of the on-disk store; least recently used entries are evicted first.
+    """
+    def __init__(self, cache_dir: str=None, max_memory_entries: int=1024, max_disk_bytes: int=1 << 30):
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self.evictions = 0
+
+        self.db = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(cache_dir, "generation_cache.sqlite"))
+            self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_access REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            self.db.commit()
+
+    def _remember(self, key: str, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str):
+        """
+        Returns the cached value for key, or None on a miss.
+        """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits["memory"] += 1
+            return self.memory[key]
+        if self.db is not None:
+            row = self.db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+                self.db.commit()
+                value = json.loads(row[0])
+                self._remember(key, value)
+                self.hits["disk"] += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value):
+        """
+        Stores a JSON-serializable value in both layers, evicting old disk entries past the size bound.
+        """
+        self._remember(key, value)
+        if self.db is None:
+            return
+        data = json.dumps(value)
+        self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, data, len(data), time.time()))
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        while total > self.max_disk_bytes:
+            oldest_key, size = self.db.execute("SELECT key, size FROM entries ORDER BY last_access LIMIT 1").fetchone()
+            self.db.execute("DELETE FROM entries WHERE key = ?", (oldest_key,))
+            total -= size
+            self.evictions += 1
+        self.db.commit()
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss counts, hit rate and the current size of each layer.
+        """
+        hits = self.hits["memory"] + self.hits["disk"]
+        lookups = hits + self.misses
+        stats = {
+            "hits": hits,
+            "memory_hits": self.hits["memory"],
+            "disk_hits": self.hits["disk"],
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "evictions": self.evictions,
+        }
+        if self.db is not None:
+            entries, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            stats.update({"disk_entries": entries, "disk_bytes": size})
+        return stats
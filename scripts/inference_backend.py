@@ -0,0 +1,95 @@
+import torch
+import logging
+import os
+
+"""
+Device selection and CPU inference settings for the peleke generation engine.
+    - resolve_device: picks CUDA when available and falls back to CPU.
+    - configure_cpu_backend: intra-op/inter-op thread counts and NUMA-aware CPU pinning.
+    - quantize_int8: dynamic int8 quantization of the Linear layers for CPU inference.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_device(device: str="auto") -> str:
+    """
+    Args:
+        device: str, 'auto', 'cpu', 'cuda' or 'cuda:N'.
+    Returns:
+        str: the device to use ('auto' becomes 'cuda' if a GPU is available, else 'cpu').
+    """
+    if device == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return device
+
+
+def numa_node_cpus(node: int) -> list:
+    """
+    Returns the CPU IDs of a NUMA node (Linux only), read from /sys/devices/system/node.
+    """
+    with open(f"/sys/devices/system/node/node{node}/cpulist") as f:
+        cpulist = f.read().strip()
+    cpus = []
+    for part in cpulist.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def configure_cpu_backend(num_threads: int=None, num_interop_threads: int=None, numa_node: int=None) -> dict:
+    """
+    Configures PyTorch CPU threading. Call before loading the model.
+    Pinning the process to one NUMA node keeps the weights (allocated after pinning, by first touch)
+    in that node's memory, and the intra-op thread count defaults to that node's cores.
+    Args:
+        num_threads: int, intra-op threads (matrix multiplications). Defaults to the available CPUs.
+        num_interop_threads: int, inter-op threads.
+        numa_node: int, NUMA node to pin the process to.
+    Returns:
+        dict: the applied settings.
+    """
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    if numa_node is not None:
+        cpus = numa_node_cpus(numa_node)
+        os.sched_setaffinity(0, cpus)
+        logger.info(f"Pinned to NUMA node {numa_node} (CPUs {cpus[0]}-{cpus[-1]}).")
+
+    torch.set_num_threads(num_threads or len(cpus))
+    if num_interop_threads:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError as e:
+            ## Can only be set once, before any inter-op parallel work
+            logger.warning(f"Could not set inter-op threads: {e}")
+
+    settings = {
+        "num_threads": torch.get_num_threads(),
+        "num_interop_threads": torch.get_num_interop_threads(),
+        "numa_node": numa_node,
+        "cpus": len(cpus),
+    }
+    logger.info(f"CPU backend: {settings}")
+    return settings
+
+
+def add_backend_arguments(parser):
+    """
+    Adds the CPU backend options (--quantization, --num_threads, --num_interop_threads, --numa_node) to an argparse parser.
+    """
+    parser.add_argument("--quantization", type=str, default=None, choices=["int8"], help="Dynamic int8 quantization of Linear layers (CPU only).")
+    parser.add_argument("--num_threads", type=int, default=None, help="CPU intra-op threads (defaults to the available cores).")
+    parser.add_argument("--num_interop_threads", type=int, default=None, help="CPU inter-op threads.")
+    parser.add_argument("--numa_node", type=int, default=None, help="Pin the process to this NUMA node's CPUs.")
+
+
+def quantize_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Applies dynamic int8 quantization to every Linear layer (weights stored in int8, activations
+    quantized on the fly). CPU only; the model must be in float32.
+    """
+    model = model.float()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
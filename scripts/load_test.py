@@ -0,0 +1,112 @@
+import pandas as pd
+import statistics
+import argparse
+import asyncio
+import json
+import time
+
+"""
+Load test for peleke_server.py: fires concurrent /generate requests and reports latency and throughput.
+Works against a server running a tiny CPU model, e.g.:
+    python peleke_server.py --model_name path/to/tiny-model --device cpu --port 8000
+    python load_test.py --port 8000 --n_requests 32 --concurrency 8 --max_new_tokens 32
+"""
+
+
+async def generate(host: str, port: int, payload: dict) -> dict:
+    """
+    Sends one /generate request and consumes the streamed events.
+    Returns:
+        dict: latency, time to first token, number of token events and per-sequence statuses.
+    """
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    body = json.dumps(payload).encode()
+    writer.write(f"POST /generate HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+
+    status_line = (await reader.readline()).decode().strip()
+    while (await reader.readline()) not in (b"\r\n", b""):
+        pass
+
+    first_token, n_tokens, statuses, buffer = None, 0, [], b""
+    if not status_line.endswith("200 OK"):
+        statuses.append(status_line)
+    else:
+        ## Read the chunked body
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            if size == 0:
+                break
+            buffer += await reader.readexactly(size)
+            await reader.readline()
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                event = json.loads(line)
+                if "token" in event:
+                    n_tokens += 1
+                    first_token = first_token or time.perf_counter() - start
+                elif "status" in event:
+                    statuses.append(event["status"])
+    writer.close()
+    return {"latency": time.perf_counter() - start, "ttft": first_token, "n_tokens": n_tokens, "statuses": statuses}
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+
+async def run_load_test(args, antigens: list) -> list:
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i: int) -> dict:
+        payload = {
+            "antigen": antigens[i % len(antigens)],
+            "n": args.n_per_request,
+            "max_new_tokens": args.max_new_tokens,
+            "timeout": args.timeout,
+            "constrained": args.constrained,
+        }
+        if args.adapters:
+            payload["adapter"] = args.adapters[i % len(args.adapters)]
+        async with semaphore:
+            return await generate(args.host, args.port, payload)
+
+    return await asyncio.gather(*[one(i) for i in range(args.n_requests)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Load test the generation server.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Server host.")
+    parser.add_argument("--port", type=int, default=8000, help="Server port.")
+    parser.add_argument("--antigens_file", type=str, default="../tests/generated_antibody_sequences.csv", help="A .csv with an `antigen_epitope_dict` column.")
+    parser.add_argument("--n_requests", type=int, default=32, help="Total number of requests.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of requests in flight at once.")
+    parser.add_argument("--n_per_request", type=int, default=1, help="Antibodies per request.")
+    parser.add_argument("--max_new_tokens", type=int, default=64, help="Maximum number of new tokens per sequence.")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request deadline in seconds.")
+    parser.add_argument("--constrained", action="store_true", help="Request grammar-constrained decoding.")
+    parser.add_argument("--adapters", type=str, nargs="+", default=None, help="Adapter labels to spread the requests over (round robin).")
+    args = parser.parse_args()
+
+    antigens = pd.read_csv(args.antigens_file)['antigen_epitope_dict'].drop_duplicates().tolist()
+
+    start = time.perf_counter()
+    results = asyncio.run(run_load_test(args, antigens))
+    elapsed = time.perf_counter() - start
+
+    latencies = [r["latency"] for r in results]
+    ttfts = [r["ttft"] for r in results if r["ttft"] is not None]
+    statuses = [s for r in results for s in r["statuses"]]
+    n_tokens = sum(r["n_tokens"] for r in results)
+    print(f"Requests: {len(results)} in {elapsed:.2f}s ({len(results) / elapsed:.2f} req/s), concurrency {args.concurrency}")
+    print(f"Sequences: {len(statuses)} ({len(statuses) / elapsed:.2f} seq/s), tokens: {n_tokens} ({n_tokens / elapsed:.1f} tok/s)")
+    print(f"Latency p50/p95/max: {percentile(latencies, 0.5):.2f}/{percentile(latencies, 0.95):.2f}/{max(latencies):.2f}s")
+    if ttfts:
+        print(f"Time to first token p50/p95: {percentile(ttfts, 0.5):.2f}/{percentile(ttfts, 0.95):.2f}s")
+    print(f"Statuses: { {s: statuses.count(s) for s in set(statuses)} }")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1139 @@
+from transformers import AutoTokenizer, AutoModelForCausalLM, DynamicCache, LogitsProcessorList
+from peft import PeftModel, PeftConfig
+from antibody_grammar import AntibodyGrammar, AntibodyGrammarLogitsProcessor
+from generation_cache import GenerationCache, adapter_fingerprint, cache_key
+from inference_backend import resolve_device, quantize_int8
+from antibody_draft import NGramDraftModel
+from sequence_trie import SequenceTrie
+import hashlib
+import torch
+import time
+import re
+import logging
+
+"""
+Peleke🦋 generation engine.
+Loads the tokenizer, base model and PEFT adapter once and reuses them to generate
+antibody sequences for any number of antigens in the same process.
+
+Usage:
+    from peleke_generator import PelekeGenerator
+    generator = PelekeGenerator("silicobio/peleke-phi-4")
+    results = generator.generate_many({"PD-1": "NPPTFSPALLVV...[S][F][V]L[N]WYRMQ..."}, n_per_antigen=10)
+"""
+
+logger = logging.getLogger(__name__)
+
+PROMPT_END_TOKEN = "<|im_end|>"
+
+DEFAULT_SAMPLING_PARAMS = {"max_new_tokens": 1000, "temperature": 0.7, "top_p": 1.0, "top_k": 50, "constrained": False}
+
+
+def format_prompt(antigen_sequence: str) -> str:
+    """
+    Formats an antigen sequence into a peleke prompt.
+    Epitope residues in [square brackets] are converted to <epi></epi> tags.
+    Args:
+        antigen_sequence: str, antigen amino acid sequence with epitope residues in [ ].
+    Returns:
+        str: the formatted prompt.
+    """
+    epitope_seq = re.sub(r'\[([A-Z])\]', r'<epi>\1</epi>', antigen_sequence)
+    formatted_str = f"Antigen: {epitope_seq}{PROMPT_END_TOKEN}\nAntibody:"
+    return formatted_str
+
+
+def antigen_seed(seed: int, prompt: str) -> int:
+    """
+    Seed of one antigen's samples, derived from the run seed and the antigen's prompt so that
+    the samples do not depend on the other antigens of the panel.
+    """
+    digest = hashlib.sha256(f"{seed}:{prompt}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") & (2**63 - 1)
+
+
+def crop_antigen(antigen_sequence: str, flank: int=16, token_budget: int=None, count_tokens=None) -> str:
+    """
+    Crops an antigen to windows of `flank` residues on either side of its epitope residues.
+    Overlapping windows are merged. Windows are joined with `|`, like the chains of a multi-chain
+    antigen, and chains without epitope residues are dropped. With a token_budget, the flank is
+    narrowed until count_tokens(cropped) fits the budget (or the flank reaches 0).
+    Args:
+        antigen_sequence: str, antigen sequence (chains separated by `|`) with epitope residues in [ ].
+        flank: int, residues kept on each side of an epitope residue.
+        token_budget: int, maximum value of count_tokens for the cropped antigen.
+        count_tokens: callable, str -> int (default: number of residues).
+    Returns:
+        str: the cropped antigen, or the input unchanged if it has no epitope residues.
+    """
+    if '[' not in antigen_sequence:
+        return antigen_sequence
+    count_tokens = count_tokens or (lambda seq: len(re.sub(r'[\[\]|]', '', seq)))
+    chains = [re.findall(r'\[[A-Z]\]|[A-Z]', chain) for chain in antigen_sequence.split('|')]
+
+    def crop(flank: int) -> str:
+        windows = []
+        for residues in chains:
+            epitope = [i for i, residue in enumerate(residues) if residue.startswith('[')]
+            start = end = None
+            for i in epitope:
+                if start is not None and i - flank <= end:
+                    end = i + flank + 1
+                    continue
+                if start is not None:
+                    windows.append(''.join(residues[start:end]))
+                start, end = max(0, i - flank), i + flank + 1
+            if start is not None:
+                windows.append(''.join(residues[start:end]))
+        return '|'.join(windows)
+
+    cropped = crop(flank)
+    if token_budget is None or count_tokens(cropped) <= token_budget:
+        return cropped
+    ## The widest flank that fits the budget
+    low, high = 0, flank - 1
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(crop(mid)) <= token_budget:
+            low = mid
+        else:
+            high = mid - 1
+    return crop(low)
+
+
+def parse_antibody_sequence(generated_text: str) -> tuple:
+    """
+    Extracts the heavy and light chains from the generated completion (the text after the prompt).
+    Args:
+        generated_text: str, decoded completion, possibly including special tokens.
+    Returns:
+        tuple: (h_chain, l_chain). Missing chains are returned as empty strings.
+    """
+    antibody_sequence = generated_text.split(PROMPT_END_TOKEN)[0]
+    antibody_sequence = antibody_sequence.replace("Antibody:", "")
+    antibody_sequence = re.sub(r'\s+', '', antibody_sequence)
+    chains = antibody_sequence.split('|')
+    h_chain = chains[0]
+    l_chain = chains[1] if len(chains) > 1 else ""
+    return h_chain, l_chain
+
+
+def next_token_probs(
+        logits: torch.Tensor,
+        temperature: float=0.7,
+        top_p: float=1.0,
+        top_k: int=50
+        ) -> torch.Tensor:
+    """
+    Converts next-token logits into the sampling distribution after temperature, top-k and top-p
+    filtering (the same filters model.generate() applies).
+    Args:
+        logits: torch.Tensor, (..., vocab) next-token logits.
+        temperature, top_p, top_k: sampling parameters.
+    Returns:
+        torch.Tensor: (..., vocab) probabilities.
+    """
+    logits = logits.float() / temperature
+    if top_k and top_k < logits.shape[-1]:
+        kth_logit = torch.topk(logits, top_k, dim=-1).values[..., -1:]
+        logits = logits.masked_fill(logits < kth_logit, float('-inf'))
+    if top_p < 1.0:
+        sorted_logits, sorted_idx = torch.sort(logits, descending=True, dim=-1)
+        cumulative_probs = sorted_logits.softmax(dim=-1).cumsum(dim=-1)
+        ## Keep the smallest set of tokens whose probability reaches top_p (always keep the top token)
+        sorted_remove = cumulative_probs > top_p
+        sorted_remove[..., 1:] = sorted_remove[..., :-1].clone()
+        sorted_remove[..., 0] = False
+        remove = sorted_remove.scatter(-1, sorted_idx, sorted_remove)
+        logits = logits.masked_fill(remove, float('-inf'))
+    return logits.softmax(dim=-1)
+
+
+def sample_next_tokens(
+        logits: torch.Tensor,
+        temperature: float=0.7,
+        top_p: float=1.0,
+        top_k: int=50
+        ) -> torch.Tensor:
+    """
+    Samples one token per row from next-token logits with temperature, top-k and top-p filtering.
+    Args:
+        logits: torch.Tensor, (batch, vocab) next-token logits.
+        temperature, top_p, top_k: sampling parameters.
+    Returns:
+        torch.Tensor: (batch,) sampled token IDs.
+    """
+    probs = next_token_probs(logits, temperature=temperature, top_p=top_p, top_k=top_k)
+    return torch.multinomial(probs, num_samples=1).squeeze(-1)
+
+
+def cache_layers(past_key_values) -> list:
+    """
+    Returns the (keys, values) tensors of each layer of a DynamicCache (works with both the
+    per-layer API of newer transformers and the key_cache/value_cache lists of older ones).
+    """
+    if hasattr(past_key_values, "layers"):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    return list(zip(past_key_values.key_cache, past_key_values.value_cache))
+
+
+def cache_from_layers(layers: list) -> DynamicCache:
+    """
+    Builds a DynamicCache from a list of (keys, values) tensors per layer.
+    """
+    past_key_values = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(layers):
+        past_key_values.update(keys, values, layer_idx)
+    return past_key_values
+
+
+def cache_tensors(past_key_values) -> list:
+    """
+    Returns all key and value tensors held by a DynamicCache.
+    """
+    return [t for layer in cache_layers(past_key_values) for t in layer]
+
+
+def select_cache_rows(past_key_values, rows: torch.Tensor) -> DynamicCache:
+    """
+    Returns a new cache with only the given batch rows.
+    """
+    return cache_from_layers([(keys[rows], values[rows]) for keys, values in cache_layers(past_key_values)])
+
+
+def concat_caches(caches: list, attention_masks: list) -> tuple:
+    """
+    Concatenates caches along the batch dimension, left-padding shorter ones so that every
+    row ends at the same position (the layout model.generate() uses for left-padded batches).
+    Args:
+        caches: list of DynamicCache.
+        attention_masks: list of torch.Tensor, (batch, cached_length) mask of each cache.
+    Returns:
+        tuple: (DynamicCache, attention_mask) of the merged batch.
+    """
+    length = max(mask.shape[1] for mask in attention_masks)
+    padded_masks = [torch.nn.functional.pad(mask, (length - mask.shape[1], 0)) for mask in attention_masks]
+    merged_layers = []
+    for layers in zip(*[cache_layers(c) for c in caches]):
+        keys = [torch.nn.functional.pad(k, (0, 0, length - k.shape[2], 0)) for k, _ in layers]
+        values = [torch.nn.functional.pad(v, (0, 0, length - v.shape[2], 0)) for _, v in layers]
+        merged_layers.append((torch.cat(keys, dim=0), torch.cat(values, dim=0)))
+    return cache_from_layers(merged_layers), torch.cat(padded_masks, dim=0)
+
+
+def trim_cache_padding(past_key_values, attention_mask: torch.Tensor) -> tuple:
+    """
+    Drops leading cache positions that are padding for every row (e.g., after the longest
+    sequence in a batch has been retired).
+    Returns:
+        tuple: (DynamicCache, attention_mask).
+    """
+    used = attention_mask.any(dim=0).nonzero()
+    start = int(used[0]) if len(used) else attention_mask.shape[1]
+    if start == 0:
+        return past_key_values, attention_mask
+    trimmed_layers = [(k[:, :, start:], v[:, :, start:]) for k, v in cache_layers(past_key_values)]
+    return cache_from_layers(trimmed_layers), attention_mask[:, start:]
+
+
+def cache_nbytes(past_key_values) -> int:
+    """
+    Returns the number of bytes of KV-cache storage, counting shared (expanded) storage once.
+    """
+    storages = {}
+    for t in cache_tensors(past_key_values):
+        storage = t.untyped_storage()
+        storages[storage.data_ptr()] = storage.nbytes()
+    return sum(storages.values())
+
+
+def fork_cache(past_key_values, n: int):
+    """
+    Forks a single-sequence KV cache into n sampling streams in place.
+    The streams are expanded views of the same prefix storage, so nothing is recomputed or copied here.
+    Per-stream storage is only allocated when the streams append their own (divergent) tokens.
+    Args:
+        past_key_values: DynamicCache, cache with batch size 1.
+        n: int, number of streams.
+    Returns:
+        DynamicCache: the same cache object, now with batch size n.
+    """
+    if hasattr(past_key_values, "layers"):
+        for layer in past_key_values.layers:
+            layer.keys = layer.keys.expand(n, -1, -1, -1)
+            layer.values = layer.values.expand(n, -1, -1, -1)
+    else:
+        past_key_values.key_cache = [k.expand(n, -1, -1, -1) for k in past_key_values.key_cache]
+        past_key_values.value_cache = [v.expand(n, -1, -1, -1) for v in past_key_values.value_cache]
+    return past_key_values
+
+
+def speculative_accept(probs: torch.Tensor, drafts: torch.Tensor) -> tuple:
+    """
+    Verifies deterministic draft tokens against the target distributions (speculative sampling).
+    Draft token d is accepted with probability p(d); on rejection, the next token is sampled from p with d
+    removed (renormalized). The accepted tokens plus that correction are distributed exactly as
+    token-by-token sampling from p.
+    Args:
+        probs: torch.Tensor, (batch, k + 1, vocab) target distributions at each draft position and after the last draft.
+        drafts: torch.Tensor, (batch, k) draft token IDs.
+    Returns:
+        tuple: (n_accepted, next_tokens), the number of leading drafts accepted per row and the token that follows them
+            (the correction after a rejection, or a sample from the last distribution when every draft was accepted).
+    """
+    batch_size, k = drafts.shape
+    rows = torch.arange(batch_size, device=drafts.device)
+    draft_probs = probs[:, :k].gather(-1, drafts[..., None]).squeeze(-1)
+    accepted = torch.rand_like(draft_probs) < draft_probs
+    n_accepted = accepted.long().cumprod(dim=-1).sum(dim=-1)
+
+    next_probs = probs[rows, n_accepted].clone()
+    rejected = n_accepted < k
+    if rejected.any():
+        rejected_rows = rows[rejected]
+        next_probs[rejected_rows, drafts[rejected_rows, n_accepted[rejected]]] = 0
+    ## A rejection with (numerically) nothing left to sample can only come from rounding; fall back to p
+    empty = next_probs.sum(dim=-1) <= 0
+    next_probs[empty] = probs[rows[empty], n_accepted[empty]]
+    next_tokens = torch.multinomial(next_probs, num_samples=1).squeeze(-1)
+    return n_accepted, next_tokens
+
+
+def adapter_label(model_name: str) -> str:
+    """
+    Returns the label of an adapter: its directory name, prefixed with the run directory for
+    Trainer checkpoints (e.g., 'peleke-phi-4-10eps/checkpoint-1914' -> 'peleke-phi-4-10eps_checkpoint-1914').
+    """
+    parts = model_name.rstrip('/').split('/')
+    if parts[-1].startswith("checkpoint-") and len(parts) > 1:
+        return f"{parts[-2]}_{parts[-1]}"
+    return parts[-1]
+
+
+class PelekeGenerator:
+    """
+    Keeps a peleke model resident and generates antibody sequences for batches of antigens.
+    Args:
+        model_name: str, Hugging Face ID or local path of a peleke adapter (e.g., 'silicobio/peleke-phi-4').
+            Paths without an adapter_config.json are loaded as full (merged) models.
+        base_model_path: str, overrides the base model recorded in the adapter config.
+        device: str, device to run generation on ('auto', 'cpu', 'cuda', 'cuda:1', ...).
+        torch_dtype: torch.dtype, weights dtype.
+        quantization: str, 'int8' for dynamic int8 quantization of the Linear layers (CPU only).
+            The adapter is merged into the base weights first.
+        cache: GenerationCache, cache for seeded generate_many() results.
+        draft_model: NGramDraftModel, draft model for speculative decoding (see antibody_draft.py).
+        num_draft_tokens: int, number of draft tokens verified per forward pass in speculative decoding.
+        crop_flank: int, crop antigens to windows of this many residues around the epitope (see crop_antigen()).
+        prompt_token_budget: int, narrow the crop flank until each prompt fits this many tokens.
+    """
+    def __init__(
+            self,
+            model_name: str,
+            base_model_path: str=None,
+            device: str="auto",
+            torch_dtype: torch.dtype=torch.bfloat16,
+            quantization: str=None,
+            cache: GenerationCache=None,
+            draft_model: NGramDraftModel=None,
+            num_draft_tokens: int=4,
+            crop_flank: int=None,
+            prompt_token_budget: int=None
+            ):
+        self.model_name = model_name
+        self.device = resolve_device(device)
+        self.cache = cache
+        self.draft_model = draft_model
+        self.num_draft_tokens = num_draft_tokens
+        self.speculative_stats = {"steps": 0, "proposed": 0, "accepted": 0, "tokens": 0}
+        self.dedup_stats = {"completed": 0, "duplicates": 0, "restarts": 0, "tokens": 0, "wasted_tokens": 0}
+        self.crop_flank = crop_flank
+        self.prompt_token_budget = prompt_token_budget
+        self._prompts = {}
+        self.adapters = {}
+        self.active_adapter = None
+        self._adapter_hashes = {}
+
+        logger.info(f"Loading tokenizer from {model_name}...")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+        ## Decoder-only models need left padding for batched generation
+        self.tokenizer.padding_side = "left"
+
+        try:
+            config = PeftConfig.from_pretrained(model_name)
+        except (ValueError, OSError):
+            config = None
+
+        if config is not None:
+            base_model_path = base_model_path or config.base_model_name_or_path
+            logger.info(f"Loading base model {base_model_path}...")
+            model = AutoModelForCausalLM.from_pretrained(base_model_path, torch_dtype=torch_dtype, trust_remote_code=True)
+            model.resize_token_embeddings(len(self.tokenizer))
+            logger.info(f"Loading PEFT adapter {model_name}...")
+            self.active_adapter = adapter_label(model_name)
+            self.adapters[self.active_adapter] = model_name
+            model = PeftModel.from_pretrained(model, model_name, adapter_name=self.peft_adapter_name(self.active_adapter))
+        else:
+            logger.info(f"Loading model {model_name}...")
+            model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch_dtype, trust_remote_code=True)
+
+        if quantization == "int8":
+            if self.device != "cpu":
+                raise ValueError("int8 dynamic quantization is only supported on CPU.")
+            if isinstance(model, PeftModel):
+                model = model.merge_and_unload()
+                self.adapters = {}
+            logger.info("Quantizing Linear layers to int8...")
+            model = quantize_int8(model)
+        elif quantization is not None:
+            raise ValueError(f"Unknown quantization: {quantization}")
+
+        self.model = model.to(self.device)
+        self.model.eval()
+
+        self.pad_token_id = self.tokenizer.pad_token_id
+        if self.pad_token_id is None:
+            self.pad_token_id = self.tokenizer.eos_token_id
+            self.tokenizer.pad_token_id = self.pad_token_id
+
+        ## Generation stops at EOS or at the <|im_end|> that closes the antibody
+        self.stop_token_ids = {self.tokenizer.eos_token_id, self.tokenizer.convert_tokens_to_ids(PROMPT_END_TOKEN)}
+        self.stop_token_ids.discard(None)
+        self.stop_token_ids.discard(self.tokenizer.unk_token_id)
+
+        self._grammar = None
+
+    @property
+    def grammar(self) -> AntibodyGrammar:
+        """
+        The heavy|light grammar used for constrained decoding (built on first use with the default
+        chain length bounds; assign an AntibodyGrammar to change them).
+        """
+        if self._grammar is None:
+            self._grammar = AntibodyGrammar(self.tokenizer)
+        return self._grammar.to(self.device)
+
+    @grammar.setter
+    def grammar(self, grammar: AntibodyGrammar):
+        self._grammar = grammar
+
+    @property
+    def adapter_hash(self) -> str:
+        if self.model_name not in self._adapter_hashes:
+            self._adapter_hashes[self.model_name] = adapter_fingerprint(self.model_name)
+        return self._adapter_hashes[self.model_name]
+
+    @staticmethod
+    def peft_adapter_name(label: str) -> str:
+        """
+        PEFT adapter names become module names, which cannot contain dots (e.g., 'peleke-llama-3.1-8b-instruct').
+        """
+        return label.replace(".", "_")
+
+    def load_adapter(self, model_name: str, label: str=None) -> str:
+        """
+        Loads another PEFT adapter (e.g., a training checkpoint or another peleke variant) next to the
+        resident ones. The base model weights are shared; only the LoRA weights are added.
+        Args:
+            model_name: str, Hugging Face ID or local path of the adapter. It must share the base model and tokenizer.
+            label: str, name used to select the adapter and in the results (defaults to adapter_label(model_name)).
+        Returns:
+            str: the adapter's label.
+        """
+        if not isinstance(self.model, PeftModel):
+            raise ValueError("Adapters can only be added to a generator loaded from a PEFT adapter (and not merged/quantized).")
+        label = label or adapter_label(model_name)
+        if label in self.adapters:
+            raise ValueError(f"An adapter named {label} is already loaded.")
+        tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+        if len(tokenizer) != len(self.tokenizer):
+            raise ValueError(f"{model_name} uses a different tokenizer ({len(tokenizer)} tokens, expected {len(self.tokenizer)}).")
+        logger.info(f"Loading PEFT adapter {model_name} as {label}...")
+        self.model.load_adapter(model_name, adapter_name=self.peft_adapter_name(label))
+        self.model.eval()
+        self.adapters[label] = model_name
+        return label
+
+    def set_adapter(self, label: str):
+        """
+        Routes subsequent generation to a loaded adapter.
+        """
+        if label not in self.adapters:
+            raise ValueError(f"Unknown adapter {label}. Loaded adapters: {', '.join(self.adapters)}")
+        if label != self.active_adapter:
+            self.model.set_adapter(self.peft_adapter_name(label))
+            self.active_adapter = label
+            self.model_name = self.adapters[label]
+
+    def format_prompt(self, antigen_sequence: str) -> str:
+        """
+        Formats the prompt for an antigen, cropped around the epitope if crop_flank is set or the prompt
+        is longer than prompt_token_budget.
+        """
+        if self.crop_flank is None and self.prompt_token_budget is None:
+            return format_prompt(antigen_sequence)
+        key = (antigen_sequence, self.crop_flank, self.prompt_token_budget)
+        if key not in self._prompts:
+            count_tokens = lambda seq: len(self.tokenizer(format_prompt(seq))["input_ids"])
+            if self.crop_flank is None and count_tokens(antigen_sequence) <= self.prompt_token_budget:
+                cropped = antigen_sequence
+            else:
+                ## Without a flank, start from windows wide enough to cover every chain and narrow them to the budget
+                flank = self.crop_flank if self.crop_flank is not None else len(antigen_sequence)
+                cropped = crop_antigen(antigen_sequence, flank=flank, token_budget=self.prompt_token_budget, count_tokens=count_tokens)
+            self._prompts[key] = format_prompt(cropped)
+        return self._prompts[key]
+
+    def _cache_key(self, antigen_sequence: str, n: int, sampling_params: dict, seed: int) -> str:
+        params = {**DEFAULT_SAMPLING_PARAMS, **sampling_params, "n": n}
+        if params["constrained"]:
+            grammar = self.grammar
+            params["chain_bounds"] = [grammar.min_heavy, grammar.max_heavy, grammar.min_light, grammar.max_light]
+        return cache_key(self.adapter_hash, self.format_prompt(antigen_sequence), params, seed)
+
+    def _parse_completions(self, token_ids: torch.Tensor) -> list:
+        """
+        Decodes generated token IDs (a tensor or a list of lists) up to each row's first stop token and parses the chains.
+        Returns:
+            list of tuple: (h_chain, l_chain) for each row.
+        """
+        if isinstance(token_ids, torch.Tensor):
+            token_ids = token_ids.tolist()
+        chains = []
+        for row in token_ids:
+            stop_idx = next((i for i, token_id in enumerate(row) if token_id in self.stop_token_ids), len(row))
+            completion = self.tokenizer.decode(row[:stop_idx], skip_special_tokens=True)
+            chains.append(parse_antibody_sequence(completion))
+        return chains
+
+    def prompt_lengths(self, antigen_sequences: list, crop: bool=True) -> list:
+        """
+        Returns the number of prompt tokens for each antigen sequence (uncropped if crop is False).
+        """
+        prompts = [self.format_prompt(seq) if crop else format_prompt(seq) for seq in antigen_sequences]
+        return [len(ids) for ids in self.tokenizer(prompts)["input_ids"]]
+
+    @torch.no_grad()
+    def generate_batch(
+            self,
+            antigen_sequences: list,
+            n: int=1,
+            max_new_tokens: int=1000,
+            temperature: float=0.7,
+            top_p: float=1.0,
+            top_k: int=50,
+            constrained: bool=False
+            ) -> list:
+        """
+        Generates n antibody sequences for each antigen in one left-padded batch with the KV cache on.
+        Args:
+            antigen_sequences: list of str, antigen sequences with epitope residues in [ ].
+            n: int, number of antibodies to sample per antigen (num_return_sequences).
+            max_new_tokens, temperature, top_p, top_k: sampling parameters.
+            constrained: bool, restrict decoding to valid heavy|light sequences (see antibody_grammar.py).
+        Returns:
+            list of list of tuple: (h_chain, l_chain) samples for each antigen, in input order.
+        """
+        prompts = [self.format_prompt(seq) for seq in antigen_sequences]
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True)
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        prompt_length = inputs["input_ids"].shape[1]
+
+        logits_processor = LogitsProcessorList()
+        if constrained:
+            logits_processor.append(AntibodyGrammarLogitsProcessor(self.grammar, prompt_length))
+            max_new_tokens = min(max_new_tokens, self.grammar.max_new_tokens)
+
+        outputs = self.model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            do_sample=True,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            num_return_sequences=n,
+            pad_token_id=self.pad_token_id,
+            eos_token_id=sorted(self.stop_token_ids),
+            logits_processor=logits_processor,
+            use_cache=True,
+        )
+
+        ## Outputs are grouped per prompt: n rows for the first antigen, then n for the second, ...
+        chains = self._parse_completions(outputs[:, prompt_length:])
+        return [chains[i * n:(i + 1) * n] for i in range(len(prompts))]
+
+    @torch.no_grad()
+    def _decode(
+            self,
+            logits: torch.Tensor,
+            attention_mask: torch.Tensor,
+            past_key_values,
+            max_new_tokens: int=1000,
+            temperature: float=0.7,
+            top_p: float=1.0,
+            top_k: int=50,
+            grammar: AntibodyGrammar=None,
+            min_new_tokens: int=0
+            ) -> torch.Tensor:
+        """
+        Sampling loop that continues from an already pre-filled KV cache.
+        Args:
+            logits: torch.Tensor, (batch, vocab) next-token logits from the prefill.
+            attention_mask: torch.Tensor, (batch, cached_length) mask over the cached tokens.
+            past_key_values: DynamicCache, the cache for the prompt(s).
+            max_new_tokens, temperature, top_p, top_k: sampling parameters.
+            grammar: AntibodyGrammar, if given, sampling runs over the grammar's candidate tokens only.
+            min_new_tokens: int, stop tokens are masked until this many tokens are generated (unconstrained only),
+                e.g. for fixed-length benchmarks.
+        Returns:
+            torch.Tensor: (batch, n_generated) token IDs. Rows are padded after their stop token.
+        """
+        batch_size = logits.shape[0]
+        stop_token_ids = torch.tensor(sorted(self.stop_token_ids), device=logits.device)
+        finished = torch.zeros(batch_size, dtype=torch.bool, device=logits.device)
+        generated = []
+        if grammar is not None:
+            grammar_state = grammar.initial_state(batch_size, device=logits.device)
+            max_new_tokens = min(max_new_tokens, grammar.max_new_tokens)
+        for step in range(max_new_tokens):
+            if grammar is not None:
+                candidate_logits = grammar.candidate_logits(logits, *grammar_state)
+                next_candidates = sample_next_tokens(candidate_logits, temperature=temperature, top_p=top_p, top_k=top_k)
+                next_tokens = grammar.candidate_ids[next_candidates]
+                grammar.advance(*grammar_state, next_tokens)
+            else:
+                if step < min_new_tokens:
+                    logits = logits.index_fill(-1, stop_token_ids, float("-inf"))
+                next_tokens = sample_next_tokens(logits, temperature=temperature, top_p=top_p, top_k=top_k)
+            next_tokens = next_tokens.masked_fill(finished, self.pad_token_id)
+            generated.append(next_tokens)
+            finished |= torch.isin(next_tokens, stop_token_ids)
+            if finished.all():
+                break
+
+            attention_mask = torch.cat([attention_mask, attention_mask.new_ones((batch_size, 1))], dim=-1)
+            position_ids = attention_mask.long().sum(dim=-1, keepdim=True) - 1
+            outputs = self.model(
+                input_ids=next_tokens[:, None],
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+            past_key_values = outputs.past_key_values
+            logits = outputs.logits[:, -1, :]
+        return torch.stack(generated, dim=1)
+
+    @torch.no_grad()
+    def _decode_unique(
+            self,
+            logits: torch.Tensor,
+            attention_mask: torch.Tensor,
+            past_key_values,
+            trie: SequenceTrie,
+            max_restarts: int,
+            max_new_tokens: int=1000,
+            temperature: float=0.7,
+            top_p: float=1.0,
+            top_k: int=50,
+            grammar: AntibodyGrammar=None
+            ) -> list:
+        """
+        Sampling loop of _decode() that deduplicates against a trie of earlier completions. When a stream
+        finishes a completion that is already in the trie, it is restarted in the same batch slot: its
+        cache entries are masked out (as for rejected drafts in _decode_speculative()) and it samples again
+        from the prompt's logits. Once max_restarts is used up, duplicate streams are dropped.
+        Args: see _decode(). All rows must share the same prompt.
+            trie: SequenceTrie, `HEAVY|LIGHT` completions of this antigen so far (updated in place).
+            max_restarts: int, restarts allowed in this call.
+        Returns:
+            list of list: token IDs of each unique completion (at most one per row), without the stop token.
+        """
+        batch_size = logits.shape[0]
+        device = logits.device
+        stats = self.dedup_stats
+        stop_token_ids = torch.tensor(sorted(self.stop_token_ids), device=device)
+        prompt_logits = logits.clone()
+        prompt_length = attention_mask.shape[1]
+        finished = torch.zeros(batch_size, dtype=torch.bool, device=device)
+        rows = [[] for _ in range(batch_size)]
+        unique = []
+        if grammar is not None:
+            grammar_state = grammar.initial_state(batch_size, device=device)
+            max_new_tokens = min(max_new_tokens, grammar.max_new_tokens)
+        while True:
+            if grammar is not None:
+                candidate_logits = grammar.candidate_logits(logits, *grammar_state)
+                next_candidates = sample_next_tokens(candidate_logits, temperature=temperature, top_p=top_p, top_k=top_k)
+                next_tokens = grammar.candidate_ids[next_candidates]
+                grammar.advance(*grammar_state, next_tokens)
+            else:
+                next_tokens = sample_next_tokens(logits, temperature=temperature, top_p=top_p, top_k=top_k)
+            next_tokens = next_tokens.masked_fill(finished, self.pad_token_id)
+            stopped = torch.isin(next_tokens, stop_token_ids)
+
+            restarted = []
+            for row, (token_id, is_stop, is_finished) in enumerate(zip(next_tokens.tolist(), stopped.tolist(), finished.tolist())):
+                if is_finished:
+                    continue
+                if not is_stop:
+                    rows[row].append(token_id)
+                stats["tokens"] += 1
+                if not is_stop and len(rows[row]) < max_new_tokens:
+                    continue
+                ## The stream completed a sequence (or ran out of tokens)
+                stats["completed"] += 1
+                ## Keyed on the parsed sequence: different tokenizations of the same antibody are duplicates too
+                if trie.insert("|".join(self._parse_completions([rows[row]])[0])):
+                    unique.append(rows[row])
+                    finished[row] = True
+                    continue
+                stats["duplicates"] += 1
+                stats["wasted_tokens"] += len(rows[row]) + is_stop
+                if max_restarts > 0:
+                    max_restarts -= 1
+                    stats["restarts"] += 1
+                    rows[row] = []
+                    restarted.append(row)
+                else:
+                    finished[row] = True
+            if finished.all():
+                break
+
+            ## Restarted streams forget their tokens: mask their cache entries (and this step's input) out
+            new_column = attention_mask.new_ones((batch_size, 1))
+            if restarted:
+                attention_mask = attention_mask.clone()
+                attention_mask[restarted, prompt_length:] = 0
+                new_column[restarted] = 0
+                if grammar is not None:
+                    phase, chain_length = grammar.initial_state(len(restarted), device=device)
+                    grammar_state[0][restarted] = phase
+                    grammar_state[1][restarted] = chain_length
+            attention_mask = torch.cat([attention_mask, new_column], dim=-1)
+            position_ids = (attention_mask.long().sum(dim=-1, keepdim=True) - 1).clamp(min=0)
+            outputs = self.model(
+                input_ids=next_tokens[:, None],
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+            past_key_values = outputs.past_key_values
+            logits = outputs.logits[:, -1, :]
+            if restarted:
+                logits[restarted] = prompt_logits[restarted]
+        return unique
+
+    @torch.no_grad()
+    def _decode_speculative(
+            self,
+            logits: torch.Tensor,
+            attention_mask: torch.Tensor,
+            past_key_values,
+            max_new_tokens: int=1000,
+            temperature: float=0.7,
+            top_p: float=1.0,
+            top_k: int=50
+            ) -> torch.Tensor:
+        """
+        Speculative sampling loop: the draft model proposes num_draft_tokens tokens per row, and one forward
+        pass of the peleke model scores all of them. Accepted tokens follow the model's distribution exactly
+        (see speculative_accept()). Each row keeps its own accepted drafts; the cache entries of rejected
+        drafts stay in place but are masked out of the attention mask (and out of the position IDs).
+        Args: see _decode().
+        Returns:
+            torch.Tensor: (batch, n_generated) token IDs. Rows are padded after their stop token.
+        """
+        batch_size = logits.shape[0]
+        device = logits.device
+        stop_token_ids = torch.tensor(sorted(self.stop_token_ids), device=device)
+
+        ## The first token is sampled from the prefill logits
+        next_tokens = sample_next_tokens(logits, temperature=temperature, top_p=top_p, top_k=top_k)
+        finished = torch.isin(next_tokens, stop_token_ids)
+        histories = [[token_id] for token_id in next_tokens.tolist()]
+
+        while not finished.all():
+            k = self.num_draft_tokens
+            drafts = self.draft_model.propose(histories, k).to(device)
+            cached_length = attention_mask.shape[1]
+            position_ids = attention_mask.long().sum(dim=-1, keepdim=True) + torch.arange(k + 1, device=device)
+            attention_mask = torch.cat([attention_mask, attention_mask.new_ones((batch_size, k + 1))], dim=-1)
+            outputs = self.model(
+                input_ids=torch.cat([next_tokens[:, None], drafts], dim=-1),
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+            probs = next_token_probs(outputs.logits, temperature=temperature, top_p=top_p, top_k=top_k)
+            n_accepted, next_tokens = speculative_accept(probs, drafts)
+
+            active = ~finished
+            self.speculative_stats["steps"] += int(active.sum())
+            self.speculative_stats["proposed"] += k * int(active.sum())
+            self.speculative_stats["accepted"] += int(n_accepted[active].sum())
+            self.speculative_stats["tokens"] += int(n_accepted[active].sum() + active.sum())
+
+            ## Each row emits its accepted drafts and the token after them
+            for row, (history, n, draft) in enumerate(zip(histories, n_accepted.tolist(), drafts.tolist())):
+                if finished[row]:
+                    continue
+                history.extend(draft[:n] + [int(next_tokens[row])])
+                if any(token_id in self.stop_token_ids for token_id in history[-(n + 1):]) or len(history) >= max_new_tokens:
+                    finished[row] = True
+
+            ## Only the input token and the accepted drafts stay visible in the cache
+            valid = torch.arange(k + 1, device=device)[None, :] <= n_accepted[:, None]
+            attention_mask[:, cached_length:] = (valid & active[:, None]).to(attention_mask.dtype)
+            n_rejected = k - int(n_accepted[active].max())
+            past_key_values = outputs.past_key_values
+            if n_rejected > 0:
+                past_key_values.crop(-n_rejected)
+                attention_mask = attention_mask[:, :-n_rejected]
+
+        tokens = torch.full((batch_size, min(max(len(h) for h in histories), max_new_tokens)), self.pad_token_id, dtype=torch.long)
+        for row, history in enumerate(histories):
+            history = history[:max_new_tokens]
+            tokens[row, :len(history)] = torch.tensor(history)
+        return tokens
+
+    def speculative_report(self) -> dict:
+        """
+        Returns the draft acceptance rate and the number of tokens each stream generates per forward pass
+        of speculative decoding (steps count one per active stream and forward pass).
+        """
+        stats = self.speculative_stats
+        return {
+            **stats,
+            "acceptance_rate": stats["accepted"] / stats["proposed"] if stats["proposed"] else 0.0,
+            "tokens_per_step": stats["tokens"] / stats["steps"] if stats["steps"] else 0.0,
+        }
+
+    def dedup_report(self) -> dict:
+        """
+        Completions, duplicates and restarts of deduplicated sampling, and the share of sampled tokens
+        spent on completions that turned out to be duplicates.
+        """
+        stats = self.dedup_stats
+        return {
+            **stats,
+            "duplicate_rate": stats["duplicates"] / stats["completed"] if stats["completed"] else 0.0,
+            "wasted_token_fraction": stats["wasted_tokens"] / stats["tokens"] if stats["tokens"] else 0.0,
+        }
+
+    @torch.no_grad()
+    def generate_shared_prefix(
+            self,
+            antigen_sequence: str,
+            n: int=1,
+            max_new_tokens: int=1000,
+            temperature: float=0.7,
+            top_p: float=1.0,
+            top_k: int=50,
+            constrained: bool=False,
+            speculative: bool=False,
+            trie: SequenceTrie=None,
+            max_restarts: int=None,
+            min_new_tokens: int=0
+            ) -> list:
+        """
+        Generates n antibody sequences for one antigen, prefilling the prompt only once.
+        The prompt's KV cache is forked into n sampling streams instead of being recomputed
+        for every sample as with num_return_sequences.
+        Args:
+            antigen_sequence: str, antigen sequence with epitope residues in [ ].
+            n: int, number of antibodies to sample.
+            max_new_tokens, temperature, top_p, top_k: sampling parameters.
+            constrained: bool, restrict decoding to valid heavy|light sequences (see antibody_grammar.py).
+            speculative: bool, decode with the draft model (see _decode_speculative()).
+            trie: SequenceTrie, earlier completions for this antigen. Streams that repeat one are restarted
+                (see _decode_unique()), so every returned sample is new.
+            max_restarts: int, restarts allowed with a trie (default: 4 per sample). Fewer than n samples
+                are returned if they run out.
+            min_new_tokens: int, minimum number of generated tokens (plain unconstrained decoding only, see _decode()).
+        Returns:
+            list of tuple: (h_chain, l_chain) for each sample.
+        """
+        if min_new_tokens and (speculative or trie is not None or constrained):
+            raise ValueError("min_new_tokens is only supported with plain unconstrained decoding.")
+        if speculative and self.draft_model is None:
+            raise ValueError("Speculative decoding needs a draft_model.")
+        if speculative and constrained:
+            raise ValueError("Speculative decoding does not support constrained decoding.")
+        if speculative and trie is not None:
+            raise ValueError("Speculative decoding does not support deduplication.")
+
+        inputs = self.tokenizer(self.format_prompt(antigen_sequence), return_tensors="pt")
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+
+        ## Prefill once for a single sequence
+        outputs = self.model(**inputs, past_key_values=DynamicCache(), use_cache=True)
+        past_key_values = fork_cache(outputs.past_key_values, n)
+        logits = outputs.logits[:, -1, :].expand(n, -1)
+        attention_mask = inputs["attention_mask"].expand(n, -1)
+
+        if trie is not None:
+            tokens = self._decode_unique(
+                logits,
+                attention_mask,
+                past_key_values,
+                trie,
+                max_restarts=4 * n if max_restarts is None else max_restarts,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+                grammar=self.grammar if constrained else None
+            )
+        elif speculative:
+            tokens = self._decode_speculative(
+                logits,
+                attention_mask,
+                past_key_values,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k
+            )
+        else:
+            tokens = self._decode(
+                logits,
+                attention_mask,
+                past_key_values,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+                grammar=self.grammar if constrained else None,
+                min_new_tokens=min_new_tokens
+            )
+        return self._parse_completions(tokens)
+
+    @torch.no_grad()
+    def embed_batch(self, antibody_sequences: list, layer: int=None) -> torch.Tensor:
+        """
+        Embeds antibodies as the mean hidden state of each chain's tokens. Sequences are encoded alone,
+        as the completion `Antibody: HEAVY|LIGHT<|im_end|>`, so embeddings are comparable across antigens.
+        The LM head is skipped.
+        Args:
+            antibody_sequences: list of str, `HEAVY|LIGHT` sequences.
+            layer: int, decoder layer whose output is pooled (default: the final, normalized hidden states).
+        Returns:
+            torch.Tensor: (batch, 2, hidden_size) float32 heavy and light chain embeddings, on the CPU.
+        """
+        prefix = "Antibody: "
+        texts = [f"{prefix}{seq}{PROMPT_END_TOKEN}" for seq in antibody_sequences]
+        inputs = self.tokenizer(texts, return_tensors="pt", padding=True, return_offsets_mapping=True)
+        offsets = inputs.pop("offset_mapping")
+
+        ## Assign each token to the heavy (0) or light (1) chain by the character its span starts at
+        starts, ends = offsets[..., 0], offsets[..., 1]
+        heavy_end = torch.tensor([len(prefix) + len(seq.split('|')[0]) for seq in antibody_sequences])[:, None]
+        light_end = torch.tensor([len(prefix) + len(seq) for seq in antibody_sequences])[:, None]
+        is_token = (ends > starts) & inputs["attention_mask"].bool()
+        chain_masks = torch.stack([
+            is_token & (starts >= len(prefix)) & (starts < heavy_end),
+            is_token & (starts > heavy_end) & (starts < light_end),
+        ], dim=1).float().to(self.device)
+
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        position_ids = (inputs["attention_mask"].long().cumsum(dim=-1) - 1).clamp(min=0)
+        causal_lm = self.model.get_base_model() if isinstance(self.model, PeftModel) else self.model
+        decoder = causal_lm.base_model
+        if layer is None:
+            hidden_states = decoder(**inputs, position_ids=position_ids, use_cache=False).last_hidden_state
+        else:
+            captured = {}
+            def capture(module, args, output):
+                captured["hidden_states"] = output[0] if isinstance(output, tuple) else output
+            handle = decoder.layers[layer].register_forward_hook(capture)
+            try:
+                decoder(**inputs, position_ids=position_ids, use_cache=False)
+            finally:
+                handle.remove()
+            hidden_states = captured["hidden_states"]
+
+        pooled = torch.einsum("bcs,bsh->bch", chain_masks, hidden_states.float())
+        pooled = pooled / chain_masks.sum(dim=-1, keepdim=True).clamp(min=1)
+        return pooled.cpu()
+
+    def generate(self, antigen_sequence: str, n: int=1, **sampling_params) -> list:
+        """
+        Generates n antibody sequences for a single antigen.
+        Args:
+            antigen_sequence: str, antigen sequence with epitope residues in [ ].
+            n: int, number of antibodies to sample.
+            **sampling_params: passed to generate_batch() (max_new_tokens, temperature, top_p, top_k, constrained).
+        Returns:
+            list of tuple: (h_chain, l_chain) for each sample.
+        """
+        return self.generate_batch([antigen_sequence], n=n, **sampling_params)[0]
+
+    def _generate_many_bucketed(self, antigens: dict, n_per_antigen: int, batch_size: int, seed: int=None, **sampling_params) -> dict:
+        """
+        Batches antigens of similar prompt length together and samples with num_return_sequences.
+        Seeded runs decode one antigen per batch, reseeded with antigen_seed(), since padding and
+        random draws would otherwise depend on the antigens it is batched with.
+        Returns:
+            dict: mapping of antigen IDs to lists of (h_chain, l_chain).
+        """
+        ## Bucket antigens by prompt length
+        antigen_ids = list(antigens.keys())
+        lengths = self.prompt_lengths([antigens[antigen_id] for antigen_id in antigen_ids])
+        sorted_ids = [antigen_id for _, antigen_id in sorted(zip(lengths, antigen_ids), key=lambda x: x[0])]
+        antigens_per_batch = max(1, batch_size // n_per_antigen) if seed is None else 1
+        samples_per_batch = min(n_per_antigen, batch_size)
+
+        chains_by_antigen = {antigen_id: [] for antigen_id in antigen_ids}
+        for start in range(0, len(sorted_ids), antigens_per_batch):
+            batch_ids = sorted_ids[start:start + antigens_per_batch]
+            if seed is not None:
+                torch.manual_seed(antigen_seed(seed, self.format_prompt(antigens[batch_ids[0]])))
+            logger.info(f"Generating {n_per_antigen} antibodies for {', '.join(map(str, batch_ids))}...")
+            ## More samples than fit in one batch are drawn over several passes
+            for n_done in range(0, n_per_antigen, samples_per_batch):
+                n = min(samples_per_batch, n_per_antigen - n_done)
+                batch_chains = self.generate_batch([antigens[antigen_id] for antigen_id in batch_ids], n=n, **sampling_params)
+                for antigen_id, chains in zip(batch_ids, batch_chains):
+                    chains_by_antigen[antigen_id].extend(chains)
+
+        return chains_by_antigen
+
+    def _generate_many_shared_prefix(self, antigens: dict, n_per_antigen: int, batch_size: int, dedup: bool=False, seed: int=None, **sampling_params) -> dict:
+        """
+        Prefills each unique antigen sequence once and forks it into up to batch_size sampling streams.
+        With dedup, the batches of an antigen share one SequenceTrie, so its samples are all distinct.
+        With a seed, each antigen is reseeded with antigen_seed() before its first batch.
+        Returns:
+            dict: mapping of antigen IDs to lists of (h_chain, l_chain).
+        """
+        samples_per_batch = min(n_per_antigen, batch_size)
+        chains_by_sequence = {}
+        for antigen_id, antigen_sequence in antigens.items():
+            if antigen_sequence in chains_by_sequence:
+                continue
+            logger.info(f"Generating {n_per_antigen} antibodies for {antigen_id} (shared prefix{', deduplicated' if dedup else ''})...")
+            chains = []
+            trie = SequenceTrie() if dedup else None
+            if seed is not None:
+                torch.manual_seed(antigen_seed(seed, self.format_prompt(antigen_sequence)))
+            while len(chains) < n_per_antigen:
+                n = min(samples_per_batch, n_per_antigen - len(chains))
+                batch_chains = self.generate_shared_prefix(antigen_sequence, n=n, trie=trie, **sampling_params)
+                chains.extend(batch_chains)
+                if len(batch_chains) < n:
+                    logger.warning(f"{antigen_id}: only {len(chains)} distinct antibodies before running out of restarts.")
+                    break
+            chains_by_sequence[antigen_sequence] = chains
+        return {antigen_id: chains_by_sequence[antigen_sequence] for antigen_id, antigen_sequence in antigens.items()}
+
+    def generate_many(
+            self,
+            antigens,
+            n_per_antigen: int=1,
+            batch_size: int=16,
+            share_prefix: bool=False,
+            speculative: bool=False,
+            dedup: bool=False,
+            seed: int=None,
+            model_label: str=None,
+            adapter: str=None,
+            **sampling_params
+            ) -> list:
+        """
+        Generates antibody sequences for a panel of antigens with the already-loaded model.
+        Prompts are sorted by token length and grouped into batches so that similarly sized prompts
+        share a batch, which keeps left padding to a minimum.
+        Args:
+            antigens: dict mapping antigen IDs to epitope-tagged sequences, or a list of sequences.
+            n_per_antigen: int, number of antibodies to generate per antigen.
+            batch_size: int, maximum number of sequences (antigens x n_per_antigen) decoded together.
+            share_prefix: bool, prefill each unique antigen prompt once and fork its KV cache into
+                the sampling streams (see generate_shared_prefix()) instead of batching antigens together.
+            speculative: bool, decode with the generator's draft model (implies share_prefix).
+            dedup: bool, restart sampling streams that repeat an earlier sample of the same antigen
+                (implies share_prefix; see generate_shared_prefix()).
+            seed: int, seeds the sampler, per antigen (see antigen_seed()), so an antigen's samples do not depend
+                on the rest of the panel. Seeded results are looked up in and stored to the generator's cache,
+                so rerunning an antigen with the same model, options, parameters and seed does not touch the model.
+            model_label: str, model name written to the results (defaults to the active adapter's label,
+                or the basename of model_name for merged models).
+            adapter: str, label of the loaded adapter to generate with (see load_adapter()); defaults to the active one.
+            **sampling_params: passed to generate_batch() (max_new_tokens, temperature, top_p, top_k, constrained).
+        Returns:
+            list of dict: one record per generated antibody with the columns of
+            tests/generated_antibody_sequences.csv plus the parsed h_chain and l_chain.
+        """
+        if not isinstance(antigens, dict):
+            antigens = {f"antigen_{i+1}": seq for i, seq in enumerate(antigens)}
+        if adapter is not None:
+            self.set_adapter(adapter)
+        model_label = model_label or self.active_adapter or self.model_name.rstrip('/').split('/')[-1]
+
+        antigen_ids = list(antigens.keys())
+        chains_by_antigen = {}
+        cache_keys = {}
+        if seed is not None and self.cache is not None:
+            ## Options that change which samples are drawn are part of the key
+            options = {
+                "share_prefix": bool(share_prefix or speculative or dedup),
+                "speculative": speculative,
+                "dedup": dedup,
+                "batch_size": min(batch_size, n_per_antigen)
+            }
+            if speculative:
+                options["num_draft_tokens"] = self.num_draft_tokens
+            for antigen_id, antigen_sequence in antigens.items():
+                cache_keys[antigen_id] = self._cache_key(antigen_sequence, n_per_antigen, {**sampling_params, **options}, seed)
+                cached = self.cache.get(cache_keys[antigen_id])
+                if cached is not None:
+                    chains_by_antigen[antigen_id] = [tuple(chains) for chains in cached]
+
+        missing = {antigen_id: antigens[antigen_id] for antigen_id in antigen_ids if antigen_id not in chains_by_antigen}
+        if missing:
+            if speculative:
+                chains_by_antigen.update(self._generate_many_shared_prefix(missing, n_per_antigen, batch_size, speculative=True, dedup=dedup, seed=seed, **sampling_params))
+            elif share_prefix or dedup:
+                chains_by_antigen.update(self._generate_many_shared_prefix(missing, n_per_antigen, batch_size, dedup=dedup, seed=seed, **sampling_params))
+            else:
+                chains_by_antigen.update(self._generate_many_bucketed(missing, n_per_antigen, batch_size, seed=seed, **sampling_params))
+            for antigen_id in missing:
+                if antigen_id in cache_keys:
+                    self.cache.put(cache_keys[antigen_id], [list(chains) for chains in chains_by_antigen[antigen_id]])
+        if self.cache is not None and seed is not None:
+            logger.info(f"Generation cache: {len(antigen_ids) - len(missing)} of {len(antigen_ids)} antigens cached. {self.cache.stats()}")
+
+        results = []
+        for antigen_id in antigen_ids:
+            for seq_num, (h_chain, l_chain) in enumerate(chains_by_antigen[antigen_id], 1):
+                results.append({
+                    'antigen': antigen_id,
+                    'antigen_epitope_dict': antigens[antigen_id],
+                    'model': model_label,
+                    'generated_seq_id': f"{model_label}_{antigen_id}_{seq_num:02d}",
+                    'generated_seq': f"{h_chain}|{l_chain}",
+                    'h_chain': h_chain,
+                    'l_chain': l_chain
+                })
+        return results
+
+    def sweep(self, antigens, adapters: list=None, **kwargs) -> list:
+        """
+        Generates the same antigen panel with every loaded adapter (e.g., all checkpoints of a training run)
+        without reloading the base model.
+        Args:
+            antigens: dict mapping antigen IDs to epitope-tagged sequences, or a list of sequences.
+            adapters: list of str, adapter labels to sweep (defaults to all loaded adapters, in load order).
+            **kwargs: passed to generate_many() (n_per_antigen, batch_size, seed, sampling parameters, ...).
+        Returns:
+            list of dict: the records of every adapter, with the adapter label in the `model` column.
+        """
+        results = []
+        ## Merged models have no adapters to switch between
+        for label in adapters or list(self.adapters) or [None]:
+            start = time.perf_counter()
+            results.extend(self.generate_many(antigens, adapter=label, **kwargs))
+            logger.info(f"Sweep: {label or self.model_name} done in {time.perf_counter() - start:.1f}s.")
+        return results
@@ -0,0 +1,436 @@
+from inference_backend import add_backend_arguments, configure_cpu_backend, resolve_device
+from peleke_generator import PelekeGenerator, DEFAULT_SAMPLING_PARAMS, sample_next_tokens, fork_cache, concat_caches, select_cache_rows, trim_cache_padding
+from antibody_grammar import HEAVY
+from transformers import DynamicCache
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import collections
+import itertools
+import argparse
+import logging
+import json
+import time
+import torch
+
+"""
+Peleke🦋 generation server (replaces the Gradio demo in scripts/old/app.py).
+Requests are queued and decoded with continuous batching: at every decode step new sequences join the
+running batch and finished ones are retired, so concurrent requests share the GPU instead of waiting in line.
+Tokens are streamed back as newline-delimited JSON, and every request has a deadline.
+
+Usage:
+    python peleke_server.py --model_name silicobio/peleke-phi-4 --port 8000
+
+    curl -N -X POST localhost:8000/generate -d '{"antigen": "NPPTFSPALLVV...[S][F][V]L[N]WYRMQ...", "n": 4, "timeout": 120}'
+
+Endpoints:
+    - POST /generate: JSON body with `antigen` and optional `n`, `max_new_tokens`, `temperature`, `top_p`, `top_k`,
+      `constrained`, `adapter` (label of a loaded adapter, see --adapters) and `timeout` (seconds). Streams {"seq": i, "token": ...} events, one
+      {"seq": i, "status": "done"|"timeout"|"cancelled"|"error", "h_chain": ..., "l_chain": ...} event per sequence,
+      and a final {"done": true}.
+    - GET /health: active and queued sequence counts and the loaded adapters.
+
+With --adapters, several PEFT adapters (peleke variants or checkpoints) share one resident base model.
+Sequences of different adapters are decoded in the same batch, each row routed to its own LoRA weights.
+"""
+
+## Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def validate_params(n, params: dict) -> tuple:
+    """
+    Coerces the number of sequences and the sampling parameters of a request and checks their ranges.
+    Returns:
+        tuple: (n, params) with the converted values.
+    Raises:
+        ValueError: if a value has the wrong type or is out of range.
+    """
+    def integer(name, value):
+        if isinstance(value, bool) or float(value) != int(float(value)):
+            raise ValueError(f"{name} must be an integer, got {value!r}")
+        return int(float(value))
+
+    n = integer("n", n)
+    params = {
+        **params,
+        "max_new_tokens": integer("max_new_tokens", params["max_new_tokens"]),
+        "temperature": float(params["temperature"]),
+        "top_p": float(params["top_p"]),
+        "top_k": integer("top_k", params["top_k"]),
+    }
+    if not isinstance(params["constrained"], bool):
+        raise ValueError(f"constrained must be true or false, got {params['constrained']!r}")
+    checks = [
+        (n >= 1, "n must be at least 1"),
+        (params["max_new_tokens"] >= 1, "max_new_tokens must be at least 1"),
+        (params["temperature"] > 0, "temperature must be positive"),
+        (0 < params["top_p"] <= 1, "top_p must be in (0, 1]"),
+        (params["top_k"] >= 0, "top_k must be non-negative"),
+    ]
+    for ok, message in checks:
+        if not ok:
+            raise ValueError(message)
+    return n, params
+
+
+class GenerationRequest:
+    """
+    A client request for n antibodies for one antigen. Events are delivered through an asyncio queue.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, antigen: str, n: int, params: dict, deadline: float, loop: asyncio.AbstractEventLoop, adapter: str=None):
+        self.id = next(self._ids)
+        self.antigen = antigen
+        self.adapter = adapter
+        self.n = n
+        self.params = params
+        self.deadline = deadline
+        self.cancelled = False
+        self.remaining = n
+        self._loop = loop
+        self._events = asyncio.Queue()
+
+    def emit(self, event: dict):
+        """
+        Sends an event to the client (safe to call from the decode thread).
+        """
+        self._loop.call_soon_threadsafe(self._events.put_nowait, event)
+
+    def finish_sequence(self, event: dict):
+        self.emit(event)
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.emit({"done": True})
+
+    async def events(self):
+        while True:
+            event = await self._events.get()
+            yield event
+            if event.get("done"):
+                return
+
+
+class Stream:
+    """
+    One sampled sequence occupying a slot (row) of the running batch.
+    """
+    def __init__(self, request: GenerationRequest, index: int):
+        self.request = request
+        self.index = index
+        self.tokens = []
+
+
+class ContinuousBatchingEngine:
+    """
+    Runs a single decode loop over all active sequences, admitting and retiring sequences at every step.
+    Args:
+        generator: PelekeGenerator, the loaded model.
+        max_batch_size: int, maximum number of sequences decoded together.
+    """
+    def __init__(self, generator: PelekeGenerator, max_batch_size: int=32):
+        self.generator = generator
+        self.max_batch_size = max_batch_size
+        self.pending = collections.deque()
+        self.streams = []
+        self.past_key_values = None
+        self.attention_mask = None
+        self.logits = None
+        self.phase = None
+        self.chain_length = None
+        self.steps = 0
+        self._admitting = []
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._wakeup = None
+
+    def submit(self, antigen: str, n: int=1, timeout: float=300.0, adapter: str=None, **params) -> GenerationRequest:
+        """
+        Queues a request. Its sequences join the running batch at the next decode step with free slots.
+        """
+        loop = asyncio.get_running_loop()
+        unknown = set(params) - set(DEFAULT_SAMPLING_PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+        if adapter is not None and adapter not in self.generator.adapters:
+            raise ValueError(f"Unknown adapter {adapter}. Loaded adapters: {', '.join(self.generator.adapters)}")
+        n, params = validate_params(n, {**DEFAULT_SAMPLING_PARAMS, **params})
+        request = GenerationRequest(antigen, n, params, time.monotonic() + timeout, loop, adapter=adapter or self.generator.active_adapter)
+        ## Requests larger than the batch are admitted in chunks
+        for start in range(0, n, self.max_batch_size):
+            self.pending.append((request, list(range(start, min(n, start + self.max_batch_size)))))
+        self._wakeup.set()
+        return request
+
+    @property
+    def queued(self) -> int:
+        return sum(len(indices) for _, indices in list(self.pending))
+
+    async def run(self):
+        """
+        Background task driving the decode loop. Model calls run in a worker thread so the event loop stays responsive.
+        """
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.streams and not self.pending:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+            try:
+                await loop.run_in_executor(self._executor, self.step)
+            except Exception as e:
+                ## Fail the sequences of this batch only; the loop keeps serving new requests
+                logger.exception(f"Decode step failed; dropping {len(self.streams) + len(self._admitting)} active sequences.")
+                self._fail_batch(e)
+
+    def _fail_batch(self, error: Exception):
+        for stream in self.streams + self._admitting:
+            stream.request.finish_sequence({"seq": stream.index, "status": "error", "error": str(error), "h_chain": "", "l_chain": ""})
+        self.streams, self._admitting = [], []
+        self.past_key_values = self.attention_mask = self.logits = self.phase = self.chain_length = None
+
+    def _adapter_kwargs(self, adapters: list) -> dict:
+        """
+        Per-row adapter routing for a forward pass (only needed when more than one adapter is loaded).
+        """
+        if len(self.generator.adapters) < 2:
+            return {}
+        return {"adapter_names": [self.generator.peft_adapter_name(adapter) for adapter in adapters]}
+
+    def _max_new_tokens(self, params: dict) -> int:
+        if params["constrained"]:
+            return min(params["max_new_tokens"], self.generator.grammar.max_new_tokens)
+        return params["max_new_tokens"]
+
+    def _expire_pending(self, now: float):
+        for _ in range(len(self.pending)):
+            request, indices = self.pending.popleft()
+            if request.cancelled or now > request.deadline:
+                status = "cancelled" if request.cancelled else "timeout"
+                for index in indices:
+                    request.finish_sequence({"seq": index, "status": status, "h_chain": "", "l_chain": ""})
+            else:
+                self.pending.append((request, indices))
+
+    @torch.no_grad()
+    def _admit(self):
+        """
+        Prefills waiting requests (once per prompt, forked into its sequences) and merges them into the running batch.
+        """
+        generator = self.generator
+        caches, masks, logits = [], [], []
+        ## Kept on the engine so a failed prefill can still fail the sequences taken off the queue
+        new_streams = self._admitting = []
+        if self.streams:
+            caches.append(self.past_key_values)
+            masks.append(self.attention_mask)
+            logits.append(self.logits)
+        while self.pending and len(self.streams) + len(new_streams) + len(self.pending[0][1]) <= self.max_batch_size:
+            request, indices = self.pending.popleft()
+            new_streams.extend(Stream(request, index) for index in indices)
+            inputs = generator.tokenizer(generator.format_prompt(request.antigen), return_tensors="pt")
+            inputs = {k: v.to(generator.device) for k, v in inputs.items()}
+            outputs = generator.model(**inputs, past_key_values=DynamicCache(), use_cache=True, **self._adapter_kwargs([request.adapter]))
+            caches.append(fork_cache(outputs.past_key_values, len(indices)))
+            masks.append(inputs["attention_mask"].expand(len(indices), -1))
+            logits.append(outputs.logits[:, -1, :].float().expand(len(indices), -1))
+        if not new_streams:
+            return
+
+        self.past_key_values, self.attention_mask = concat_caches(caches, masks)
+        self.logits = torch.cat(logits, dim=0)
+        ## Grammar state of the new rows (only used by constrained requests)
+        phase = torch.full((len(new_streams),), HEAVY, dtype=torch.long, device=self.logits.device)
+        chain_length = torch.zeros(len(new_streams), dtype=torch.long, device=self.logits.device)
+        if self.streams:
+            phase = torch.cat([self.phase, phase])
+            chain_length = torch.cat([self.chain_length, chain_length])
+        self.phase, self.chain_length = phase, chain_length
+        self.streams.extend(new_streams)
+        self._admitting = []
+        logger.info(f"Admitted {len(new_streams)} sequences; {len(self.streams)} active, {self.queued} queued.")
+
+    def _sample(self) -> torch.Tensor:
+        """
+        Samples the next token of every row, grouping rows that share sampling parameters.
+        """
+        next_tokens = torch.empty(len(self.streams), dtype=torch.long, device=self.logits.device)
+        groups = collections.defaultdict(list)
+        for row, stream in enumerate(self.streams):
+            params = stream.request.params
+            groups[(params["temperature"], params["top_p"], params["top_k"], params["constrained"])].append(row)
+        for (temperature, top_p, top_k, constrained), rows in groups.items():
+            rows = torch.tensor(rows, device=self.logits.device)
+            if constrained:
+                grammar = self.generator.grammar
+                candidate_logits = grammar.candidate_logits(self.logits[rows], self.phase[rows], self.chain_length[rows])
+                next_tokens[rows] = grammar.candidate_ids[sample_next_tokens(candidate_logits, temperature=temperature, top_p=top_p, top_k=top_k)]
+            else:
+                next_tokens[rows] = sample_next_tokens(self.logits[rows], temperature=temperature, top_p=top_p, top_k=top_k)
+        if any(stream.request.params["constrained"] for stream in self.streams):
+            self.generator.grammar.advance(self.phase, self.chain_length, next_tokens)
+        return next_tokens
+
+    def _retire(self, stream: Stream, status: str):
+        h_chain, l_chain = self.generator._parse_completions([stream.tokens])[0]
+        stream.request.finish_sequence({"seq": stream.index, "status": status, "h_chain": h_chain, "l_chain": l_chain, "n_tokens": len(stream.tokens)})
+
+    @torch.no_grad()
+    def step(self):
+        """
+        One decode step: expire, admit, sample, stream, retire, and run the model on the surviving rows.
+        """
+        generator = self.generator
+        now = time.monotonic()
+        self._expire_pending(now)
+        self._admit()
+        if not self.streams:
+            return
+
+        next_tokens = self._sample()
+        keep = []
+        for row, (stream, token_id) in enumerate(zip(self.streams, next_tokens.tolist())):
+            request = stream.request
+            if request.cancelled:
+                self._retire(stream, "cancelled")
+                continue
+            if token_id in generator.stop_token_ids:
+                self._retire(stream, "done")
+                continue
+            stream.tokens.append(token_id)
+            request.emit({"seq": stream.index, "token": generator.tokenizer.decode([token_id])})
+            if len(stream.tokens) >= self._max_new_tokens(request.params):
+                self._retire(stream, "done")
+            elif now > request.deadline:
+                self._retire(stream, "timeout")
+            else:
+                keep.append(row)
+        self.steps += 1
+
+        if not keep:
+            self.streams = []
+            self.past_key_values = self.attention_mask = self.logits = self.phase = self.chain_length = None
+            return
+        if len(keep) < len(self.streams):
+            rows = torch.tensor(keep, device=self.logits.device)
+            self.streams = [self.streams[row] for row in keep]
+            self.past_key_values = select_cache_rows(self.past_key_values, rows)
+            self.attention_mask = self.attention_mask[rows]
+            self.past_key_values, self.attention_mask = trim_cache_padding(self.past_key_values, self.attention_mask)
+            self.phase, self.chain_length, next_tokens = self.phase[rows], self.chain_length[rows], next_tokens[rows]
+
+        self.attention_mask = torch.cat([self.attention_mask, self.attention_mask.new_ones((len(self.streams), 1))], dim=-1)
+        position_ids = self.attention_mask.long().sum(dim=-1, keepdim=True) - 1
+        outputs = generator.model(
+            input_ids=next_tokens[:, None],
+            attention_mask=self.attention_mask,
+            position_ids=position_ids,
+            past_key_values=self.past_key_values,
+            use_cache=True,
+            **self._adapter_kwargs([stream.request.adapter for stream in self.streams]),
+        )
+        self.past_key_values = outputs.past_key_values
+        self.logits = outputs.logits[:, -1, :].float()
+
+
+async def write_response(writer: asyncio.StreamWriter, status: str, payload: dict):
+    body = json.dumps(payload).encode()
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+    await writer.drain()
+
+
+async def write_chunk(writer: asyncio.StreamWriter, data: bytes):
+    writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+    await writer.drain()
+
+
+def make_handler(engine: ContinuousBatchingEngine, default_timeout: float):
+    async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        request = None
+        try:
+            try:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = line.decode().split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+            except ValueError as e:
+                ## Malformed request or header line, undecodable bytes or a bad Content-Length
+                await write_response(writer, "400 Bad Request", {"error": f"Malformed request: {e}"})
+                return
+
+            if method == "GET" and path == "/health":
+                await write_response(writer, "200 OK", {"active": len(engine.streams), "queued": engine.queued, "steps": engine.steps, "adapters": list(engine.generator.adapters)})
+                return
+            if method != "POST" or path != "/generate":
+                await write_response(writer, "404 Not Found", {"error": f"No route for {method} {path}"})
+                return
+
+            try:
+                payload = json.loads(body or b"{}")
+                antigen = payload.pop("antigen")
+                n = payload.pop("n", 1)
+                timeout = float(payload.pop("timeout", default_timeout))
+                if not timeout > 0:
+                    raise ValueError("timeout must be positive")
+                request = engine.submit(antigen, n=n, timeout=timeout, **payload)
+            except (KeyError, ValueError, TypeError, OverflowError) as e:
+                await write_response(writer, "400 Bad Request", {"error": f"Invalid request: {e}"})
+                return
+
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+            async for event in request.events():
+                await write_chunk(writer, (json.dumps(event) + "\n").encode())
+            await write_chunk(writer, b"")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            ## Client went away: free its batch slots
+            if request is not None:
+                request.cancelled = True
+        finally:
+            writer.close()
+
+    return handle_connection
+
+
+async def serve(engine: ContinuousBatchingEngine, host: str, port: int, default_timeout: float):
+    engine_task = asyncio.create_task(engine.run())
+    server = await asyncio.start_server(make_handler(engine, default_timeout), host, port)
+    logger.info(f"Peleke server listening on http://{host}:{port}")
+    async with server:
+        await asyncio.gather(server.serve_forever(), engine_task)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Continuous-batching antibody generation server.")
+    parser.add_argument("--model_name", type=str, default="silicobio/peleke-phi-4", help="Hugging Face ID or path of the peleke adapter (or merged model).")
+    parser.add_argument("--base_model_path", type=str, default=None, help="Override the base model recorded in the adapter config.")
+    parser.add_argument("--adapters", type=str, nargs="+", default=None, help="More adapters to serve on the same base model (requests select one with `adapter`).")
+    parser.add_argument("--device", type=str, default="auto", help="Device to run generation on ('auto', 'cpu', 'cuda', ...).")
+    add_backend_arguments(parser)
+    parser.add_argument("--crop_flank", type=int, default=None, help="Crop antigens to windows of this many residues on either side of the [epitope] residues.")
+    parser.add_argument("--prompt_token_budget", type=int, default=None, help="Narrow the crop (see --crop_flank) until each prompt fits this many tokens.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to bind.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to bind.")
+    parser.add_argument("--max_batch_size", type=int, default=32, help="Maximum number of sequences decoded together.")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Default per-request deadline in seconds.")
+    args = parser.parse_args()
+
+    if resolve_device(args.device) == "cpu":
+        configure_cpu_backend(args.num_threads, args.num_interop_threads, args.numa_node)
+    generator = PelekeGenerator(args.model_name, base_model_path=args.base_model_path, device=args.device, quantization=args.quantization,
+                                crop_flank=args.crop_flank, prompt_token_budget=args.prompt_token_budget)
+    for adapter_path in args.adapters or []:
+        generator.load_adapter(adapter_path)
+    engine = ContinuousBatchingEngine(generator, max_batch_size=args.max_batch_size)
+    asyncio.run(serve(engine, args.host, args.port, args.timeout))
+
+
+if __name__ == "__main__":
+    main()
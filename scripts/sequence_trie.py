@@ -0,0 +1,49 @@
+"""
+Prefix trie of the antibody sequences sampled for one antigen. Sampling streams that share a
+trie are checked against it when they finish, so a stream that reproduces an earlier completion
+can be restarted at once instead of being discarded after the whole batch is done
+(see PelekeGenerator.generate_shared_prefix(..., trie=...)).
+"""
+
+END = None
+
+
+class SequenceTrie:
+    """
+    Set of sequences (strings or token lists) stored as nested dicts, one level per element. Sequences
+    that share a prefix (e.g., the near-deterministic framework of the heavy chain) share its nodes.
+    """
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+        self.nodes = 1
+
+    def insert(self, sequence) -> bool:
+        """
+        Adds a sequence.
+        Returns:
+            bool: True if the sequence is new, False if it was already in the trie.
+        """
+        node = self.root
+        for item in sequence:
+            child = node.get(item)
+            if child is None:
+                child = node[item] = {}
+                self.nodes += 1
+            node = child
+        if END in node:
+            return False
+        node[END] = True
+        self.size += 1
+        return True
+
+    def __contains__(self, sequence) -> bool:
+        node = self.root
+        for item in sequence:
+            node = node.get(item)
+            if node is None:
+                return False
+        return END in node
+
+    def __len__(self) -> int:
+        return self.size
@@ -0,0 +1,448 @@
+from contextlib import contextmanager, redirect_stdout
+import pandas as pd
+import multiprocessing
+import statistics
+import tempfile
+import platform
+import resource
+import argparse
+import logging
+import shutil
+import gzip
+import json
+import time
+import sys, os
+
+"""
+Benchmarks for the structure-processing hot paths of the data pipeline, on the data/sabdab/pdbs_test
+fixtures and on scaled-up synthetic complexes (a fixture with its antigen chains copied n times, so
+every step sees more atoms and antigen chains). Timed cases:
+
+    parse       reading the PDB with BioPandas
+    sequences   extracting chain sequences from ATOM records (as in 01_get_structure_seqs.ipynb)
+    pandaprot   epitope detection with PandaProt (get_contacts.get_epitope_residues_pandaprot)
+    intercaat   interface residues of both antibody chains with intercaat (data/old/intercaat_testing)
+    highlight   residue number mapping and epitope bracketing of each antigen chain (get_contacts.py)
+    numbering   Chothia numbering of the heavy and light chains with abnumber
+
+Each case first runs once untimed (which warms up imports and caches), is then timed over --repeats runs
+(min and median), and finally runs once more in a forked child process whose peak RSS growth (ru_maxrss)
+is its peak memory, including memory allocated by C extensions. Results, with the atom and residue counts of each structure, are written to a .json.
+Given a baseline .json (e.g., from the main branch, saved with --save_baseline), cases that got slower
+or use more memory than --tolerance allows are reported as regressions. Cases whose dependencies
+are not installed are recorded as skipped.
+
+Usage:
+    python benchmark_structures.py --output_file benchmark_results.json --save_baseline benchmark_baseline.json
+    python benchmark_structures.py --output_file benchmark_results.json --baseline_file benchmark_baseline.json --scales 2 4 8
+"""
+
+## Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(REPO_DIR, "data", "sabdab", "pdbs_test")
+SABDAB_DIR = os.path.join(REPO_DIR, "data", "sabdab")
+INTERCAAT_DIR = os.path.join(REPO_DIR, "data", "old", "intercaat_testing")
+
+## Heavy chain, light chain and antigen (or partner) chains of each fixture
+FIXTURES = {
+    "1a14": ("H", "L", ["N"]),
+    "1a2y": ("B", "A", ["C"]),
+    "1a2y_modified": ("B", "A", ["C"]),
+    "1a3r": ("H", "L", ["P"]),
+    "12e8": ("H", "L", ["M", "P"]),  ## Two Fabs in the asymmetric unit; the second one is the partner
+    "1a4j": ("H", "L", ["A", "B"]),
+    "1a4k": ("H", "L", ["A", "B"]),
+    "15c8": ("H", "L", []),
+    "1a0q": ("H", "L", []),
+    "1a3l": ("H", "L", [])
+}
+CASES = ["parse", "sequences", "pandaprot", "intercaat", "highlight", "numbering"]
+CHAIN_IDS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+
+
+class Skip(Exception):
+    pass
+
+
+def open_pdb(path: str):
+    return gzip.open(path, 'rt') if path.endswith('.gz') else open(path)
+
+
+def count_structure(path: str) -> dict:
+    """
+    Atom and residue counts of a PDB file.
+    """
+    atoms, residues = 0, set()
+    with open_pdb(path) as f:
+        for line in f:
+            if line.startswith(("ATOM", "HETATM")):
+                atoms += 1
+                residues.add((line[21], line[22:27]))
+    return {"atoms": atoms, "residues": len(residues)}
+
+
+def scale_complex(path: str, antigen_ids: list, copies: int, output_path: str) -> list:
+    """
+    Writes a synthetic complex with copies of the antigen chains, side by side along x.
+    Returns:
+        list: antigen chain IDs of the synthetic complex (originals first).
+    """
+    with open_pdb(path) as f:
+        lines = [line.rstrip("\n") for line in f if line.startswith(("ATOM", "HETATM", "TER"))]
+    used = {line[21] for line in lines if len(line) > 21}
+    free = [c for c in CHAIN_IDS if c not in used]
+    xs = [float(line[30:38]) for line in lines if line.startswith(("ATOM", "HETATM"))]
+    shift = 1.5 * (max(xs) - min(xs)) + 10
+
+    scaled_ids = list(antigen_ids)
+    copied = []
+    for copy in range(1, copies):
+        mapping = {chain: free.pop(0) for chain in antigen_ids}
+        scaled_ids += mapping.values()
+        for line in lines:
+            if line.startswith(("ATOM", "HETATM")) and line[21] in mapping:
+                x = float(line[30:38]) + copy * shift
+                copied.append(f"{line[:21]}{mapping[line[21]]}{line[22:30]}{x:8.3f}{line[38:]}")
+        copied.append("TER")
+    with open(output_path, 'w') as f:
+        f.write("\n".join(lines + copied + ["END"]) + "\n")
+    return scaled_ids
+
+
+## Timed cases: each takes the prepared structure (and the state of earlier cases) and raises Skip when it cannot run
+
+def case_parse(structure: dict, state: dict):
+    try:
+        from biopandas.pdb import PandasPdb
+    except ImportError as e:
+        raise Skip(str(e))
+    state["pdb_df"] = PandasPdb().read_pdb(structure["path"])
+
+
+def extract_sequence_from_pdb(pdb_df, chain_id: str) -> str:
+    """
+    ATOM-record sequence of a chain, as in 01_get_structure_seqs.ipynb.
+    """
+    from Bio.SeqUtils import seq1
+    sequence = ''
+    seen_residues = set()
+    for index, row in pdb_df.df['ATOM'].iterrows():
+        resn = row['residue_number']
+        if row['chain_id'] == chain_id and resn not in seen_residues:
+            seen_residues.add(resn)
+            sequence += seq1(row['residue_name'])
+    return sequence
+
+
+def case_sequences(structure: dict, state: dict):
+    if "pdb_df" not in state:
+        raise Skip("needs parse")
+    try:
+        import Bio
+    except ImportError as e:
+        raise Skip(str(e))
+    chains = [structure["h_chain_id"], structure["l_chain_id"]] + structure["antigen_ids"]
+    state["sequences"] = {chain: extract_sequence_from_pdb(state["pdb_df"], chain) for chain in chains}
+
+
+def import_get_contacts():
+    if SABDAB_DIR not in sys.path:
+        sys.path.insert(0, SABDAB_DIR)
+    try:
+        import get_contacts
+    except ImportError as e:
+        raise Skip(str(e))
+    get_contacts.logger.setLevel(logging.WARNING)
+    return get_contacts
+
+
+def case_pandaprot(structure: dict, state: dict):
+    if not structure["antigen_ids"]:
+        raise Skip("no antigen chains")
+    get_contacts = import_get_contacts()
+    state["epitope_residues"] = get_contacts.get_epitope_residues_pandaprot(
+        structure["plain_path"], structure["h_chain_id"], structure["l_chain_id"], structure["antigen_ids"]
+    )
+
+
+def case_intercaat(structure: dict, state: dict):
+    if not structure["antigen_ids"]:
+        raise Skip("no antigen chains")
+    if INTERCAAT_DIR not in sys.path:
+        sys.path.insert(0, INTERCAAT_DIR)
+    try:
+        from intercaat.interface import InterfaceAnalyzer
+    except ImportError as e:
+        raise Skip(str(e))
+    ## intercaat reads its config relative to the working directory
+    with working_directory(INTERCAAT_DIR), open(os.devnull, 'w') as fnull, redirect_stdout(fnull):
+        for chain in [structure["h_chain_id"], structure["l_chain_id"]]:
+            InterfaceAnalyzer(structure["path"], chain, structure["antigen_ids"], path="").get_interface_residues()
+
+
+def case_highlight(structure: dict, state: dict):
+    if not structure["antigen_ids"]:
+        raise Skip("no antigen chains")
+    if "pdb_df" not in state or "sequences" not in state:
+        raise Skip("needs parse and sequences")
+    get_contacts = import_get_contacts()
+    residues = state.get("epitope_residues") or structure["epitope_residues"]
+    for chain in structure["antigen_ids"]:
+        resnum_to_idx = get_contacts.build_resnum_to_seq_idx_map(state["pdb_df"], chain)
+        get_contacts.highlight_epitope_in_sequence(state["sequences"][chain], chain, residues, resnum_to_idx)
+
+
+def case_numbering(structure: dict, state: dict):
+    if "sequences" not in state:
+        raise Skip("needs sequences")
+    try:
+        from abnumber import Chain
+    except ImportError as e:
+        raise Skip(str(e))
+    for chain in [structure["h_chain_id"], structure["l_chain_id"]]:
+        try:
+            Chain(state["sequences"][chain], scheme="chothia")
+        except Exception:
+            pass
+
+
+CASE_FUNCTIONS = {
+    "parse": case_parse,
+    "sequences": case_sequences,
+    "pandaprot": case_pandaprot,
+    "intercaat": case_intercaat,
+    "highlight": case_highlight,
+    "numbering": case_numbering
+}
+
+
+@contextmanager
+def working_directory(path: str):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def max_rss_mb() -> float:
+    ## ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def _peak_memory_child(func, structure: dict, state: dict, connection):
+    try:
+        before = max_rss_mb()
+        func(structure, state)
+        connection.send(max_rss_mb() - before)
+    except BaseException:
+        connection.send(None)
+    finally:
+        connection.close()
+
+
+def peak_memory(func, structure: dict, state: dict) -> float:
+    """
+    Peak memory (MB) of one run of a case: the growth of the maximum RSS of a forked child process that
+    starts from the warmed-up state. Returns None where fork is not available or the run failed.
+    """
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_peak_memory_child, args=(func, structure, state, sender))
+    process.start()
+    sender.close()
+    peak = receiver.recv() if receiver.poll(None) else None
+    process.join()
+    return peak
+
+
+def time_case(func, structure: dict, state: dict, repeats: int) -> dict:
+    """
+    Runs a case once to warm it up, times repeats runs, then measures its peak memory in a child process.
+    """
+    func(structure, state)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(structure, state)
+        times.append(time.perf_counter() - start)
+    return {"min_s": min(times), "median_s": statistics.median(times), "peak_mb": peak_memory(func, structure, state)}
+
+
+def sample_epitope(path: str, antigen_ids: list, every: int=5) -> list:
+    """
+    Stand-in epitope (every few residues of each antigen chain) for highlighting when PandaProt did not run.
+    """
+    residues = {}
+    with open_pdb(path) as f:
+        for line in f:
+            if line.startswith("ATOM") and line[21] in antigen_ids:
+                residues.setdefault((line[21], int(line[22:26])), line[17:20])
+    return [f"{chain}:{name} {number}" for i, ((chain, number), name) in enumerate(residues.items()) if i % every == 0]
+
+
+def prepare_structures(fixtures: list, scales: list, scale_fixture: str, work_dir: str) -> list:
+    """
+    Fixture files (and plain-text copies for tools that cannot read .gz) plus the synthetic complexes.
+    """
+    structures = []
+    for pdb_id in fixtures:
+        h_chain_id, l_chain_id, antigen_ids = FIXTURES[pdb_id]
+        path = os.path.join(FIXTURES_DIR, f"{pdb_id}.pdb.gz")
+        plain_path = os.path.join(work_dir, f"{pdb_id}.pdb")
+        with gzip.open(path, 'rb') as f_in, open(plain_path, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        structures.append({"name": pdb_id, "scale": 1, "path": path, "plain_path": plain_path,
+                           "h_chain_id": h_chain_id, "l_chain_id": l_chain_id, "antigen_ids": antigen_ids})
+
+    h_chain_id, l_chain_id, antigen_ids = FIXTURES[scale_fixture]
+    for scale in scales:
+        path = os.path.join(work_dir, f"{scale_fixture}_x{scale}.pdb")
+        scaled_ids = scale_complex(os.path.join(FIXTURES_DIR, f"{scale_fixture}.pdb.gz"), antigen_ids, scale, path)
+        structures.append({"name": f"{scale_fixture}_x{scale}", "scale": scale, "path": path, "plain_path": path,
+                           "h_chain_id": h_chain_id, "l_chain_id": l_chain_id, "antigen_ids": scaled_ids})
+
+    for structure in structures:
+        structure.update(count_structure(structure["plain_path"]))
+        structure["epitope_residues"] = sample_epitope(structure["plain_path"], structure["antigen_ids"])
+    return structures
+
+
+def run_benchmarks(structures: list, cases: list, repeats: int) -> list:
+    results = []
+    for structure in structures:
+        state = {}
+        for case in cases:
+            row = {"case": case, "structure": structure["name"], "scale": structure["scale"],
+                   "atoms": structure["atoms"], "residues": structure["residues"], "repeats": repeats, "memory": "max_rss"}
+            try:
+                row.update(status="ok", **time_case(CASE_FUNCTIONS[case], structure, state, repeats))
+                peak = "n/a" if row["peak_mb"] is None else f"{row['peak_mb']:.1f} MB"
+                logger.info(f"{structure['name']} {case}: {1000 * row['median_s']:.1f} ms (min {1000 * row['min_s']:.1f} ms), peak {peak}")
+            except Skip as e:
+                row.update(status="skipped", error=str(e))
+                logger.info(f"{structure['name']} {case}: skipped ({e})")
+            except Exception as e:
+                row.update(status="error", error=f"{type(e).__name__}: {e}")
+                logger.error(f"{structure['name']} {case}: {row['error']}")
+            results.append(row)
+    return results
+
+
+def compare_with_baseline(results: list, baseline: list, tolerance: float=0.2, min_time_diff: float=0.002, min_memory_diff: float=1.0) -> list:
+    """
+    Compares the best (min) time and peak memory of every case with the baseline.
+    A case regresses if it is slower (or uses more memory) by more than tolerance and by more than the
+    absolute minimum difference, which keeps sub-millisecond noise from being reported.
+    """
+    reference = {(row["case"], row["structure"]): row for row in baseline if row.get("status") == "ok"}
+    comparison = []
+    for row in results:
+        base = reference.get((row["case"], row["structure"]))
+        if row["status"] != "ok" or base is None:
+            continue
+        time_ratio = row["min_s"] / base["min_s"] if base["min_s"] > 0 else float("inf")
+        slower = time_ratio > 1 + tolerance and row["min_s"] - base["min_s"] > min_time_diff
+        ## Memory is only compared when both runs measured it (baselines from before the RSS measurement used tracemalloc)
+        memory_ratio, larger = None, False
+        if row.get("peak_mb") is not None and base.get("peak_mb") is not None and base.get("memory") == row.get("memory"):
+            memory_ratio = row["peak_mb"] / base["peak_mb"] if base["peak_mb"] > 0 else float("inf")
+            larger = memory_ratio > 1 + tolerance and row["peak_mb"] - base["peak_mb"] > min_memory_diff
+        comparison.append({
+            "case": row["case"],
+            "structure": row["structure"],
+            "baseline_min_s": base["min_s"],
+            "min_s": row["min_s"],
+            "time_ratio": time_ratio,
+            "baseline_peak_mb": base.get("peak_mb"),
+            "peak_mb": row["peak_mb"],
+            "memory_ratio": memory_ratio,
+            "regression": ", ".join(name for name, flag in [("time", slower), ("memory", larger)] if flag)
+        })
+    return comparison
+
+
+def environment() -> dict:
+    packages = {}
+    for name in ["pandas", "numpy", "scipy", "biopandas", "Bio", "pandaprot", "abnumber"]:
+        try:
+            packages[name] = getattr(__import__(name), "__version__", "installed")
+        except ImportError:
+            packages[name] = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(), "packages": packages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Benchmark structure parsing, sequence extraction, contacts, highlighting and numbering.")
+    parser.add_argument("--fixtures", type=str, nargs='+', default=list(FIXTURES), choices=list(FIXTURES), help="Fixtures in data/sabdab/pdbs_test to benchmark.")
+    parser.add_argument("--cases", type=str, nargs='+', default=CASES, choices=CASES, help="Cases to run (parse and sequences feed the later cases).")
+    parser.add_argument("--scales", type=int, nargs='*', default=[2, 4, 8], help="Antigen copies of the synthetic complexes.")
+    parser.add_argument("--scale_fixture", type=str, default="1a14", choices=[k for k, v in FIXTURES.items() if v[2]], help="Fixture the synthetic complexes are built from.")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per case.")
+    parser.add_argument("--output_file", type=str, default="benchmark_results.json", help="Results .json.")
+    parser.add_argument("--baseline_file", type=str, default=None, help="Results .json of an earlier run to compare with.")
+    parser.add_argument("--save_baseline", type=str, default=None, help="Also save these results as the baseline .json.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative slowdown (or memory growth) reported as a regression.")
+    parser.add_argument("--fail_on_regression", action='store_true', help="Exit with status 1 if any case regressed.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="peleke_benchmark_")
+    try:
+        structures = prepare_structures(args.fixtures, args.scales, args.scale_fixture, work_dir)
+        start = time.perf_counter()
+        results = run_benchmarks(structures, args.cases, args.repeats)
+        wall_time = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "environment": environment(),
+        "config": {"repeats": args.repeats, "scales": args.scales, "scale_fixture": args.scale_fixture},
+        "wall_time_s": wall_time,
+        "max_rss_mb": max_rss_mb(),
+        "results": results
+    }
+
+    regressions = []
+    if args.baseline_file and not os.path.exists(args.baseline_file):
+        logger.warning(f"Baseline {args.baseline_file} not found; nothing to compare with.")
+    elif args.baseline_file:
+        with open(args.baseline_file) as f:
+            baseline = json.load(f)
+        report["baseline_file"] = args.baseline_file
+        report["comparison"] = compare_with_baseline(results, baseline["results"], tolerance=args.tolerance)
+        regressions = [row for row in report["comparison"] if row["regression"]]
+        for row in report["comparison"]:
+            memory = "memory not compared" if row["memory_ratio"] is None else f"{row['memory_ratio']:.2f}x memory"
+            logger.info(f"{row['structure']} {row['case']}: {row['time_ratio']:.2f}x time, {memory} of the baseline"
+                        + (f"  REGRESSION ({row['regression']})" if row["regression"] else ""))
+
+    with open(args.output_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    ## Summary per case
+    df = pd.DataFrame(results)
+    ok = df[df["status"] == "ok"]
+    if len(ok):
+        summary = ok.groupby("case", sort=False).agg(structures=("structure", "count"), total_s=("median_s", "sum"), peak_mb=("peak_mb", "max"))
+        logger.info(f"Benchmarks ran in {wall_time:.1f} s (max RSS {report['max_rss_mb']:.0f} MB):\n{summary.to_string()}")
+    skipped = df[df["status"] != "ok"].groupby(["case", "status"]).size()
+    if len(skipped):
+        logger.info(f"Not run:\n{skipped.to_string()}")
+    if regressions:
+        logger.warning(f"{len(regressions)} regressions against {args.baseline_file}.")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+from scipy.spatial import cKDTree
+from scipy import stats
+import pandas as pd
+import numpy as np
+import argparse
+import logging
+import time
+import os
+
+"""
+Solvent accessible and buried surface areas of antibody-antigen complexes with a vectorized
+Shrake-Rupley algorithm: every heavy atom gets a sphere of test points (radius + probe), and a point
+is accessible if no neighboring atom's sphere contains it. Neighbor pairs come from a k-d tree and the
+occlusion tests run on NumPy arrays in blocks of atoms.
+
+The complex and the separated partners (antibody and antigen) are computed in one pass. Each test
+point is checked separately against atoms of its own partner and against atoms of the other partner.
+It is accessible in the free partner if no atom of its own partner occludes it, and accessible in the
+complex if no atom at all does. The buried surface area is SASA(antibody) + SASA(antigen) - SASA(complex),
+the same definition as the `bsa` term of `haddock3-score`. Per-residue burial marks the paratope
+and epitope residues.
+
+Usage:
+    python buried_surface.py --structures_dir /mnt/tests/structures/predicted_complexes --compare_with binding_affinity_results.csv
+"""
+
+## Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+## Atomic radii (Å) by element, as in Biopython's ShrakeRupley
+ATOMIC_RADII = {"C": 1.70, "N": 1.55, "O": 1.52, "S": 1.80, "P": 1.80, "SE": 1.90, "F": 1.47, "CL": 1.75, "BR": 1.85, "I": 1.98}
+DEFAULT_RADIUS = 1.80
+PROBE_RADIUS = 1.4
+
+
+def sphere_points(n: int) -> np.ndarray:
+    """
+    n nearly uniform points on the unit sphere (golden spiral).
+    """
+    i = np.arange(n) + 0.5
+    z = 1 - 2 * i / n
+    r = np.sqrt(1 - z**2)
+    phi = np.pi * (1 + 5**0.5) * i
+    return np.stack([r * np.cos(phi), r * np.sin(phi), z], axis=1)
+
+
+def read_atoms(pdb_file: str) -> pd.DataFrame:
+    """
+    Heavy atoms of the ATOM records of a PDB file (first alternate location only).
+    """
+    rows = []
+    with open(pdb_file) as f:
+        for line in f:
+            if not line.startswith("ATOM"):
+                continue
+            if line[16] not in (" ", "A"):
+                continue
+            name = line[12:16].strip()
+            element = line[76:78].strip().upper() or name.lstrip("0123456789")[:1]
+            if element in ("H", "D"):
+                continue
+            rows.append((line[21], int(line[22:26]), line[26].strip(), line[17:20].strip(), name, element,
+                         float(line[30:38]), float(line[38:46]), float(line[46:54])))
+    return pd.DataFrame(rows, columns=["chain", "resnum", "icode", "resname", "atom", "element", "x", "y", "z"])
+
+
+def shrake_rupley(coords: np.ndarray, radii: np.ndarray, groups: np.ndarray, n_points: int=100, block_size: int=2048) -> tuple:
+    """
+    Per-atom SASA of the whole system and of each group on its own, in one pass.
+    Args:
+        coords: (n_atoms, 3) coordinates.
+        radii: (n_atoms,) atomic radii plus the probe radius.
+        groups: (n_atoms,) group label of each atom (e.g., 0 for antibody, 1 for antigen).
+        n_points: int, test points per atom.
+        block_size: int, atoms whose occlusion tests are evaluated together (bounds memory).
+    Returns:
+        tuple: (sasa_complex, sasa_free), each (n_atoms,) in Å².
+    """
+    n_atoms = len(coords)
+    unit = sphere_points(n_points)
+    area_per_point = 4 * np.pi * radii**2 / n_points
+    sasa_complex = np.zeros(n_atoms)
+    sasa_free = np.zeros(n_atoms)
+    if n_atoms == 0:
+        return sasa_complex, sasa_free
+
+    ## All ordered pairs of atoms whose spheres overlap, sorted by the first atom and then by whether the
+    ## second atom belongs to the same group, so each (atom, same/other group) is a contiguous segment
+    pairs = cKDTree(coords).query_pairs(2 * radii.max(), output_type='ndarray')
+    i = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    j = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    offsets = coords[i] - coords[j]
+    distances_sq = np.einsum('pd,pd->p', offsets, offsets)
+    close = distances_sq < (radii[i] + radii[j])**2
+    i, j, offsets, distances_sq = i[close], j[close], offsets[close], distances_sq[close]
+    segment = 2 * i + (groups[i] != groups[j])
+    order = np.argsort(segment, kind='stable')
+    i, j, offsets, distances_sq, segment = i[order], j[order], offsets[order], distances_sq[order], segment[order]
+    bounds = np.searchsorted(segment, np.arange(0, 2 * n_atoms + 1, 2))
+
+    for block_start in range(0, n_atoms, block_size):
+        block_end = min(block_start + block_size, n_atoms)
+        first, last = bounds[block_start], bounds[block_end]
+        if first == last:
+            sasa_free[block_start:block_end] = sasa_complex[block_start:block_end] = 4 * np.pi * radii[block_start:block_end]**2
+            continue
+        bi, bj = i[first:last], j[first:last]
+        ## Test point c_i + r_i u lies inside the sphere of atom j if |c_i - c_j|² + r_i² + 2 r_i (c_i - c_j)·u < r_j²
+        occluded = 2 * radii[bi, None] * (offsets[first:last] @ unit.T) < (radii[bj]**2 - radii[bi]**2 - distances_sq[first:last])[:, None]
+
+        ## One OR-reduction per non-empty (atom, same/other group) segment
+        starts, index = np.unique(segment[first:last], return_index=True)
+        reduced = np.logical_or.reduceat(occluded, index, axis=0)
+        buried_same = np.zeros((block_end - block_start, n_points), dtype=bool)
+        buried_other = np.zeros((block_end - block_start, n_points), dtype=bool)
+        other = starts % 2 == 1
+        buried_same[starts[~other] // 2 - block_start] = reduced[~other]
+        buried_other[starts[other] // 2 - block_start] = reduced[other]
+
+        atoms = slice(block_start, block_end)
+        sasa_free[atoms] = (~buried_same).sum(axis=1) * area_per_point[atoms]
+        sasa_complex[atoms] = (~(buried_same | buried_other)).sum(axis=1) * area_per_point[atoms]
+    return sasa_complex, sasa_free
+
+
+def buried_surface(pdb_file: str, antibody_chains: list=None, n_points: int=100, probe_radius: float=PROBE_RADIUS, interface_threshold: float=1.0) -> tuple:
+    """
+    Buried surface area of an antibody-antigen complex.
+    Args:
+        pdb_file: str, complex with antibody chains first (as predicted by ESM3) unless antibody_chains is given.
+        antibody_chains: list of str, antibody chain IDs (default: the first two chains).
+        interface_threshold: float, Å² of buried surface for a residue to count as paratope or epitope.
+    Returns:
+        tuple: (summary dict, per-residue DataFrame).
+    """
+    atoms = read_atoms(pdb_file)
+    chains = list(dict.fromkeys(atoms["chain"]))
+    antibody_chains = antibody_chains or chains[:2]
+    atoms["partner"] = np.where(atoms["chain"].isin(antibody_chains), "antibody", "antigen")
+
+    radii = atoms["element"].map(ATOMIC_RADII).fillna(DEFAULT_RADIUS).to_numpy() + probe_radius
+    coords = atoms[["x", "y", "z"]].to_numpy()
+    groups = (atoms["partner"] == "antigen").to_numpy().astype(np.int8)
+    atoms["sasa_complex"], atoms["sasa_free"] = shrake_rupley(coords, radii, groups, n_points=n_points)
+
+    residues = atoms.groupby(["chain", "resnum", "icode"], sort=False).agg(
+        resname=("resname", "first"), partner=("partner", "first"),
+        sasa_complex=("sasa_complex", "sum"), sasa_free=("sasa_free", "sum")
+    ).reset_index()
+    residues["buried"] = residues["sasa_free"] - residues["sasa_complex"]
+    residues["buried_fraction"] = (residues["buried"] / residues["sasa_free"].where(residues["sasa_free"] > 0)).fillna(0.0)
+    residues["interface"] = residues["buried"] > interface_threshold
+
+    by_partner = residues.groupby("partner")
+    buried = by_partner["buried"].sum()
+    interface = residues[residues["interface"]].groupby("partner").size()
+    summary = {
+        "atoms": len(atoms),
+        "residues": len(residues),
+        "sasa_complex": float(residues["sasa_complex"].sum()),
+        "sasa_antibody": float(by_partner["sasa_free"].sum().get("antibody", 0.0)),
+        "sasa_antigen": float(by_partner["sasa_free"].sum().get("antigen", 0.0)),
+        "bsa": float(buried.sum()),
+        "bsa_antibody": float(buried.get("antibody", 0.0)),
+        "bsa_antigen": float(buried.get("antigen", 0.0)),
+        "paratope_residues": int(interface.get("antibody", 0)),
+        "epitope_residues": int(interface.get("antigen", 0))
+    }
+    return summary, residues
+
+
+def compare_bsa(results: pd.DataFrame, reference_file: str) -> dict:
+    """
+    Agreement of the computed bsa with the bsa column of haddock3-score results (joined on seq_id).
+    """
+    reference = pd.read_csv(reference_file)[["seq_id", "bsa"]]
+    merged = results.merge(reference, on="seq_id", suffixes=("", "_haddock")).dropna(subset=["bsa", "bsa_haddock"])
+    if len(merged) < 2:
+        return {"n": len(merged)}
+    return {
+        "n": len(merged),
+        "pearson": stats.pearsonr(merged["bsa"], merged["bsa_haddock"])[0],
+        "spearman": stats.spearmanr(merged["bsa"], merged["bsa_haddock"])[0],
+        "mae": (merged["bsa"] - merged["bsa_haddock"]).abs().mean(),
+        "median_ratio": (merged["bsa"] / merged["bsa_haddock"]).median()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Buried surface area of predicted antibody-antigen complexes.")
+    parser.add_argument("--structures_dir", type=str, default='/mnt/tests/structures/predicted_complexes', help="Directory of .pdb complexes.")
+    parser.add_argument("--output_file", type=str, default='bsa_results.csv', help="Per-structure SASA/BSA .csv.")
+    parser.add_argument("--residues_file", type=str, default='bsa_residues.csv', help="Per-residue SASA and burial .csv (paratope and epitope flags).")
+    parser.add_argument("--antibody_chains", type=str, nargs='+', default=None, help="Antibody chain IDs (default: the first two chains of each file).")
+    parser.add_argument("--n_points", type=int, default=100, help="Test points per atom.")
+    parser.add_argument("--probe_radius", type=float, default=PROBE_RADIUS, help="Probe radius (Å).")
+    parser.add_argument("--interface_threshold", type=float, default=1.0, help="Buried Å² for a residue to count as paratope/epitope.")
+    parser.add_argument("--compare_with", type=str, default=None, help="haddock3-score results .csv with a bsa column (e.g., binding_affinity_results.csv).")
+    args = parser.parse_args()
+
+    pdb_files = sorted(f for f in os.listdir(args.structures_dir) if f.endswith('.pdb'))
+    results, residue_tables = [], []
+    start = time.perf_counter()
+    for i, pdb_file in enumerate(pdb_files, start=1):
+        seq_id = pdb_file.replace('.pdb', '')
+        structure_start = time.perf_counter()
+        summary, residues = buried_surface(
+            os.path.join(args.structures_dir, pdb_file),
+            antibody_chains=args.antibody_chains,
+            n_points=args.n_points,
+            probe_radius=args.probe_radius,
+            interface_threshold=args.interface_threshold
+        )
+        summary = {"seq_id": seq_id, **summary, "runtime_s": time.perf_counter() - structure_start}
+        results.append(summary)
+        residue_tables.append(residues.assign(seq_id=seq_id))
+        logger.info(f"[{i}/{len(pdb_files)}] {seq_id}: BSA {summary['bsa']:.0f} Å² ({summary['paratope_residues']} paratope, "
+                    f"{summary['epitope_residues']} epitope residues) in {summary['runtime_s']:.2f} s")
+    wall_time = time.perf_counter() - start
+
+    results_df = pd.DataFrame(results)
+    results_df.to_csv(args.output_file, index=False)
+    if residue_tables:
+        pd.concat(residue_tables)[["seq_id", "chain", "resnum", "icode", "resname", "partner", "sasa_complex", "sasa_free", "buried", "buried_fraction", "interface"]].to_csv(args.residues_file, index=False)
+    logger.info(f"Computed {len(results_df)} structures in {wall_time:.1f} s ({wall_time / max(len(results_df), 1):.2f} s per structure).")
+
+    if args.compare_with and len(results_df):
+        comparison = compare_bsa(results_df, args.compare_with)
+        if comparison["n"] < 2:
+            logger.info(f"Only {comparison['n']} structures match {args.compare_with}; nothing to compare.")
+        else:
+            logger.info(f"Against the haddock3-score bsa of {comparison['n']} structures: Pearson {comparison['pearson']:.3f}, "
+                        f"Spearman {comparison['spearman']:.3f}, MAE {comparison['mae']:.0f} Å², median ratio {comparison['median_ratio']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import threading
+import argparse
+import logging
+import queue
+import json
+import time
+import re, os
+
+from folding_client import FoldingClient, FoldingError, ESMForgeBackend, HTTPBackend
+from run_binding_affinity import Haddock3Scorer, CsvAppender, RESULT_COLUMNS
+from buried_surface import buried_surface
+from filter_cascade import FilterCascade, FILTERS, STRUCTURE_COSTS, read_sequences, log_report
+
+"""
+Streaming evaluation of a generation campaign: generate -> filter -> fold -> relax -> score.
+Stages run concurrently, each with its own worker threads, and are linked by bounded queues, so a
+sequence is folded, relaxed and scored while later sequences are still being generated or folded,
+and the first binding scores appear minutes after the campaign starts instead of after every stage
+has finished the whole campaign. The orchestrator logs each stage's throughput and the depth of its
+input queue, and saves them to a metrics .json.
+
+The generate stage reads a campaign written by scripts/generate.py (a .csv, or a .jsonl campaign file that
+--follow keeps reading while generate.py is still appending to it). Reruns resume: folds are cached,
+existing relaxed structures are reused, and sequences already in the results .csv are skipped.
+The filter stage runs the cost-ordered filter cascade of filter_cascade.py, so only sequences that pass
+the format, length, anchor and numbering checks (and, optionally, deduplication) reach the structure stages.
+
+Usage:
+    python ../scripts/generate.py --antigens_file antigens.csv --output_file campaign.jsonl &
+    python evaluation_pipeline.py --generated_file campaign.jsonl --follow --fold_workers 8 --relax_workers 4 --score_workers 4
+"""
+
+## Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STOP = object()
+
+
+class Stage:
+    """
+    A pipeline stage: worker threads take items from the input queue, apply func, and put the
+    result on the output queue (func returns None to drop an item). A stage stops once its input
+    is exhausted and all its workers are done, and then signals the next stage.
+    """
+    def __init__(self, name: str, func, workers: int, input_queue: queue.Queue, output_queue: queue.Queue=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.stats = {"in": 0, "out": 0, "dropped": 0, "errors": 0, "busy_s": 0.0, "first_output_s": None, "last_output_s": None}
+        self.depths = []
+        self._lock = threading.Lock()
+        self._running = workers
+        self._threads = []
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self._threads = [threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True) for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            item = self.input_queue.get()
+            if item is STOP:
+                ## Let the other workers of this stage see the end of the input too
+                self.input_queue.put(STOP)
+                break
+            start = time.perf_counter()
+            try:
+                result = self.func(item)
+            except Exception as e:
+                logger.error(f"{self.name}: failed on {item.get('generated_seq_id')}: {e}")
+                result, key = None, "errors"
+            else:
+                key = "out" if result is not None else "dropped"
+            with self._lock:
+                self.stats["in"] += 1
+                self.stats[key] += 1
+                self.stats["busy_s"] += time.perf_counter() - start
+                if key == "out":
+                    elapsed = time.perf_counter() - self.start_time
+                    self.stats["first_output_s"] = self.stats["first_output_s"] or elapsed
+                    self.stats["last_output_s"] = elapsed
+            if result is not None and self.output_queue is not None:
+                self.output_queue.put(result)
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if last and self.output_queue is not None:
+            self.output_queue.put(STOP)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def sample_depth(self):
+        self.depths.append(self.input_queue.qsize())
+
+    def summary(self, wall_time: float) -> dict:
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "throughput_per_min": 60 * self.stats["out"] / wall_time if wall_time > 0 else 0.0,
+            "utilization": self.stats["busy_s"] / (self.workers * wall_time) if wall_time > 0 else 0.0,
+            "mean_queue_depth": sum(self.depths) / len(self.depths) if self.depths else 0.0,
+            "max_queue_depth": max(self.depths, default=0)
+        }
+
+
+def read_campaign(generated_file: str, follow: bool=False, idle_timeout: float=300, poll_interval: float=2.0):
+    """
+    Yields generated sequence records from a .csv or a .jsonl campaign file. With follow, keeps reading a
+    .jsonl that is still being written until it has not grown for idle_timeout seconds.
+    """
+    if generated_file.endswith(".csv"):
+        for record in pd.read_csv(generated_file).dropna(subset=['generated_seq']).to_dict('records'):
+            yield record
+        return
+    seen, position, idle_since = set(), 0, time.monotonic()
+    while True:
+        if os.path.exists(generated_file):
+            with open(generated_file) as f:
+                f.seek(position)
+                for line in iter(f.readline, ""):
+                    if not line.endswith("\n"):
+                        break
+                    position += len(line.encode())
+                    record = json.loads(line)
+                    if record.get("type") == "sequence" and record["generated_seq_id"] not in seen:
+                        seen.add(record["generated_seq_id"])
+                        idle_since = time.monotonic()
+                        yield record
+        if not follow or time.monotonic() - idle_since > idle_timeout:
+            return
+        time.sleep(poll_interval)
+
+
+def complex_sequence(record: dict) -> str:
+    """
+    `HEAVY|LIGHT|ANTIGEN...` sequence of a record (epitope brackets removed from the antigen).
+    """
+    heavy, light = record.get("h_chain"), record.get("l_chain")
+    if not isinstance(heavy, str) or not isinstance(light, str):
+        heavy, _, light = record["generated_seq"].partition("|")
+    antigen = re.sub(r"[\[\]]", "", record["antigen_epitope_dict"])
+    return f"{heavy}|{light}|{antigen}"
+
+
+def run_pipeline(args) -> dict:
+    predicted_dir = os.path.join(args.work_dir, "predicted_complexes")
+    relaxed_dir = os.path.join(args.work_dir, "relaxed_complexes")
+    os.makedirs(predicted_dir, exist_ok=True)
+    os.makedirs(relaxed_dir, exist_ok=True)
+
+    ## Stage functions
+    if args.fold_backend == "esm":
+        backend = ESMForgeBackend(args.fold_model, url=args.fold_url or "https://forge.evolutionaryscale.ai")
+    else:
+        backend = HTTPBackend(args.fold_url)
+    folding_client = FoldingClient(backend, cache_dir=args.fold_cache_dir, workers=args.fold_workers, requests_per_second=args.requests_per_second)
+
+    def fold(record):
+        path = os.path.join(predicted_dir, f"predicted__{record['generated_seq_id']}__esm3.pdb")
+        if not os.path.exists(path):
+            try:
+                pdb_str = folding_client.fold(complex_sequence(record))
+            except FoldingError as e:
+                logger.error(f"fold: {record['generated_seq_id']}: {e}")
+                return None
+            with open(f"{path}.partial", 'w') as f:
+                f.write(pdb_str)
+            os.replace(f"{path}.partial", path)
+        return {**record, "pdb_path": path}
+
+    relax_pool = None
+    if not args.skip_relax:
+        import run_amber_relax
+        relax_pool = ProcessPoolExecutor(
+            max_workers=args.relax_workers,
+            initializer=run_amber_relax.init_worker,
+            initargs=(args.relax_platform, args.threads_per_worker)
+        )
+
+    def relax(record):
+        path = os.path.join(relaxed_dir, os.path.basename(record["pdb_path"]))
+        if not os.path.exists(path):
+            result = relax_pool.submit(run_amber_relax.relax_file, record["pdb_path"], path, mode=args.relax_mode).result()
+            if result["status"] != "ok":
+                logger.error(f"relax: {record['generated_seq_id']}: {result['error']}")
+                return None
+        return {**record, "pdb_path": path}
+
+    def interface(record):
+        summary, _ = buried_surface(record["pdb_path"])
+        if summary["bsa"] < args.min_bsa:
+            logger.info(f"interface: {record['generated_seq_id']} buries {summary['bsa']:.0f} Å² (< {args.min_bsa:.0f}), not scored")
+            return None
+        return {**record, "bsa_estimate": summary["bsa"]}
+
+    results = CsvAppender(args.results_file, RESULT_COLUMNS)
+    scored = set(results.rows['seq_id'].astype(str))
+    scorer = Haddock3Scorer(executable=args.haddock_executable, timeout=args.score_timeout)
+    results_lock = threading.Lock()
+
+    def score(record):
+        seq_id = os.path.basename(record["pdb_path"]).replace(".pdb", "")
+        result = scorer.score(record["pdb_path"])
+        if result["status"] != "ok":
+            logger.error(f"score: {record['generated_seq_id']}: {result['status']} {result.get('error', '')}")
+            return None
+        with results_lock:
+            results.write({**result, "seq_id": seq_id})
+        return {**record, **result}
+
+    seen = [seq for path in args.dedup_against for seq in read_sequences(path)['generated_seq']]
+    cascade = FilterCascade(filters=args.filters, dedup=args.dedup or bool(seen), seen=seen)
+
+    def filter_record(record):
+        seq_id = f"predicted__{record['generated_seq_id']}__esm3"
+        if seq_id in scored:
+            return None
+        failed = cascade.check(record["generated_seq"])
+        if failed is not None:
+            logger.debug(f"filter: {record['generated_seq_id']} removed by {failed}")
+            return None
+        return record
+
+    ## Stages linked by bounded queues
+    stage_specs = [("filter", filter_record, args.filter_workers), ("fold", fold, args.fold_workers)]
+    if not args.skip_relax:
+        stage_specs.append(("relax", relax, args.relax_workers))
+    if args.min_bsa > 0:
+        stage_specs.append(("interface", interface, 1))
+    stage_specs.append(("score", score, args.score_workers))
+    queues = [queue.Queue(maxsize=args.queue_size) for _ in stage_specs]
+    stages = [
+        Stage(name, func, workers, queues[i], queues[i + 1] if i + 1 < len(queues) else None)
+        for i, (name, func, workers) in enumerate(stage_specs)
+    ]
+
+    start = time.perf_counter()
+    for stage in stages:
+        stage.start()
+    done = threading.Event()
+
+    def monitor():
+        while not done.wait(args.report_interval):
+            for stage in stages:
+                stage.sample_depth()
+            elapsed = time.perf_counter() - start
+            logger.info(f"[{elapsed:.0f} s] generated {n_generated} | " + " | ".join(
+                f"{stage.name}: {stage.stats['out']} done, {stage.input_queue.qsize()} queued" for stage in stages))
+
+    n_generated = 0
+    monitor_thread = threading.Thread(target=monitor, daemon=True)
+    monitor_thread.start()
+    generate_start = time.perf_counter()
+    try:
+        for record in read_campaign(args.generated_file, follow=args.follow, idle_timeout=args.idle_timeout):
+            queues[0].put(record)
+            n_generated += 1
+        queues[0].put(STOP)
+        generate_time = time.perf_counter() - generate_start
+        for stage in stages:
+            stage.join()
+    except KeyboardInterrupt:
+        logger.info("Interrupted; killing running scoring jobs. Finished results are saved and will be skipped on the next run.")
+        scorer.kill_all()
+        raise
+    finally:
+        done.set()
+        results.close()
+        if relax_pool is not None:
+            relax_pool.shutdown()
+
+    wall_time = time.perf_counter() - start
+    ## Compute saved by the filters, at the measured cost per structure of each stage
+    structure_costs = {
+        stage.name: stage.stats["busy_s"] / stage.stats["in"] if stage.stats["in"] else STRUCTURE_COSTS[stage.name]
+        for stage in stages if stage.name in STRUCTURE_COSTS
+    }
+    filter_report = cascade.report(structure_costs)
+    metrics = {
+        "wall_time_s": wall_time,
+        "generated": n_generated,
+        "generate_s": generate_time,
+        "first_score_s": stages[-1].stats["first_output_s"],
+        "scored": stages[-1].stats["out"],
+        "scores_per_min": 60 * stages[-1].stats["out"] / wall_time if wall_time > 0 else 0.0,
+        "fold_client": folding_client.stats,
+        "filtered": cascade.candidates,
+        "filters": filter_report.to_dict('records'),
+        "stages": {stage.name: stage.summary(wall_time) for stage in stages}
+    }
+    with open(args.metrics_file, 'w') as f:
+        json.dump(metrics, f, indent=2)
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Streaming generate -> filter -> fold -> relax -> score evaluation.")
+    parser.add_argument("--generated_file", type=str, required=True, help="Campaign .jsonl (or .csv) written by scripts/generate.py.")
+    parser.add_argument("--follow", action='store_true', help="Keep reading a campaign .jsonl that is still being generated.")
+    parser.add_argument("--idle_timeout", type=float, default=300, help="With --follow, stop once the campaign has not grown for this many seconds.")
+    parser.add_argument("--work_dir", type=str, default="structures/pipeline", help="Directory for predicted and relaxed structures.")
+    parser.add_argument("--results_file", type=str, default="binding_affinity_results.csv", help="Binding score .csv (resumed if it exists).")
+    parser.add_argument("--metrics_file", type=str, default="pipeline_metrics.json", help="Per-stage throughput and queue depth .json.")
+    parser.add_argument("--queue_size", type=int, default=16, help="Capacity of the queue in front of each stage.")
+    parser.add_argument("--report_interval", type=float, default=10.0, help="Seconds between progress lines (and queue depth samples).")
+    parser.add_argument("--filter_workers", type=int, default=2, help="Filter threads.")
+    parser.add_argument("--filters", type=str, nargs='*', default=list(FILTERS), choices=list(FILTERS), help="Filters applied before folding (see filter_cascade.py).")
+    parser.add_argument("--dedup", action='store_true', help="Drop exact repeats of earlier candidates before folding.")
+    parser.add_argument("--dedup_against", type=str, nargs='*', default=[], help="Earlier campaigns (.csv or .jsonl) to deduplicate against.")
+    parser.add_argument("--fold_backend", type=str, default="esm", choices=["esm", "http"], help="Folding backend (see folding_client.py).")
+    parser.add_argument("--fold_model", type=str, default="esm3-medium-multimer-2024-09", help="ESM model (esm backend).")
+    parser.add_argument("--fold_url", type=str, default=None, help="Folding server URL.")
+    parser.add_argument("--fold_cache_dir", type=str, default="fold_cache", help="Structure cache directory.")
+    parser.add_argument("--fold_workers", type=int, default=4, help="Concurrent folding requests.")
+    parser.add_argument("--requests_per_second", type=float, default=2.0, help="Folding rate limit.")
+    parser.add_argument("--skip_relax", action='store_true', help="Score the predicted structures without relaxation.")
+    parser.add_argument("--relax_workers", type=int, default=2, help="Relaxation processes.")
+    parser.add_argument("--threads_per_worker", type=int, default=1, help="OpenMM CPU threads per relaxation process.")
+    parser.add_argument("--relax_platform", type=str, default="auto", help="OpenMM platform.")
+    parser.add_argument("--relax_mode", type=str, default="full", choices=["full", "interface"], help="Relaxation mode (see run_amber_relax.py).")
+    parser.add_argument("--min_bsa", type=float, default=0.0, help="Skip HADDOCK scoring of structures that bury less than this many Å² (see buried_surface.py; 0 disables the check).")
+    parser.add_argument("--score_workers", type=int, default=2, help="Concurrent haddock3-score processes.")
+    parser.add_argument("--score_timeout", type=float, default=600, help="Seconds before a scoring job is killed.")
+    parser.add_argument("--haddock_executable", type=str, default="haddock3-score", help="haddock3-score executable (or a stand-in).")
+    args = parser.parse_args()
+
+    metrics = run_pipeline(args)
+    first_score = f"{metrics['first_score_s']:.1f} s" if metrics['first_score_s'] is not None else "n/a"
+    logger.info(f"Scored {metrics['scored']} of {metrics['generated']} sequences in {metrics['wall_time_s']:.1f} s "
+                f"(first score after {first_score}, {metrics['scores_per_min']:.1f} scores/min).")
+    log_report(pd.DataFrame(metrics["filters"]), metrics["filtered"])
+    for name, stage in metrics["stages"].items():
+        logger.info(f"  {name}: {stage['out']}/{stage['in']} passed, {stage['throughput_per_min']:.1f}/min, "
+                    f"utilization {stage['utilization']:.0%}, queue depth mean {stage['mean_queue_depth']:.1f} max {stage['max_queue_depth']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import pandas as pd
+import threading
+import argparse
+import logging
+import time
+import json
+import re
+
+"""
+Cheap sequence filters applied before the structure stages (folding, relaxation and HADDOCK scoring).
+Filters run in order of cost and a candidate stops at the first one it fails, so the expensive
+checks only see sequences that passed the cheap ones:
+
+    format     one `|` between heavy and light chain, amino acid letters only
+    length     chain lengths within the bounds of constrained decoding (antibody_grammar.py)
+    anchors    conserved Cys22/Trp36/Cys92/Trp103 (heavy) and Cys23/Trp35/Cys88 (light) at plausible spacings
+    numbering  Chothia numbering of both chains with the expected chain types (as in run_numbering_test.py)
+    dedup      (optional) drops exact repeats of earlier candidates, e.g., from previous campaigns
+
+The report shows how many candidates each filter removed, the time it took, the filter evaluations
+that short-circuiting skipped, and the structure-stage compute that the removed candidates would have cost.
+
+Usage:
+    python filter_cascade.py --generated_file generated_antibody_sequences.csv --output_file filtered_sequences.csv --dedup
+"""
+
+## Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+FORMAT_PATTERN = re.compile(rf"^[{AMINO_ACIDS}]+\|[{AMINO_ACIDS}]+$")
+
+## Conserved anchors with the spacings observed in generated and natural Fv sequences
+HEAVY_ANCHORS = re.compile(r"^.{15,29}C.{9,17}W.{40,75}C.{3,35}W")
+LIGHT_ANCHORS = re.compile(r"^.{15,29}C.{8,20}W.{40,60}C")
+
+## Estimated seconds per structure for each structure stage
+STRUCTURE_COSTS = {"fold": 10.0, "relax": 60.0, "score": 30.0}
+
+
+def check_format(heavy: str, light: str) -> bool:
+    return bool(FORMAT_PATTERN.match(f"{heavy}|{light}"))
+
+
+def check_length(heavy: str, light: str, min_heavy: int=90, max_heavy: int=150, min_light: int=90, max_light: int=130) -> bool:
+    return min_heavy <= len(heavy) <= max_heavy and min_light <= len(light) <= max_light
+
+
+def check_anchors(heavy: str, light: str) -> bool:
+    return bool(HEAVY_ANCHORS.match(heavy)) and bool(LIGHT_ANCHORS.match(light))
+
+
+def check_numbering(heavy: str, light: str, scheme: str="chothia") -> bool:
+    from abnumber import Chain
+    try:
+        return Chain(heavy, scheme=scheme).is_heavy_chain() and Chain(light, scheme=scheme).is_light_chain()
+    except Exception:
+        return False
+
+
+## Filters in order of cost
+FILTERS = {
+    "format": check_format,
+    "length": check_length,
+    "anchors": check_anchors,
+    "numbering": check_numbering
+}
+
+
+class FilterCascade:
+    """
+    Applies filters in order and stops at the first failure. Safe to share between threads.
+    Args:
+        filters: list of filter names (see FILTERS); they always run in FILTERS order.
+        dedup: bool, drop candidates identical to an earlier survivor (or to a sequence in seen).
+        seen: iterable of `HEAVY|LIGHT` sequences to deduplicate against.
+        length_bounds: dict of min_heavy/max_heavy/min_light/max_light.
+        scheme: str, numbering scheme.
+    """
+    def __init__(self, filters: list=list(FILTERS), dedup: bool=False, seen: list=(), length_bounds: dict={}, scheme: str="chothia"):
+        unknown = set(filters) - set(FILTERS)
+        if unknown:
+            raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+        kwargs = {"length": length_bounds, "numbering": {"scheme": scheme}}
+        self.filters = [(name, FILTERS[name], kwargs.get(name, {})) for name in FILTERS if name in filters]
+        self.dedup = dedup
+        self.seen = {normalize(seq) for seq in seen}
+        names = [name for name, _, _ in self.filters] + (["dedup"] if dedup else [])
+        self.stats = {name: {"evaluated": 0, "removed": 0, "time_s": 0.0} for name in names}
+        self.candidates = 0
+        self._lock = threading.Lock()
+
+    def _record(self, name: str, passed: bool, elapsed: float):
+        with self._lock:
+            stats = self.stats[name]
+            stats["evaluated"] += 1
+            stats["removed"] += not passed
+            stats["time_s"] += elapsed
+
+    def check(self, sequence: str) -> str:
+        """
+        Returns the name of the first filter a `HEAVY|LIGHT` sequence fails, or None if it passes them all.
+        """
+        with self._lock:
+            self.candidates += 1
+        sequence = normalize(sequence)
+        heavy, _, light = sequence.partition("|")
+        for name, check, kwargs in self.filters:
+            start = time.perf_counter()
+            passed = check(heavy, light, **kwargs)
+            self._record(name, passed, time.perf_counter() - start)
+            if not passed:
+                return name
+        if self.dedup:
+            start = time.perf_counter()
+            with self._lock:
+                passed = sequence not in self.seen
+                self.seen.add(sequence)
+            self._record("dedup", passed, time.perf_counter() - start)
+            if not passed:
+                return "dedup"
+        return None
+
+    def report(self, structure_costs: dict=STRUCTURE_COSTS) -> pd.DataFrame:
+        """
+        One row per filter: candidates evaluated and removed, time per candidate, evaluations skipped by
+        short-circuiting (and their estimated time), and estimated structure-stage seconds saved by the removals.
+        """
+        cost_per_structure = sum(structure_costs.values())
+        rows = []
+        for name, stats in self.stats.items():
+            time_per_candidate = stats["time_s"] / stats["evaluated"] if stats["evaluated"] else 0.0
+            skipped = self.candidates - stats["evaluated"]
+            rows.append({
+                "filter": name,
+                **stats,
+                "remaining": stats["evaluated"] - stats["removed"],
+                "removed_fraction": stats["removed"] / self.candidates if self.candidates else 0.0,
+                "us_per_candidate": 1e6 * time_per_candidate,
+                "skipped_evaluations": skipped,
+                "skipped_time_s": skipped * time_per_candidate,
+                "structure_time_saved_s": stats["removed"] * cost_per_structure
+            })
+        return pd.DataFrame(rows)
+
+
+def normalize(sequence: str) -> str:
+    return sequence.replace(" ", "").replace("\n", "").upper()
+
+
+def read_sequences(path: str) -> pd.DataFrame:
+    """
+    Reads generated sequences from a .csv or a campaign .jsonl written by scripts/generate.py.
+    """
+    if path.endswith(".jsonl"):
+        with open(path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        df = pd.DataFrame([r for r in records if r.get("type") == "sequence"])
+    else:
+        df = pd.read_csv(path)
+    return df.dropna(subset=['generated_seq'])
+
+
+def log_report(report: pd.DataFrame, n_candidates: int):
+    passed = n_candidates - (report["removed"].sum() if len(report) else 0)
+    logger.info(f"{passed} of {n_candidates} candidates passed the filters.")
+    if not len(report):
+        return
+    for row in report.itertuples():
+        logger.info(f"  {row.filter}: removed {row.removed} of {row.evaluated} ({row.us_per_candidate:.1f} us/candidate, "
+                    f"{row.skipped_evaluations} evaluations skipped), saving ~{row.structure_time_saved_s / 3600:.2f} h of structure stages")
+    logger.info(f"Filters took {report['time_s'].sum():.2f} s, short-circuiting skipped ~{report['skipped_time_s'].sum():.2f} s of filtering, "
+                f"and ~{report['structure_time_saved_s'].sum() / 3600:.2f} h of folding, relaxation and scoring was avoided.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Filter generated antibodies before folding and scoring.")
+    parser.add_argument("--generated_file", type=str, required=True, help="Generated sequences (.csv or campaign .jsonl) with a `generated_seq` column.")
+    parser.add_argument("--output_file", type=str, default="filtered_sequences.csv", help="Sequences that passed every filter.")
+    parser.add_argument("--rejected_file", type=str, default=None, help="Optional .csv of removed sequences with the filter that removed them.")
+    parser.add_argument("--report_file", type=str, default="filter_report.csv", help="Per-filter report .csv.")
+    parser.add_argument("--filters", type=str, nargs='+', default=list(FILTERS), choices=list(FILTERS), help="Filters to apply (always run in order of cost).")
+    parser.add_argument("--min_heavy", type=int, default=90, help="Minimum heavy chain length.")
+    parser.add_argument("--max_heavy", type=int, default=150, help="Maximum heavy chain length.")
+    parser.add_argument("--min_light", type=int, default=90, help="Minimum light chain length.")
+    parser.add_argument("--max_light", type=int, default=130, help="Maximum light chain length.")
+    parser.add_argument("--scheme", type=str, default="chothia", help="Numbering scheme.")
+    parser.add_argument("--dedup", action='store_true', help="Drop exact repeats of earlier candidates.")
+    parser.add_argument("--dedup_against", type=str, nargs='*', default=[], help="Earlier campaigns (.csv or .jsonl) to deduplicate against.")
+    parser.add_argument("--fold_cost_s", type=float, default=STRUCTURE_COSTS["fold"], help="Estimated folding seconds per structure.")
+    parser.add_argument("--relax_cost_s", type=float, default=STRUCTURE_COSTS["relax"], help="Estimated relaxation seconds per structure.")
+    parser.add_argument("--score_cost_s", type=float, default=STRUCTURE_COSTS["score"], help="Estimated HADDOCK scoring seconds per structure.")
+    args = parser.parse_args()
+
+    df = read_sequences(args.generated_file)
+    seen = [seq for path in args.dedup_against for seq in read_sequences(path)['generated_seq']]
+    cascade = FilterCascade(
+        filters=args.filters,
+        dedup=args.dedup or bool(seen),
+        seen=seen,
+        length_bounds={"min_heavy": args.min_heavy, "max_heavy": args.max_heavy, "min_light": args.min_light, "max_light": args.max_light},
+        scheme=args.scheme
+    )
+
+    df['filter'] = [cascade.check(seq) for seq in df['generated_seq']]
+    df[df['filter'].isna()].drop(columns=['filter']).to_csv(args.output_file, index=False)
+    if args.rejected_file:
+        df[df['filter'].notna()].to_csv(args.rejected_file, index=False)
+    report = cascade.report({"fold": args.fold_cost_s, "relax": args.relax_cost_s, "score": args.score_cost_s})
+    report.to_csv(args.report_file, index=False)
+    log_report(report, len(df))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+import pandas as pd
+import http.client
+import threading
+import argparse
+import hashlib
+import logging
+import random
+import time
+import os
+
+"""
+Concurrent, cached structure prediction for antibody-antigen complexes (`HEAVY|LIGHT|ANTIGEN...`).
+One backend client is shared by a pool of worker threads; requests go through a rate limiter, and
+failures that can succeed later (rate limits, server errors, dropped connections) are retried with
+exponential backoff. As in the original notebook, a structure that fails for another reason is
+retried once as a potential sequence of concern. Predicted structures are cached on disk by
+sequence hash and written to the output directory as soon as they arrive, so reruns only fold new complexes.
+
+Backends:
+    - esm: EvolutionaryScale Forge through the `esm` SDK (token from $ESM_TOKEN).
+    - http: any server that answers POST <url> (body: the sequence) with a PDB, like the ESM Atlas API
+      or mock_folding_server.py.
+
+Usage:
+    python folding_client.py --input_file test_cases.csv --backend esm --workers 8 --requests_per_second 2
+    python mock_folding_server.py --port 8765 &
+    python folding_client.py --input_file test_cases.csv --backend http --url http://127.0.0.1:8765/fold --output_dir /tmp/predicted
+"""
+
+## Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+## Transport and timeout errors of the HTTP libraries under the SDKs (requests, httpx), matched by class name
+TRANSPORT_ERRORS = {"ConnectionError", "Timeout", "TransportError", "TimeoutException", "NetworkError"}
+
+
+class FoldingError(Exception):
+    """
+    A failed prediction. retryable errors (rate limits, server errors) may succeed later;
+    retry_after is the server's requested delay in seconds, if any.
+    """
+    def __init__(self, message: str, retryable: bool=False, retry_after: float=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def is_transport_error(error: Exception) -> bool:
+    """
+    Whether an exception is a network or timeout failure (builtin, or from an HTTP library) that may succeed later.
+    """
+    return isinstance(error, OSError) or any(cls.__name__ in TRANSPORT_ERRORS for cls in type(error).__mro__)
+
+
+class ESMForgeBackend:
+    """
+    Folds complexes with an ESM3 model on EvolutionaryScale Forge. One SDK client is created and shared.
+    """
+    def __init__(self, model_name: str="esm3-medium-multimer-2024-09", token: str=None, url: str="https://forge.evolutionaryscale.ai"):
+        from esm.sdk import client
+        self.name = model_name
+        self.client = client(model=model_name, url=url, token=token or os.getenv("ESM_TOKEN"))
+
+    def fold(self, sequence: str, soc: bool=False) -> str:
+        from esm.sdk.api import ESMProtein, ESMProteinError, GenerationConfig
+        protein = ESMProtein(sequence=sequence, potential_sequence_of_concern=soc)
+        config = GenerationConfig(track="structure", num_steps=10, temperature=0.1)
+        try:
+            generation = self.client.generate(protein, config)
+            if isinstance(generation, ESMProteinError):
+                raise FoldingError(f"{generation.error_code}: {generation.error_msg}", retryable=generation.error_code in RETRYABLE_STATUS)
+            return generation.to_protein_complex().to_pdb_string()
+        except FoldingError:
+            raise
+        except Exception as e:
+            raise FoldingError(f"{type(e).__name__}: {e}", retryable=is_transport_error(e))
+
+
+class HTTPBackend:
+    """
+    Folds complexes with a server that answers POST <url> (body: the sequence) with a PDB.
+    Each worker thread keeps its own persistent (keep-alive) connection.
+    """
+    def __init__(self, url: str, name: str=None, timeout: float=300):
+        self.url = urlsplit(url)
+        self.name = name or self.url.netloc.replace(":", "_")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if self.url.scheme == "https" else http.client.HTTPConnection
+            connection = connection_class(self.url.netloc, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def fold(self, sequence: str, soc: bool=False) -> str:
+        path = self.url.path or "/"
+        if soc:
+            path += ("&" if "?" in path else "?") + "potential_sequence_of_concern=true"
+        connection = self._connection()
+        try:
+            connection.request("POST", path, body=sequence.encode(), headers={"Content-Type": "text/plain"})
+            response = connection.getresponse()
+            body = response.read().decode()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            self._local.connection = None
+            raise FoldingError(f"Connection error: {e}", retryable=True)
+        if response.status != 200:
+            retry_after = response.getheader("Retry-After")
+            raise FoldingError(
+                f"HTTP {response.status}: {body[:200]}",
+                retryable=response.status in RETRYABLE_STATUS,
+                retry_after=float(retry_after) if retry_after else None
+            )
+        return body
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all worker threads: at most rate requests per second on average, in bursts of up to burst.
+    """
+    def __init__(self, rate: float, burst: int=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def write_atomic(path: str, text: str):
+    partial_path = f"{path}.partial"
+    with open(partial_path, 'w') as f:
+        f.write(text)
+    os.replace(partial_path, path)
+
+
+class FoldingClient:
+    """
+    Args:
+        backend: ESMForgeBackend or HTTPBackend (anything with a name and fold(sequence, soc) -> PDB string).
+        cache_dir: str, directory of cached structures (one subdirectory per backend name).
+        workers: int, concurrent requests.
+        requests_per_second: float, rate limit across all workers (0 for none).
+        max_retries: int, retries of a retryable failure.
+        backoff: float, base delay in seconds, doubled on every retry (with jitter) up to max_backoff.
+    """
+    def __init__(self, backend, cache_dir: str="fold_cache", workers: int=4, requests_per_second: float=2.0,
+                 max_retries: int=5, backoff: float=1.0, max_backoff: float=60.0):
+        self.backend = backend
+        self.cache_dir = os.path.join(cache_dir, backend.name)
+        self.workers = workers
+        self.rate_limiter = RateLimiter(requests_per_second, burst=max(1, workers))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = {"cached": 0, "folded": 0, "failed": 0, "retries": 0, "soc_fallbacks": 0}
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def cache_path(self, sequence: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(sequence.encode()).hexdigest() + ".pdb")
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _fold_with_retries(self, sequence: str, soc: bool) -> str:
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                return self.backend.fold(sequence, soc=soc)
+            except FoldingError as e:
+                if not e.retryable or attempt == self.max_retries:
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                delay = max(delay, e.retry_after or 0)
+                logger.debug(f"Retrying in {delay:.1f} s after: {e}")
+                self._count("retries")
+                time.sleep(delay)
+
+    def fold(self, sequence: str) -> str:
+        """
+        Returns the predicted structure of a complex, from the cache if it was folded before.
+        Raises FoldingError if it could not be folded.
+        """
+        sequence = sequence.replace(" ", "").replace("\n", "")
+        cache_path = self.cache_path(sequence)
+        if os.path.exists(cache_path):
+            self._count("cached")
+            with open(cache_path) as f:
+                return f.read()
+        try:
+            pdb_str = self._fold_with_retries(sequence, soc=False)
+        except FoldingError as e:
+            if e.retryable:
+                raise
+            ## Retry once as a potential sequence of concern
+            self._count("soc_fallbacks")
+            pdb_str = self._fold_with_retries(sequence, soc=True)
+        if not pdb_str.strip():
+            raise FoldingError("Empty structure")
+        write_atomic(cache_path, pdb_str)
+        self._count("folded")
+        return pdb_str
+
+    def fold_many(self, complexes: dict, output_dir: str, filename: str="predicted__{}__esm3.pdb") -> dict:
+        """
+        Folds complexes concurrently and writes each structure to output_dir as soon as it arrives.
+        Complexes whose output file already exists are skipped.
+        Args:
+            complexes: dict mapping IDs to `HEAVY|LIGHT|ANTIGEN...` sequences.
+            filename: str, output file name pattern ({} is replaced by the ID).
+        Returns:
+            dict: output path (or None for failures) per ID.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        paths = {seq_id: os.path.join(output_dir, filename.format(seq_id)) for seq_id in complexes}
+        pending = {seq_id: seq for seq_id, seq in complexes.items() if not os.path.exists(paths[seq_id])}
+        logger.info(f"{len(complexes)} complexes, {len(complexes) - len(pending)} already written, {len(pending)} to fold with {self.workers} workers.")
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.fold, seq): seq_id for seq_id, seq in pending.items()}
+            for i, future in enumerate(as_completed(futures), start=1):
+                seq_id = futures[future]
+                try:
+                    write_atomic(paths[seq_id], future.result())
+                    logger.info(f"[{i}/{len(pending)}] Wrote {paths[seq_id]}")
+                except Exception as e:
+                    ## Any failure only loses this complex; the others are still written
+                    self._count("failed")
+                    paths[seq_id] = None
+                    logger.error(f"[{i}/{len(pending)}] Failed to fold {seq_id}: {e if isinstance(e, FoldingError) else f'{type(e).__name__}: {e}'}")
+        wall_time = time.perf_counter() - start
+        logger.info(f"Folded {len(pending)} complexes in {wall_time:.1f} s: {self.stats}")
+        return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Fold antibody-antigen complexes concurrently with a disk cache.")
+    parser.add_argument("--input_file", type=str, required=True, help="A .csv (or .xlsx) with an ID column and the chain sequence columns.")
+    parser.add_argument("--id_column", type=str, default="seq_id", help="Column with complex IDs.")
+    parser.add_argument("--sequence_columns", type=str, nargs='+', default=["h_chain", "l_chain", "antigen_seqs"], help="Columns joined with `|` into the complex sequence.")
+    parser.add_argument("--output_dir", type=str, default="./structures/predicted_complexes", help="Directory for the predicted .pdb files.")
+    parser.add_argument("--filename", type=str, default="predicted__{}__esm3.pdb", help="Output file name pattern ({} is the ID).")
+    parser.add_argument("--backend", type=str, default="esm", choices=["esm", "http"], help="Folding backend.")
+    parser.add_argument("--model_name", type=str, default="esm3-medium-multimer-2024-09", help="ESM model (esm backend).")
+    parser.add_argument("--url", type=str, default=None, help="Server URL (Forge URL for esm, endpoint for http).")
+    parser.add_argument("--cache_dir", type=str, default="fold_cache", help="Structure cache directory.")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent requests.")
+    parser.add_argument("--requests_per_second", type=float, default=2.0, help="Rate limit (0 for none).")
+    parser.add_argument("--max_retries", type=int, default=5, help="Retries of rate-limited or failed requests.")
+    args = parser.parse_args()
+
+    read = pd.read_excel if args.input_file.endswith(".xlsx") else pd.read_csv
+    df = read(args.input_file).dropna(subset=args.sequence_columns)
+    complexes = dict(zip(df[args.id_column], df[args.sequence_columns].astype(str).agg("|".join, axis=1)))
+
+    if args.backend == "esm":
+        backend = ESMForgeBackend(args.model_name, url=args.url or "https://forge.evolutionaryscale.ai")
+    else:
+        backend = HTTPBackend(args.url)
+    client = FoldingClient(backend, cache_dir=args.cache_dir, workers=args.workers, requests_per_second=args.requests_per_second, max_retries=args.max_retries)
+    client.fold_many(complexes, args.output_dir, filename=args.filename)
+
+
+if __name__ == "__main__":
+    main()
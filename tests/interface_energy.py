@@ -0,0 +1,193 @@
+from scipy.spatial import cKDTree
+from scipy import stats
+import pandas as pd
+import numpy as np
+import argparse
+import logging
+import time
+import os
+
+from buried_surface import read_atoms
+
+"""
+In-process interface energy proxy for triage before `haddock3-score`. Inter-chain atom pairs within a
+cutoff come from a k-d tree neighbor list, and simplified van der Waals and electrostatic terms are
+evaluated on all pairs at once from a parameter table:
+
+    vdw   Lennard-Jones 12-6 with per-element well depth and radius (Lorentz-Berthelot combination)
+    elec  Coulomb between the charged side-chain groups and termini, shifted to zero at the cutoff (as in CNS)
+
+In both terms, distances are floored at a fraction of the contact distance so clashes in unrelaxed models stay finite.
+
+Like HADDOCK, every pair of chains counts as an interface; the antibody-antigen part is reported
+separately. `proxy_score` = vdw + 0.2 elec uses the HADDOCK weights of these terms (without desolvation).
+Structures are ranked by proxy_score, so only the best ones need to be scored with HADDOCK
+(see `run_binding_affinity.py --select_file`).
+
+Usage:
+    python interface_energy.py --structures_dir /mnt/tests/structures/predicted_complexes --compare_with binding_affinity_results.csv --top_k 100
+"""
+
+## Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+## Lennard-Jones well depth (kcal/mol) and half contact distance Rmin/2 (Å) by element
+LJ_PARAMETERS = {
+    "C": (0.110, 2.00),
+    "N": (0.200, 1.85),
+    "O": (0.120, 1.70),
+    "S": (0.450, 2.00),
+    "SE": (0.450, 2.10)
+}
+DEFAULT_LJ = (0.110, 2.00)
+
+## Charges (e) of ionizable side-chain atoms at pH 7; termini are added in atom_charges()
+CHARGES = {
+    ("LYS", "NZ"): 1.0,
+    ("ARG", "NH1"): 0.5,
+    ("ARG", "NH2"): 0.5,
+    ("ASP", "OD1"): -0.5,
+    ("ASP", "OD2"): -0.5,
+    ("GLU", "OE1"): -0.5,
+    ("GLU", "OE2"): -0.5
+}
+COULOMB_CONSTANT = 332.0636  ## kcal Å / (mol e²)
+CUTOFF = 8.5  ## Å, HADDOCK's non-bonded cutoff
+
+
+def atom_charges(atoms: pd.DataFrame) -> np.ndarray:
+    """
+    Charges from CHARGES plus +1 on the N-terminal N and -1 on the C-terminal carboxyl of each chain.
+    """
+    charges = np.array([CHARGES.get(key, 0.0) for key in zip(atoms["resname"], atoms["atom"])])
+    residue = list(zip(atoms["chain"], atoms["resnum"], atoms["icode"]))
+    residue_index = pd.Series(pd.factorize(pd.Series(residue))[0], index=atoms.index)
+    first = residue_index == residue_index.groupby(atoms["chain"]).transform("min")
+    last = residue_index == residue_index.groupby(atoms["chain"]).transform("max")
+    charges[(first & (atoms["atom"] == "N")).to_numpy()] += 1.0
+    carboxyl = (last & atoms["atom"].isin(["O", "OXT"])).to_numpy()
+    ## Spread over O and OXT (or all on O when OXT is missing)
+    for chain in atoms["chain"].unique():
+        mask = carboxyl & (atoms["chain"] == chain).to_numpy()
+        if mask.any():
+            charges[mask] -= 1.0 / mask.sum()
+    return charges
+
+
+def interface_energy(pdb_file: str, antibody_chains: list=None, cutoff: float=CUTOFF, min_distance_fraction: float=0.8, dielectric: float=1.0) -> dict:
+    """
+    Inter-chain van der Waals and electrostatic energies (kcal/mol) of a complex.
+    Args:
+        pdb_file: str, complex with antibody chains first (as predicted by ESM3) unless antibody_chains is given.
+        antibody_chains: list of str, antibody chain IDs (default: the first two chains).
+        cutoff: float, neighbor list cutoff (Å).
+        min_distance_fraction: float, pair distances are floored at this fraction of the LJ contact distance (in both terms).
+        dielectric: float, relative dielectric constant.
+    Returns:
+        dict: vdw, elec, proxy_score, their antibody-antigen parts and the number of pairs.
+    """
+    atoms = read_atoms(pdb_file)
+    chains = list(dict.fromkeys(atoms["chain"]))
+    antibody_chains = antibody_chains or chains[:2]
+    coords = atoms[["x", "y", "z"]].to_numpy()
+    chain_index = pd.factorize(atoms["chain"])[0]
+    antigen = (~atoms["chain"].isin(antibody_chains)).to_numpy()
+    lj = np.array([LJ_PARAMETERS.get(element, DEFAULT_LJ) for element in atoms["element"]]).reshape(-1, 2)
+    charges = atom_charges(atoms)
+
+    ## Neighbor list of inter-chain pairs within the cutoff
+    pairs = cKDTree(coords).query_pairs(cutoff, output_type='ndarray')
+    i, j = pairs[:, 0], pairs[:, 1]
+    inter_chain = chain_index[i] != chain_index[j]
+    i, j = i[inter_chain], j[inter_chain]
+    distances = np.linalg.norm(coords[i] - coords[j], axis=1)
+
+    ## Lennard-Jones: eps_ij [(rmin_ij / r)^12 - 2 (rmin_ij / r)^6]
+    epsilon = np.sqrt(lj[i, 0] * lj[j, 0])
+    rmin = lj[i, 1] + lj[j, 1]
+    ## Clashing pairs are floored for the Coulomb term below as well
+    distances = np.maximum(distances, min_distance_fraction * rmin)
+    ratio6 = (rmin / distances)**6
+    vdw = epsilon * (ratio6**2 - 2 * ratio6)
+
+    ## Shifted Coulomb: k q_i q_j / (eps r) (1 - r²/rc²)²
+    qq = charges[i] * charges[j]
+    elec = COULOMB_CONSTANT * qq / (dielectric * distances) * (1 - (distances / cutoff)**2)**2
+
+    interface = antigen[i] != antigen[j]
+    return {
+        "atoms": len(atoms),
+        "pairs": len(i),
+        "vdw": float(vdw.sum()),
+        "elec": float(elec.sum()),
+        "proxy_score": float(vdw.sum() + 0.2 * elec.sum()),
+        "vdw_antibody_antigen": float(vdw[interface].sum()),
+        "elec_antibody_antigen": float(elec[interface].sum())
+    }
+
+
+def compare_with_haddock(results: pd.DataFrame, reference_file: str, top_k: int=None) -> dict:
+    """
+    Spearman correlation of the proxy terms with the haddock3-score terms (joined on seq_id),
+    and the fraction of HADDOCK's top_k structures that are also in the proxy's top_k.
+    """
+    reference = pd.read_csv(reference_file)[["seq_id", "score", "vdw", "elec"]]
+    merged = results.merge(reference, on="seq_id", suffixes=("", "_haddock")).dropna()
+    comparison = {"n": len(merged)}
+    if len(merged) < 2:
+        return comparison
+    for proxy, haddock in [("vdw", "vdw_haddock"), ("elec", "elec_haddock"), ("proxy_score", "score")]:
+        comparison[f"spearman_{proxy}"] = stats.spearmanr(merged[proxy], merged[haddock])[0]
+    k = min(top_k or max(1, len(merged) // 10), len(merged))
+    top_haddock = set(merged.nsmallest(k, "score")["seq_id"])
+    top_proxy = set(merged.nsmallest(k, "proxy_score")["seq_id"])
+    comparison["top_k"] = k
+    comparison["top_k_recall"] = len(top_haddock & top_proxy) / k
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Rank predicted complexes with a fast interface energy proxy.")
+    parser.add_argument("--structures_dir", type=str, default='/mnt/tests/structures/predicted_complexes', help="Directory of .pdb complexes.")
+    parser.add_argument("--output_file", type=str, default='interface_energy_results.csv', help="Per-structure energies, sorted by proxy_score.")
+    parser.add_argument("--antibody_chains", type=str, nargs='+', default=None, help="Antibody chain IDs (default: the first two chains of each file).")
+    parser.add_argument("--cutoff", type=float, default=CUTOFF, help="Neighbor list cutoff (Å).")
+    parser.add_argument("--dielectric", type=float, default=1.0, help="Relative dielectric constant.")
+    parser.add_argument("--top_k", type=int, default=None, help="Write the top_k structures by proxy_score to --select_file.")
+    parser.add_argument("--select_file", type=str, default='selected_for_haddock.csv', help="Selected seq_ids (for run_binding_affinity.py --select_file).")
+    parser.add_argument("--compare_with", type=str, default=None, help="haddock3-score results .csv (e.g., binding_affinity_results.csv).")
+    args = parser.parse_args()
+
+    pdb_files = sorted(f for f in os.listdir(args.structures_dir) if f.endswith('.pdb'))
+    results = []
+    start = time.perf_counter()
+    for pdb_file in pdb_files:
+        structure_start = time.perf_counter()
+        energies = interface_energy(os.path.join(args.structures_dir, pdb_file), antibody_chains=args.antibody_chains, cutoff=args.cutoff, dielectric=args.dielectric)
+        results.append({"seq_id": pdb_file.replace('.pdb', ''), **energies, "runtime_s": time.perf_counter() - structure_start})
+    wall_time = time.perf_counter() - start
+
+    results_df = pd.DataFrame(results)
+    if len(results_df):
+        results_df = results_df.sort_values("proxy_score").reset_index(drop=True)
+        results_df.insert(1, "rank", np.arange(1, len(results_df) + 1))
+    results_df.to_csv(args.output_file, index=False)
+    logger.info(f"Scored {len(results_df)} structures in {wall_time:.1f} s ({1000 * wall_time / max(len(results_df), 1):.0f} ms per structure).")
+
+    if args.top_k and len(results_df):
+        results_df.head(args.top_k)[["seq_id", "rank", "proxy_score"]].to_csv(args.select_file, index=False)
+        logger.info(f"Wrote the top {min(args.top_k, len(results_df))} structures to {args.select_file}.")
+
+    if args.compare_with and len(results_df):
+        comparison = compare_with_haddock(results_df, args.compare_with, top_k=args.top_k)
+        if comparison["n"] < 2:
+            logger.info(f"Only {comparison['n']} structures match {args.compare_with}; nothing to compare.")
+        else:
+            logger.info(f"Against haddock3-score on {comparison['n']} structures: Spearman vdw {comparison['spearman_vdw']:.3f}, "
+                        f"elec {comparison['spearman_elec']:.3f}, score {comparison['spearman_proxy_score']:.3f}; "
+                        f"{comparison['top_k_recall']:.0%} of HADDOCK's top {comparison['top_k']} are in the proxy's top {comparison['top_k']}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import threading
+import argparse
+import random
+import math
+import time
+
+"""
+Local stand-in for a folding server, to test folding_client.py without a token or network access.
+POST /fold with a `HEAVY|LIGHT|ANTIGEN...` sequence in the body returns a PDB with one helical CA trace
+per chain after a configurable latency. The server can also rate limit (HTTP 429 with Retry-After),
+fail at random (HTTP 503), and reject sequences containing a marker unless they are submitted as
+potential sequences of concern (HTTP 400), to exercise the client's retries and fallbacks.
+
+Usage:
+    python mock_folding_server.py --port 8765 --latency 0.5 --max_concurrent 4 --failure_rate 0.1
+"""
+
+THREE_LETTER = {
+    'A': 'ALA', 'R': 'ARG', 'N': 'ASN', 'D': 'ASP', 'C': 'CYS', 'Q': 'GLN', 'E': 'GLU', 'G': 'GLY', 'H': 'HIS', 'I': 'ILE',
+    'L': 'LEU', 'K': 'LYS', 'M': 'MET', 'F': 'PHE', 'P': 'PRO', 'S': 'SER', 'T': 'THR', 'W': 'TRP', 'Y': 'TYR', 'V': 'VAL'
+}
+CHAIN_IDS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def mock_pdb(sequence: str) -> str:
+    """
+    Builds a CA-only PDB with one ideal helix per `|`-separated chain.
+    """
+    lines, serial = [], 1
+    for chain_index, chain in enumerate(sequence.split("|")):
+        chain_id = CHAIN_IDS[chain_index % len(CHAIN_IDS)]
+        for i, residue in enumerate(chain, start=1):
+            angle = math.radians(100 * i)
+            x, y, z = 2.3 * math.cos(angle) + 30 * chain_index, 2.3 * math.sin(angle), 1.5 * i
+            lines.append(f"ATOM  {serial:5d}  CA  {THREE_LETTER.get(residue, 'UNK')} {chain_id}{i:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00           C")
+            serial += 1
+        lines.append(f"TER   {serial:5d}")
+        serial += 1
+    return "\n".join(lines + ["END"]) + "\n"
+
+
+class MockFoldingServer:
+    """
+    Args:
+        port: int, port to listen on (0 picks a free one).
+        latency: float, seconds per prediction.
+        max_concurrent: int, predictions served at once; requests beyond it get HTTP 429.
+        failure_rate: float, probability of an HTTP 503 per request.
+        soc_marker: str, sequences containing it are only folded as potential sequences of concern.
+    """
+    def __init__(self, port: int=0, latency: float=0.5, max_concurrent: int=4, failure_rate: float=0.0, soc_marker: str="XXXX", seed: int=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.soc_marker = soc_marker
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "folded": 0, "rate_limited": 0, "failed": 0, "rejected": 0}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}/fold"
+        self._thread = None
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, status: int, body: str, headers: dict={}):
+                data = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                sequence = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+                soc = parse_qs(url.query).get("potential_sequence_of_concern") == ["true"]
+                server._count("requests")
+                if url.path != "/fold":
+                    return self._reply(404, "Not found")
+                if not server.slots.acquire(blocking=False):
+                    server._count("rate_limited")
+                    return self._reply(429, "Too many requests", {"Retry-After": f"{server.latency:.2f}"})
+                try:
+                    with server._lock:
+                        fail = server.random.random() < server.failure_rate
+                    if fail:
+                        server._count("failed")
+                        return self._reply(503, "Service unavailable")
+                    if server.soc_marker and server.soc_marker in sequence and not soc:
+                        server._count("rejected")
+                        return self._reply(400, "Potential sequence of concern")
+                    time.sleep(server.latency)
+                    server._count("folded")
+                    return self._reply(200, mock_pdb(sequence))
+                finally:
+                    server.slots.release()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Mock folding server for testing folding_client.py.")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on.")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per prediction.")
+    parser.add_argument("--max_concurrent", type=int, default=4, help="Concurrent predictions before HTTP 429.")
+    parser.add_argument("--failure_rate", type=float, default=0.0, help="Probability of an HTTP 503 per request.")
+    args = parser.parse_args()
+
+    server = MockFoldingServer(args.port, latency=args.latency, max_concurrent=args.max_concurrent, failure_rate=args.failure_rate)
+    print(f"Mock folding server at {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print(server.stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+from scipy import sparse
+import pandas as pd
+import numpy as np
+import argparse
+import logging
+import time
+import os
+
+"""
+Novelty and diversity metrics for generated antibodies.
+Novelty is the identity of each generated chain (and CDR) to its nearest neighbor in the training set;
+diversity is measured within each campaign (unique fraction, nearest-neighbor identity within the set,
+and mean pairwise identity). Identity is 1 - edit distance / length of the longer sequence.
+
+Nearest neighbors are exact. A k-mer index gives every training sequence an upper bound on its identity
+to the query (q-gram lemma: an edit distance d leaves at least max_len - k + 1 - k * d shared k-mers),
+candidates are scored best bound first with an edit-distance kernel vectorized across pairs, and the
+search stops once no remaining bound can beat the best identity found.
+
+Usage:
+    python novelty_metrics.py --generated_files generated_antibody_sequences.csv generated_antibody_sequences_llama.csv --training_file ../data/sabdab/sabdab_training_dataset.csv
+"""
+
+## Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CDR_NAMES = ['cdr1', 'cdr2', 'cdr3']
+QUERY_PAD, TARGET_PAD = 0, 1
+ONE, SIXTY_THREE = np.uint64(1), np.uint64(63)
+
+
+def encode(sequences: list, pad: int) -> tuple:
+    """
+    Encodes sequences as a padded (n, max_len) uint8 array of ASCII codes and their lengths.
+    Queries and targets use different pad codes, so padding never matches.
+    """
+    lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+    codes = np.full((len(sequences), max(lengths.max(initial=0), 1)), pad, dtype=np.uint8)
+    for i, seq in enumerate(sequences):
+        codes[i, :len(seq)] = np.frombuffer(seq.encode('ascii'), dtype=np.uint8)
+    return codes, lengths
+
+
+def edit_distances(a_codes: np.ndarray, a_lengths: np.ndarray, b_codes: np.ndarray, b_lengths: np.ndarray,
+                   chunk_size: int=8192) -> np.ndarray:
+    """
+    Levenshtein distances between pairs of encoded sequences (row i of a against row i of b).
+    Uses Myers' bit-parallel algorithm (Hyyro's formulation for global distance), vectorized across pairs:
+    the vertical deltas of a whole dynamic-programming column are held in the bits of a few uint64 words
+    per pair, so each residue of b costs a handful of word operations instead of a column of cells.
+    Args:
+        a_codes, b_codes: (n_pairs, max_len) arrays from encode() (a with QUERY_PAD, b with TARGET_PAD).
+        a_lengths, b_lengths: (n_pairs,) sequence lengths.
+    Returns:
+        np.ndarray: (n_pairs,) distances.
+    """
+    distances = np.empty(len(a_codes), dtype=np.int64)
+    for start in range(0, len(a_codes), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        distances[chunk] = _edit_distances(a_codes[chunk], a_lengths[chunk], b_codes[chunk], b_lengths[chunk])
+    return distances
+
+
+def _add_with_carry(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Adds (n_words, n) little-endian multi-word integers.
+    """
+    total = x + y
+    carry = total[0] < x[0]
+    for word in range(1, len(x)):
+        with_carry = total[word] + carry
+        carry = (total[word] < x[word]) | (with_carry < total[word])
+        total[word] = with_carry
+    return total
+
+
+def _shift_left(x: np.ndarray, fill: int) -> np.ndarray:
+    """
+    Shifts (n_words, n) multi-word integers left by one bit, shifting in fill.
+    """
+    shifted = x << ONE
+    shifted[1:] |= x[:-1] >> SIXTY_THREE
+    if fill:
+        shifted[0] |= ONE
+    return shifted
+
+
+def _edit_distances(a_codes, a_lengths, b_codes, b_lengths) -> np.ndarray:
+    n_pairs = len(a_codes)
+    a_max, b_max = int(a_lengths.max(initial=0)), int(b_lengths.max(initial=0))
+    n_words = max((a_max + 63) // 64, 1)
+    pairs = np.arange(n_pairs)
+    ## Match masks: bit i of peq[pair, residue] is set if a[pair, i] == residue
+    peq = np.zeros((n_words, n_pairs, 128), dtype=np.uint64)
+    for i in range(a_max):
+        valid = pairs[a_lengths > i]
+        peq[i // 64, valid, a_codes[valid, i]] |= ONE << np.uint64(i % 64)
+    ## Bit of the last query row, whose horizontal delta updates the distance
+    last_word = np.maximum(a_lengths - 1, 0) // 64
+    last_bit = ONE << (np.maximum(a_lengths - 1, 0) % 64).astype(np.uint64)
+
+    positive = np.full((n_words, n_pairs), ~np.uint64(0))
+    negative = np.zeros((n_words, n_pairs), dtype=np.uint64)
+    distances = a_lengths.copy()
+    for j in range(b_max):
+        eq = peq[:, pairs, b_codes[:, j]]
+        xv = eq | negative
+        xh = (_add_with_carry(eq & positive, positive) ^ positive) | eq
+        ph = negative | ~(xh | positive)
+        mh = positive & xh
+        in_b = j < b_lengths
+        distances += in_b & ((ph[last_word, pairs] & last_bit) != 0)
+        distances -= in_b & ((mh[last_word, pairs] & last_bit) != 0)
+        ph = _shift_left(ph, 1)
+        mh = _shift_left(mh, 0)
+        positive = mh | ~(xv | ph)
+        negative = ph & xv
+    return np.where(a_lengths == 0, b_lengths, distances)
+
+
+def identities(distances: np.ndarray, a_lengths: np.ndarray, b_lengths: np.ndarray) -> np.ndarray:
+    return 1 - distances / np.maximum(np.maximum(a_lengths, b_lengths), 1)
+
+
+class KmerIndex:
+    """
+    Exact nearest-neighbor search by edit-distance identity, pruned with a k-mer index.
+    Each sequence is a sparse binary vector over (k-mer, occurrence) features, so the dot product of two
+    vectors is the number of k-mers they share, counted with multiplicity.
+    Args:
+        sequences: list of str, the reference set (e.g., training heavy chains).
+        k: int, k-mer length (3 for chains, 2 for CDRs).
+    """
+    def __init__(self, sequences: list, k: int=3):
+        self.sequences = list(sequences)
+        self.k = k
+        self.codes, self.lengths = encode(self.sequences, pad=TARGET_PAD)
+        features, rows = self._features(self.codes, self.lengths)
+        self.vocabulary, columns = np.unique(features, return_inverse=True)
+        self.matrix = self._matrix(rows, columns, len(self.sequences)).T.tocsr()
+
+    def _features(self, codes: np.ndarray, lengths: np.ndarray) -> tuple:
+        """
+        Returns the (k-mer, occurrence) feature IDs of all sequences and the row of each feature.
+        """
+        n_kmers = np.maximum(lengths - self.k + 1, 0)
+        rows = np.repeat(np.arange(len(codes)), n_kmers)
+        positions = np.arange(n_kmers.sum()) - np.repeat(np.cumsum(n_kmers) - n_kmers, n_kmers)
+        kmers = np.zeros(len(rows), dtype=np.int64)
+        for offset in range(self.k):
+            kmers = kmers * 128 + codes[rows, positions + offset]
+        ## Number the repeats of a k-mer within a sequence
+        order = np.lexsort((positions, kmers, rows))
+        rows, kmers = rows[order], kmers[order]
+        new_group = np.ones(len(kmers), dtype=bool)
+        new_group[1:] = (rows[1:] != rows[:-1]) | (kmers[1:] != kmers[:-1])
+        group_starts = np.flatnonzero(new_group)
+        occurrences = np.arange(len(kmers)) - np.repeat(group_starts, np.diff(np.append(group_starts, len(kmers))))
+        return kmers * 256 + np.minimum(occurrences, 255), rows
+
+    def _matrix(self, rows: np.ndarray, columns: np.ndarray, n_rows: int) -> sparse.csr_matrix:
+        data = np.ones(len(rows), dtype=np.int32)
+        return sparse.csr_matrix((data, (rows, columns)), shape=(n_rows, len(self.vocabulary)))
+
+    def shared_kmers(self, codes: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """
+        Returns the (n_queries, n_reference) number of shared k-mers.
+        """
+        features, rows = self._features(codes, lengths)
+        columns = np.searchsorted(self.vocabulary, features)
+        known = (columns < len(self.vocabulary)) & (self.vocabulary[np.minimum(columns, len(self.vocabulary) - 1)] == features)
+        queries = self._matrix(rows[known], columns[known], len(codes))
+        return (queries @ self.matrix).toarray()
+
+    def nearest(self, sequences: list, exclude: np.ndarray=None, query_batch_size: int=256,
+                first_candidates: int=4, growth: int=4) -> pd.DataFrame:
+        """
+        Finds the reference sequence with the highest identity to each query.
+        Args:
+            sequences: list of str, queries.
+            exclude: optional (n_queries,) reference index to skip for each query (-1 for none), e.g.
+                the query itself when searching a set against itself.
+            query_batch_size: int, queries whose k-mer bounds are computed together.
+            first_candidates: int, candidates scored per query in the first round; every further round
+                scores growth times more.
+        Returns:
+            pd.DataFrame: identity, distance and index of the nearest reference sequence per query.
+        """
+        codes, lengths = encode(sequences, pad=QUERY_PAD)
+        best_identity = np.full(len(sequences), -np.inf)
+        best_distance = np.full(len(sequences), -1, dtype=np.int64)
+        best_index = np.full(len(sequences), -1, dtype=np.int64)
+        n_scored = 0
+        for start in range(0, len(sequences), query_batch_size):
+            batch = np.arange(start, min(start + query_batch_size, len(sequences)))
+            shared = self.shared_kmers(codes[batch], lengths[batch])
+            max_lengths = np.maximum(lengths[batch, None], self.lengths[None, :])
+            lower_bounds = np.maximum(np.ceil((max_lengths - self.k + 1 - shared) / self.k), np.abs(lengths[batch, None] - self.lengths[None, :]))
+            upper_bounds = 1 - np.maximum(lower_bounds, 0) / np.maximum(max_lengths, 1)
+            if exclude is not None:
+                rows = np.flatnonzero(exclude[batch] >= 0)
+                upper_bounds[rows, exclude[batch][rows]] = -np.inf
+            order = np.argsort(-upper_bounds, axis=1, kind='stable')
+            sorted_bounds = np.take_along_axis(upper_bounds, order, axis=1)
+
+            position, n_candidates = 0, first_candidates
+            active = np.arange(len(batch))
+            while len(active) and position < order.shape[1]:
+                candidates = order[active, position:position + n_candidates]
+                bounds = sorted_bounds[active, position:position + n_candidates]
+                query_rows = np.repeat(active, candidates.shape[1])
+                reference = candidates.ravel()
+                ## Skip candidates whose bound cannot beat the best identity found so far
+                useful = bounds.ravel() > best_identity[batch[query_rows]]
+                query_rows, reference = query_rows[useful], reference[useful]
+                queries = batch[query_rows]
+                distances = edit_distances(codes[queries], lengths[queries], self.codes[reference], self.lengths[reference])
+                n_scored += len(queries)
+                pair_identities = identities(distances, lengths[queries], self.lengths[reference])
+                improved = pair_identities > best_identity[queries]
+                ## Keep the best improving pair per query
+                pairs = np.flatnonzero(improved)
+                pairs = pairs[np.lexsort((-pair_identities[pairs], queries[pairs]))]
+                pairs = pairs[np.unique(queries[pairs], return_index=True)[1]]
+                best_identity[queries[pairs]] = pair_identities[pairs]
+                best_distance[queries[pairs]] = distances[pairs]
+                best_index[queries[pairs]] = reference[pairs]
+                position += n_candidates
+                n_candidates *= growth
+                if position < order.shape[1]:
+                    active = active[sorted_bounds[active, position] > best_identity[batch[active]]]
+        logger.debug(f"Scored {n_scored} of {len(sequences) * len(self.sequences)} pairs.")
+        return pd.DataFrame({'identity': best_identity, 'distance': best_distance, 'index': best_index})
+
+
+def mean_pairwise_identity(sequences: list, max_pairs: int=20000, seed: int=0) -> float:
+    """
+    Mean identity over all pairs of a set, or over max_pairs random pairs for larger sets.
+    """
+    n = len(sequences)
+    if n < 2:
+        return np.nan
+    if n * (n - 1) // 2 <= max_pairs:
+        a, b = np.triu_indices(n, k=1)
+    else:
+        rng = np.random.default_rng(seed)
+        a = rng.integers(0, n, max_pairs)
+        b = (a + rng.integers(1, n, max_pairs)) % n
+    a_codes, a_lengths = encode(sequences, pad=QUERY_PAD)
+    b_codes, b_lengths = encode(sequences, pad=TARGET_PAD)
+    distances = edit_distances(a_codes[a], a_lengths[a], b_codes[b], b_lengths[b])
+    return float(identities(distances, a_lengths[a], b_lengths[b]).mean())
+
+
+def number_cdrs(sequences: list, scheme: str="chothia", cache_file: str=None) -> pd.DataFrame:
+    """
+    Extracts CDR1-3 of each chain with abnumber. Chains that cannot be numbered get empty CDRs.
+    Numbering is the slow part, so results can be cached in a .csv keyed by chain sequence.
+    Returns:
+        pd.DataFrame: cdr1, cdr2, cdr3 indexed by chain sequence.
+    """
+    from abnumber import Chain
+
+    cached = pd.DataFrame(columns=CDR_NAMES)
+    if cache_file is not None and os.path.exists(cache_file):
+        cached = pd.read_csv(cache_file, index_col='sequence', keep_default_na=False)
+    new_sequences = [seq for seq in pd.unique(pd.Series(sequences)) if seq not in cached.index]
+    rows = []
+    for seq in new_sequences:
+        try:
+            chain = Chain(seq, scheme=scheme)
+            rows.append([chain.cdr1_seq, chain.cdr2_seq, chain.cdr3_seq])
+        except Exception as e:
+            logger.debug(f"Could not number {seq}: {e}")
+            rows.append(['', '', ''])
+    if new_sequences:
+        logger.info(f"Numbered {len(new_sequences)} chains.")
+        cached = pd.concat([cached, pd.DataFrame(rows, index=pd.Index(new_sequences, name='sequence'), columns=CDR_NAMES)])
+        if cache_file is not None:
+            cached.to_csv(cache_file, index_label='sequence')
+    return cached.loc[list(sequences)]
+
+
+def nearest_identities(queries: pd.Series, references: pd.Series, k: int) -> pd.Series:
+    """
+    Identity of each (non-empty) query to its nearest reference sequence; empty queries get NaN.
+    """
+    references = references[references.str.len() > 0].unique()
+    valid = queries.str.len() > 0
+    result = pd.Series(np.nan, index=queries.index)
+    unique_queries = queries[valid].unique()
+    if len(unique_queries) and len(references):
+        nearest = KmerIndex(references, k=k).nearest(list(unique_queries))
+        result[valid] = queries[valid].map(dict(zip(unique_queries, nearest['identity'])))
+    return result
+
+
+def within_set_identities(sequences: pd.Series, k: int=3) -> pd.Series:
+    """
+    Identity of each sequence to its nearest other member of the set (1.0 for duplicates).
+    """
+    sequences = sequences.reset_index(drop=True)
+    if len(sequences) < 2:
+        return pd.Series(np.nan, index=sequences.index)
+    nearest = KmerIndex(sequences.tolist(), k=k).nearest(sequences.tolist(), exclude=np.arange(len(sequences)))
+    return nearest['identity']
+
+
+def split_chains(seqs: pd.Series) -> pd.DataFrame:
+    chains = seqs.str.split('|', n=1, expand=True).reindex(columns=[0, 1]).fillna('')
+    chains.columns = ['h_chain', 'l_chain']
+    return chains
+
+
+def novelty_metrics(generated_df: pd.DataFrame, training_seqs: pd.Series, group_by: list=['model', 'antigen'],
+                    cdrs: bool=False, scheme: str="chothia", cdr_cache_file: str=None) -> tuple:
+    """
+    Computes per-sequence novelty and per-campaign diversity.
+    Args:
+        generated_df: pd.DataFrame with a `generated_seq` (`HEAVY|LIGHT`) column and the group_by columns.
+        training_seqs: pd.Series of `HEAVY|LIGHT` training sequences (`antibody_fv_seqs`).
+        group_by: list of str, columns that define a campaign.
+        cdrs: bool, also compute nearest-training identity per CDR (needs abnumber).
+    Returns:
+        tuple: (per-sequence pd.DataFrame, per-campaign summary pd.DataFrame).
+    """
+    generated_df = generated_df.dropna(subset=['generated_seq']).reset_index(drop=True)
+    generated = split_chains(generated_df['generated_seq'])
+    training = split_chains(training_seqs.dropna())
+    metrics = generated_df.copy()
+    chains = {'h': 'h_chain', 'l': 'l_chain'}
+
+    start = time.perf_counter()
+    for chain, column in chains.items():
+        metrics[f'nearest_training_identity_{chain}'] = nearest_identities(generated[column], training[column], k=3)
+    logger.info(f"Nearest-training chain identities in {time.perf_counter() - start:.1f} s.")
+
+    if cdrs:
+        start = time.perf_counter()
+        for chain, column in chains.items():
+            generated_cdrs = number_cdrs(generated[column].tolist(), scheme=scheme, cache_file=cdr_cache_file).reset_index(drop=True)
+            training_cdrs = number_cdrs(training[column].tolist(), scheme=scheme, cache_file=cdr_cache_file)
+            for cdr in CDR_NAMES:
+                name = f"{chain.upper()}{cdr[-1]}"
+                metrics[f'cdr_{name}'] = generated_cdrs[cdr]
+                metrics[f'nearest_training_identity_{name}'] = nearest_identities(generated_cdrs[cdr], training_cdrs[cdr], k=2)
+        logger.info(f"Nearest-training CDR identities in {time.perf_counter() - start:.1f} s.")
+
+    start = time.perf_counter()
+    summaries = []
+    for group, group_df in metrics.groupby(group_by, sort=False):
+        group = group if isinstance(group, tuple) else (group,)
+        summary = dict(zip(group_by, group))
+        summary['n_sequences'] = len(group_df)
+        summary['fraction_unique'] = group_df['generated_seq'].nunique() / len(group_df)
+        for chain, column in chains.items():
+            chain_seqs = generated.loc[group_df.index, column]
+            metrics.loc[group_df.index, f'within_set_identity_{chain}'] = within_set_identities(chain_seqs).values
+            summary[f'mean_within_set_identity_{chain}'] = metrics.loc[group_df.index, f'within_set_identity_{chain}'].mean()
+            summary[f'mean_pairwise_identity_{chain}'] = mean_pairwise_identity(chain_seqs.tolist())
+        for column in [c for c in metrics.columns if c.startswith('nearest_training_identity_')]:
+            summary[f'mean_{column}'] = group_df[column].mean()
+        summaries.append(summary)
+    logger.info(f"Within-set diversity of {len(summaries)} campaigns in {time.perf_counter() - start:.1f} s.")
+    return metrics, pd.DataFrame(summaries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Novelty and diversity of generated antibodies.")
+    parser.add_argument("--generated_files", type=str, nargs='+', default=['generated_antibody_sequences.csv'], help="Generated sequence .csv files.")
+    parser.add_argument("--training_file", type=str, default='../data/sabdab/sabdab_training_dataset.csv', help="Training set .csv.")
+    parser.add_argument("--training_column", type=str, default='antibody_fv_seqs', help="Column with `HEAVY|LIGHT` training sequences.")
+    parser.add_argument("--group_by", type=str, nargs='+', default=['model', 'antigen'], help="Columns that define a campaign.")
+    parser.add_argument("--cdrs", action='store_true', help="Also compute per-CDR novelty (numbers chains with abnumber).")
+    parser.add_argument("--scheme", type=str, default='chothia', help="abnumber numbering scheme for the CDRs.")
+    parser.add_argument("--cdr_cache_file", type=str, default=None, help="Optional .csv cache of numbered chains.")
+    parser.add_argument("--output_file", type=str, default='novelty_metrics.csv', help="Per-sequence metrics .csv.")
+    parser.add_argument("--summary_file", type=str, default='novelty_summary.csv', help="Per-campaign summary .csv.")
+    args = parser.parse_args()
+
+    generated_df = pd.concat([pd.read_csv(f) for f in args.generated_files], ignore_index=True)
+    training_seqs = pd.read_csv(args.training_file)[args.training_column]
+    metrics, summary = novelty_metrics(
+        generated_df,
+        training_seqs,
+        group_by=args.group_by,
+        cdrs=args.cdrs,
+        scheme=args.scheme,
+        cdr_cache_file=args.cdr_cache_file
+    )
+    metrics.to_csv(args.output_file, index=False)
+    summary.to_csv(args.summary_file, index=False)
+    logger.info(f"Saved per-sequence metrics to {args.output_file} and campaign summaries to {args.summary_file}.")
+    print(summary.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,367 @@
 import os
+import csv
+import time
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from openmm.app import *
 from openmm import *
 from openmm.unit import *
 from pdbfixer import PDBFixer
+from scipy.spatial import cKDTree
+import pandas as pd
+import numpy as np
 import logging
-import torch
 
 """
 Minimize (relax the side chains of) all PDB files in a given directory using OpenMM.
+Files are spread over a pool of worker processes. Each worker builds the AMBER force field and picks its
+platform once, and runs OpenMM's CPU platform with its own thread count, so workers x threads_per_worker
+should match the cores of the node. Outputs that already exist are skipped, and the time and potential
+energy before and after minimization of every structure are appended to a metrics .csv.
+
+With --mode interface, only residues within --flexible_radius of the antibody-antigen interface move: the
+other atoms are frozen (zero mass) or harmonically restrained, and nonbonded interactions use a cutoff
+instead of the all-pairs NoCutoff method. --interface_energy records the antibody-antigen interaction
+energy (NoCutoff, E_complex - E_antibody - E_antigen) of the minimized structure, so the two modes can be
+compared with --compare_with (the metrics .csv of a full run).
 Inputs:
     - input_dir:str The input directory of PDB files to be minimized
     - output_dir:str The output directory where minimized PDB files will be saved
 Outputs:
     - Minimized PDB files saved in the output directory with the same names as the input files.
+    - relax_metrics.csv in the output directory (one row per structure).
+
+Usage:
+    python run_amber_relax.py structures/predicted_complexes/ structures/relaxed_complexes/ --workers 8 --threads_per_worker 2 --interface_energy
+    python run_amber_relax.py structures/predicted_complexes/ structures/relaxed_interface/ --mode interface --interface_energy --compare_with structures/relaxed_complexes/relax_metrics.csv
 """
 
 ## Set up logging
 logging.basicConfig(level=logging.INFO)
 
-def minimize_pdb(input_pdb, output_pdb):
+METRICS_COLUMNS = ['pdb_file', 'status', 'mode', 'n_atoms', 'n_flexible_atoms', 'energy_before_kj_mol', 'energy_after_kj_mol', 'interface_energy_kj_mol', 'setup_s', 'minimize_s', 'total_s', 'error']
+
+## Per-process state, set up once by init_worker
+_forcefield = None
+_platform = None
+_properties = {}
+
+
+def select_platform(platform_name: str="auto", num_threads: int=None) -> tuple:
+    """
+    Returns an OpenMM platform and its properties. 'auto' uses CUDA when OpenMM can load it, and the CPU otherwise.
+    """
+    if platform_name == "auto":
+        platform_names = [Platform.getPlatform(i).getName() for i in range(Platform.getNumPlatforms())]
+        platform_name = "CUDA" if "CUDA" in platform_names else "CPU"
+    platform = Platform.getPlatformByName(platform_name)
+    if platform_name == "CUDA":
+        properties = {"CudaDeviceIndex": "0", "CudaPrecision": "mixed"}
+    elif platform_name == "OpenCL":
+        properties = {"OpenCLPrecision": "mixed"}
+    elif platform_name == "CPU" and num_threads:
+        properties = {"Threads": str(num_threads)}
+    else:
+        properties = {}
+    return platform, properties
+
+
+def init_worker(platform_name: str="auto", num_threads: int=None):
+    """
+    Builds the force field and selects the platform once per worker process.
+    """
+    global _forcefield, _platform, _properties
+    if num_threads:
+        os.environ["OPENMM_CPU_THREADS"] = str(num_threads)
+    _forcefield = ForceField('amber14-all.xml', 'amber14/tip3p.xml')
+    _platform, _properties = select_platform(platform_name, num_threads)
+    logging.info(f"Worker {os.getpid()}: OpenMM {_platform.getName()} platform {_properties}.")
+
+
+def antibody_chain_ids(topology, antibody_chains: list=None) -> set:
+    """
+    Returns the IDs of the antibody chains (by default the first two chains, as in the H|L|antigen predicted complexes).
+    """
+    if antibody_chains:
+        return set(antibody_chains)
+    return {chain.id for chain in list(topology.chains())[:2]}
+
+
+def flexible_atoms(topology, positions, antibody_chains: set, interface_cutoff: float=5.0, flexible_radius: float=10.0) -> np.ndarray:
+    """
+    Selects the atoms of residues within flexible_radius (Å) of the interface, where interface residues have a
+    heavy atom within interface_cutoff (Å) of a heavy atom of the other partner.
+    Returns:
+        np.ndarray: indices of the atoms that are free to move.
+    """
+    atoms = list(topology.atoms())
+    xyz = np.array(positions.value_in_unit(angstrom))
+    residues = np.array([atom.residue.index for atom in atoms])
+    heavy = np.array([atom.element is not None and atom.element.symbol != 'H' for atom in atoms])
+    is_antibody = np.array([atom.residue.chain.id in antibody_chains for atom in atoms])
+
+    antibody, antigen = np.flatnonzero(heavy & is_antibody), np.flatnonzero(heavy & ~is_antibody)
+    contacts = cKDTree(xyz[antibody]).sparse_distance_matrix(cKDTree(xyz[antigen]), interface_cutoff, output_type='coo_matrix')
+    interface_residues = np.union1d(residues[antibody[contacts.row]], residues[antigen[contacts.col]])
+    interface = np.flatnonzero(np.isin(residues, interface_residues))
+    if len(interface) == 0:
+        return interface
+
+    ## Whole residues with any atom within flexible_radius of an interface atom
+    near = cKDTree(xyz[interface]).query(xyz, distance_upper_bound=flexible_radius)[0] <= flexible_radius
+    return np.flatnonzero(np.isin(residues, np.unique(residues[near])))
+
+
+def restrict_to_atoms(system, positions, flexible: np.ndarray, far_atoms: str="freeze", restraint_k: float=1000.0):
+    """
+    Keeps only the flexible atoms free: the others are frozen (zero mass, which the minimizer holds fixed)
+    or restrained to their starting positions with a harmonic force (restraint_k in kJ/mol/nm^2).
+    """
+    fixed = np.setdiff1d(np.arange(system.getNumParticles()), flexible)
+    if far_atoms == "freeze":
+        for i in fixed:
+            system.setParticleMass(int(i), 0)
+        ## Constraints between two frozen atoms are not allowed (and not needed)
+        is_fixed = np.zeros(system.getNumParticles(), dtype=bool)
+        is_fixed[fixed] = True
+        for i in reversed(range(system.getNumConstraints())):
+            p1, p2, _ = system.getConstraintParameters(i)
+            if is_fixed[p1] and is_fixed[p2]:
+                system.removeConstraint(i)
+    else:
+        restraint = CustomExternalForce("0.5*k*((x-x0)^2+(y-y0)^2+(z-z0)^2)")
+        restraint.addGlobalParameter("k", restraint_k*kilojoules_per_mole/nanometer**2)
+        for name in ["x0", "y0", "z0"]:
+            restraint.addPerParticleParameter(name)
+        xyz = positions.value_in_unit(nanometer)
+        for i in fixed:
+            restraint.addParticle(int(i), xyz[i])
+        system.addForce(restraint)
+
+
+def potential_energy(system, positions) -> float:
+    integrator = VerletIntegrator(0.001*picoseconds)
+    context = Context(system, integrator, _platform, _properties)
+    context.setPositions(positions)
+    return context.getState(getEnergy=True).getPotentialEnergy().value_in_unit(kilojoules_per_mole)
+
+
+def interface_energy(topology, positions, antibody_chains: set) -> float:
+    """
+    Antibody-antigen interaction energy (kJ/mol) with NoCutoff nonbonded interactions: E_complex - E_antibody - E_antigen.
+    """
+    energies = []
+    for delete in [[], [c for c in topology.chains() if c.id not in antibody_chains], [c for c in topology.chains() if c.id in antibody_chains]]:
+        modeller = Modeller(topology, positions)
+        modeller.delete(delete)
+        system = _forcefield.createSystem(modeller.topology, nonbondedMethod=NoCutoff, constraints=None)
+        energies.append(potential_energy(system, modeller.positions))
+    return energies[0] - energies[1] - energies[2]
+
+
+def minimize_pdb(
+        input_pdb,
+        output_pdb,
+        mode: str="full",
+        antibody_chains: list=None,
+        interface_cutoff: float=5.0,
+        flexible_radius: float=10.0,
+        far_atoms: str="freeze",
+        nonbonded_cutoff: float=10.0,
+        compute_interface_energy: bool=False
+        ) -> dict:
+    """
+    Minimizes one structure with the worker's force field and platform.
+    Args:
+        mode: 'full' (all atoms, NoCutoff) or 'interface' (atoms near the interface, cutoff nonbonded method).
+        antibody_chains: list of chain IDs of the antibody (default: the first two chains).
+        interface_cutoff, flexible_radius, nonbonded_cutoff: distances in Å for the interface mode.
+        far_atoms: 'freeze' or 'restrain' the atoms beyond flexible_radius.
+        compute_interface_energy: also compute the antibody-antigen interaction energy after minimization.
+    Returns:
+        dict: atom counts, potential energy (kJ/mol) before and after minimization, and timings.
+    """
+    if _forcefield is None:
+        init_worker()
+    start = time.perf_counter()
+
     ## Load and prepare structure
     fixer = PDBFixer(filename=input_pdb)
     fixer.findMissingResidues()
     fixer.findMissingAtoms()
     fixer.addMissingAtoms()
     fixer.addMissingHydrogens(pH=7.0)
+    antibody_chains = antibody_chain_ids(fixer.topology, antibody_chains)
 
     ## Create system using AMBER force field
-    forcefield = ForceField('amber14-all.xml', 'amber14/tip3p.xml')
-    system = forcefield.createSystem(
-        fixer.topology,
-        nonbondedMethod=NoCutoff,
-        constraints=HBonds
-    )
+    if mode == "interface":
+        system = _forcefield.createSystem(
+            fixer.topology,
+            nonbondedMethod=CutoffNonPeriodic,
+            nonbondedCutoff=nonbonded_cutoff*angstrom,
+            constraints=HBonds
+        )
+        flexible = flexible_atoms(fixer.topology, fixer.positions, antibody_chains, interface_cutoff, flexible_radius)
+        restrict_to_atoms(system, fixer.positions, flexible, far_atoms)
+    else:
+        system = _forcefield.createSystem(
+            fixer.topology,
+            nonbondedMethod=NoCutoff,
+            constraints=HBonds
+        )
+        flexible = np.arange(system.getNumParticles())
 
     ## Integrator (not used for MD, just needed)
     integrator = LangevinIntegrator(300*kelvin, 1/picosecond, 0.002*picoseconds)
-    if torch.cuda.is_available():
-        logging.info("Using GPU for OpenMM.")
-        platform = Platform.getPlatformByName('CUDA')
-        properties = {"CudaDeviceIndex": "0", "CudaPrecision": "mixed"}
-        # platform = Platform.getPlatformByName('OpenCL')
-        # properties = {"OpenCLPrecision": "mixed"}
-    else:
-        logging.info("Using CPU for OpenMM.")
-        platform = Platform.getPlatformByName('CPU')
-        properties = {}
-    simulation = Simulation(fixer.topology, system, integrator, platform, properties)
+    simulation = Simulation(fixer.topology, system, integrator, _platform, _properties)
     simulation.context.setPositions(fixer.positions)
+    energy_before = simulation.context.getState(getEnergy=True).getPotentialEnergy().value_in_unit(kilojoules_per_mole)
+    setup_time = time.perf_counter() - start
 
     ## Energy minimization
     simulation.minimizeEnergy()
-    positions = simulation.context.getState(getPositions=True).getPositions()
+    state = simulation.context.getState(getPositions=True, getEnergy=True)
+    minimize_time = time.perf_counter() - start - setup_time
+
+    ## Save output (renamed into place, so an interrupted write is never mistaken for a finished file)
+    partial_pdb = f"{output_pdb}.partial"
+    with open(partial_pdb, 'w') as f:
+        PDBFile.writeFile(fixer.topology, state.getPositions(), f)
+    os.replace(partial_pdb, output_pdb)
+
+    metrics = {
+        "mode": mode,
+        "n_atoms": system.getNumParticles(),
+        "n_flexible_atoms": len(flexible),
+        "energy_before_kj_mol": energy_before,
+        "energy_after_kj_mol": state.getPotentialEnergy().value_in_unit(kilojoules_per_mole),
+        "setup_s": setup_time,
+        "minimize_s": minimize_time,
+        "total_s": time.perf_counter() - start
+    }
+    if compute_interface_energy:
+        metrics["interface_energy_kj_mol"] = interface_energy(fixer.topology, state.getPositions(), antibody_chains)
+    return metrics
+
+
+def compare_metrics(metrics_file: str, reference_file: str):
+    """
+    Logs the speedup and interface energy agreement of a run against a reference (full minimization) run.
+    """
+    df = pd.read_csv(metrics_file).merge(pd.read_csv(reference_file), on='pdb_file', suffixes=('', '_reference'))
+    df = df[(df['status'] == 'ok') & (df['status_reference'] == 'ok')]
+    if df.empty:
+        logging.warning(f"No structures minimized in both {metrics_file} and {reference_file}.")
+        return
+    logging.info(f"Compared {len(df)} structures with {reference_file}: "
+                 f"minimization {df['minimize_s_reference'].sum() / df['minimize_s'].sum():.1f}x faster, "
+                 f"total {df['total_s_reference'].sum() / df['total_s'].sum():.1f}x faster "
+                 f"(median per structure {(df['total_s_reference'] / df['total_s']).median():.1f}x).")
+    energies = df[['interface_energy_kj_mol', 'interface_energy_kj_mol_reference']].dropna()
+    if len(energies) < 2:
+        ## Runs without --interface_energy leave the column empty
+        empty = [file for file, column in [(metrics_file, 'interface_energy_kj_mol'), (reference_file, 'interface_energy_kj_mol_reference')] if df[column].isna().all()]
+        reason = f"no interface energies in {' and '.join(empty)} (run with --interface_energy)" if empty else f"only {len(energies)} structures have both"
+        logging.warning(f"Interface energies not compared: {reason}.")
+    else:
+        difference = energies['interface_energy_kj_mol'] - energies['interface_energy_kj_mol_reference']
+        logging.info(f"Interface energy vs. the reference: mean absolute difference {difference.abs().mean():.1f} kJ/mol "
+                     f"(mean reference {energies['interface_energy_kj_mol_reference'].mean():.1f} kJ/mol), "
+                     f"Pearson r {energies.corr().iloc[0, 1]:.3f}, Spearman rho {energies.corr(method='spearman').iloc[0, 1]:.3f}.")
+
+
+def relax_file(input_path: str, output_path: str, **kwargs) -> dict:
+    """
+    Worker task: minimizes one file and reports failures instead of raising them.
+    """
+    start = time.perf_counter()
+    try:
+        return {"status": "ok", **minimize_pdb(input_path, output_path, **kwargs)}
+    except Exception as e:
+        return {"status": "error", "total_s": time.perf_counter() - start, "error": str(e)}
 
-    ## Save output
-    with open(output_pdb, 'w') as f:
-        PDBFile.writeFile(fixer.topology, positions, f)
 
 def main():
     parser = argparse.ArgumentParser(description="Minimize PDBs using OpenMM.")
     parser.add_argument("input_dir", help="Directory with input PDB files")
     parser.add_argument("output_dir", help="Directory to save minimized PDB files")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: cores // threads_per_worker on CPU, 1 on a GPU)")
+    parser.add_argument("--threads_per_worker", type=int, default=1, help="OpenMM CPU threads per worker")
+    parser.add_argument("--platform", type=str, default="auto", choices=["auto", "CPU", "CUDA", "OpenCL"], help="OpenMM platform")
+    parser.add_argument("--mode", type=str, default="full", choices=["full", "interface"], help="Minimize all atoms, or only the interface region")
+    parser.add_argument("--antibody_chains", type=str, nargs='+', default=None, help="Antibody chain IDs (default: the first two chains)")
+    parser.add_argument("--interface_cutoff", type=float, default=5.0, help="Heavy-atom distance (Å) that defines interface residues")
+    parser.add_argument("--flexible_radius", type=float, default=10.0, help="Residues within this distance (Å) of the interface move in interface mode")
+    parser.add_argument("--far_atoms", type=str, default="freeze", choices=["freeze", "restrain"], help="Freeze or restrain the other atoms in interface mode")
+    parser.add_argument("--nonbonded_cutoff", type=float, default=10.0, help="Nonbonded cutoff (Å) in interface mode")
+    parser.add_argument("--interface_energy", action="store_true", help="Record the antibody-antigen interaction energy after minimization")
+    parser.add_argument("--compare_with", type=str, default=None, help="Metrics .csv of a reference (full) run to compare timings and interface energies with")
+    parser.add_argument("--metrics_file", type=str, default=None, help="Per-structure metrics .csv (default: relax_metrics.csv in output_dir)")
     args = parser.parse_args()
 
     os.makedirs(args.output_dir, exist_ok=True)
+    metrics_file = args.metrics_file or os.path.join(args.output_dir, "relax_metrics.csv")
 
     logging.info(f"Input directory: {args.input_dir}")
     logging.info(f"Output directory: {args.output_dir}")
 
-    pdb_files = [f for f in os.listdir(args.input_dir) if f.endswith(".pdb")]
+    pdb_files = sorted(f for f in os.listdir(args.input_dir) if f.endswith(".pdb"))
     if not pdb_files:
         logging.warning("No PDB files found in input directory.")
         return
+    pending = [f for f in pdb_files if not os.path.exists(os.path.join(args.output_dir, f))]
+    logging.info(f"{len(pdb_files)} PDB files, {len(pdb_files) - len(pending)} already minimized, {len(pending)} to minimize.")
+    if not pending:
+        if args.compare_with:
+            compare_metrics(metrics_file, args.compare_with)
+        return
+
+    platform_name = select_platform(args.platform)[0].getName()
+    workers = args.workers
+    if workers is None:
+        workers = 1 if platform_name != "CPU" else max(1, (os.cpu_count() or 1) // args.threads_per_worker)
+    logging.info(f"Using {workers} workers on the {platform_name} platform ({args.threads_per_worker} OpenMM CPU threads each).")
+
+    minimize_kwargs = {
+        "mode": args.mode,
+        "antibody_chains": args.antibody_chains,
+        "interface_cutoff": args.interface_cutoff,
+        "flexible_radius": args.flexible_radius,
+        "far_atoms": args.far_atoms,
+        "nonbonded_cutoff": args.nonbonded_cutoff,
+        "compute_interface_energy": args.interface_energy or args.compare_with is not None
+    }
+    new_metrics_file = not os.path.exists(metrics_file)
+    start = time.perf_counter()
+    n_ok = 0
+    with open(metrics_file, 'a', newline='') as f, ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(platform_name, args.threads_per_worker)
+    ) as executor:
+        writer = csv.DictWriter(f, fieldnames=METRICS_COLUMNS, extrasaction='ignore')
+        if new_metrics_file:
+            writer.writeheader()
+        futures = {
+            executor.submit(relax_file, os.path.join(args.input_dir, pdb_file), os.path.join(args.output_dir, pdb_file), **minimize_kwargs): pdb_file
+            for pdb_file in pending
+        }
+        for i, future in enumerate(as_completed(futures), start=1):
+            pdb_file = futures[future]
+            result = {"pdb_file": pdb_file, **future.result()}
+            writer.writerow(result)
+            f.flush()
+            if result["status"] == "ok":
+                n_ok += 1
+                logging.info(f"[{i}/{len(pending)}] Minimized {pdb_file} ({result['n_flexible_atoms']} of {result['n_atoms']} atoms) in {result['total_s']:.1f} s: "
+                             f"{result['energy_before_kj_mol']:.4g} -> {result['energy_after_kj_mol']:.4g} kJ/mol")
+            else:
+                logging.error(f"[{i}/{len(pending)}] Failed to minimize {pdb_file}: {result['error']}")
 
-    for pdb_file in pdb_files:
-        input_path = os.path.join(args.input_dir, pdb_file)
-        output_path = os.path.join(args.output_dir, pdb_file)
-        logging.info(f"Minimizing: {pdb_file}")
-        try:
-            minimize_pdb(input_path, output_path)
-        except Exception as e:
-            logging.error(f"Failed to minimize {pdb_file}: {e}")
+    wall_time = time.perf_counter() - start
+    logging.info(f"Minimized {n_ok} of {len(pending)} structures in {wall_time:.1f} s ({60 * len(pending) / wall_time:.1f} structures/min). Metrics: {metrics_file}")
+    if args.compare_with:
+        compare_metrics(metrics_file, args.compare_with)
 
 if __name__ == "__main__":
     main()
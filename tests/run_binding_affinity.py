@@ -1,27 +1,48 @@
-import re, os
-import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
+import subprocess
+import threading
+import argparse
+import tempfile
+import signal
+import shutil
+import time
+import csv
+import re, os
+
+"""
+Scores predicted complexes with `haddock3-score`, running a bounded pool of processes in parallel.
+Each structure is scored in its own process group and scratch directory with a timeout; results are
+appended to the output .csv (with the runtime of each structure) as soon as they are parsed, and
+structures already in the output are skipped, so an interrupted run resumes where it stopped.
+Failed and timed-out structures are logged to a separate .csv and retried on the next run.
+
+Any executable that prints `haddock3-score --full` output can stand in for HADDOCK (see --executable), e.g.:
+    #!/bin/sh
+    echo "HADDOCK-score (emscoring) = -72.981"
+    echo "vdw=37.6051, elec=-79.0923, desolv=-94.7676, air=0.0, bsa=3551.13"
 
-## Find all .pdb files in a directory
-structures_dir = '/mnt/tests/structures/predicted_complexes'
-pdb_files = [f for f in os.listdir(structures_dir) if f.endswith('.pdb')]
+Usage:
+    python run_binding_affinity.py --structures_dir /mnt/tests/structures/predicted_complexes --workers 8 --timeout 600
+"""
 
-def haddock3_score(pdb_path:str) -> dict:
-  try:
-    ## Run haddock3-score CLI
-    command = ["haddock3-score", "--full", pdb_path]
-    sp_result = subprocess.run(command, capture_output=True, text=True, check=True)
+RESULT_COLUMNS = ['seq_id', 'score', 'total', 'vdw', 'elec', 'desolv', 'bsa', 'runtime_s']
+FAILURE_COLUMNS = ['seq_id', 'status', 'runtime_s', 'error']
 
-    ## Parse result
+
+def parse_haddock3_output(stdout: str) -> dict:
+    """
+    Parses the HADDOCK score and energy terms printed by `haddock3-score --full`.
+    """
     metrics = {}
 
     ## Extract HADDOCK score
-    match = re.search(r"HADDOCK-score \(emscoring\) = ([\-\d\.]+)", sp_result.stdout)
+    match = re.search(r"HADDOCK-score \(emscoring\) = ([\-\d\.]+)", stdout)
     if match:
         metrics["score"] = float(match.group(1))
 
     ## Extract individual energy terms
-    matches = re.findall(r"(\w+)=([\-\d\.]+)", sp_result.stdout)
+    matches = re.findall(r"(\w+)=([\-\d\.]+)", stdout)
     for key, value in matches:
         metrics[key] = float(value)
 
@@ -29,29 +50,189 @@ def haddock3_score(pdb_path:str) -> dict:
     metrics["total"] = metrics["vdw"] + metrics["elec"]
 
     ## Remove air
-    del metrics["air"]
+    metrics.pop("air", None)
 
     return metrics
 
-  except subprocess.CalledProcessError as e:
-    print("HADDOCK3 Error occurred:", e.stderr)
-    return {}
-  
-
-## Pandas dataframe to store results
-affinity_df = pd.DataFrame(columns=['seq_id', 'score', 'total', 'vdw', 'elec', 'desolv', 'bsa'])
-  
-## Run haddock3_score on each pdb file and append results to dataframe
-for pdb_file in pdb_files:
-    pdb_path = os.path.join(structures_dir, pdb_file)
-    print(f"Scoring {pdb_file}")
-    scores = haddock3_score(pdb_path)
-    if scores:
-        scores['seq_id'] = pdb_file.replace('.pdb','')
-        affinity_df_row = pd.DataFrame([scores])
-        affinity_df = pd.concat([affinity_df, affinity_df_row], ignore_index=True)
-
-
-## Save results to CSV
-output_file = 'binding_affinity_results.csv'
-affinity_df.to_csv(output_file, index=False)
\ No newline at end of file
+
+class Haddock3Scorer:
+    """
+    Runs `haddock3-score` jobs with a timeout, and kills every running job on interruption.
+    Args:
+        executable: str, `haddock3-score` or a stand-in with the same output.
+        timeout: float, seconds before a job (and its child processes) is killed.
+    """
+    def __init__(self, executable: str="haddock3-score", timeout: float=600):
+        ## Jobs run in their own scratch directories, so a relative path would not resolve there
+        self.executable = os.path.abspath(shutil.which(executable) or executable)
+        self.timeout = timeout
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def score(self, pdb_path: str) -> dict:
+        """
+        Scores one structure. Returns a dict with `status` ('ok', 'error' or 'timeout'), `runtime_s`,
+        and the parsed metrics or the error.
+        """
+        start = time.perf_counter()
+        ## Each job works in its own directory, so parallel runs do not share scratch files
+        workdir = tempfile.mkdtemp(prefix="haddock3_score_")
+        try:
+            process = subprocess.Popen(
+                [self.executable, "--full", os.path.abspath(pdb_path)],
+                cwd=workdir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                start_new_session=True
+            )
+            with self._lock:
+                self._processes.add(process)
+            try:
+                stdout, stderr = process.communicate(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                self._kill(process)
+                process.communicate()
+                return {"status": "timeout", "runtime_s": time.perf_counter() - start, "error": f"Timed out after {self.timeout} s"}
+            finally:
+                with self._lock:
+                    self._processes.discard(process)
+            if process.returncode != 0:
+                return {"status": "error", "runtime_s": time.perf_counter() - start, "error": stderr.strip()[-1000:]}
+            try:
+                metrics = parse_haddock3_output(stdout)
+            except KeyError as e:
+                return {"status": "error", "runtime_s": time.perf_counter() - start, "error": f"Missing {e} in the output"}
+            return {"status": "ok", "runtime_s": time.perf_counter() - start, **metrics}
+        except OSError as e:
+            return {"status": "error", "runtime_s": time.perf_counter() - start, "error": str(e)}
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _kill(self, process: subprocess.Popen):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def kill_all(self):
+        with self._lock:
+            for process in list(self._processes):
+                self._kill(process)
+
+
+class CsvAppender:
+    """
+    Appends rows to a .csv, flushing each one. An existing file is reused; if its columns differ
+    from the expected ones (e.g., results written before runtimes were recorded), it is rewritten
+    with the new columns first.
+    """
+    def __init__(self, path: str, columns: list):
+        self.path = path
+        self.columns = columns
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.rows = pd.read_csv(path) if exists else pd.DataFrame(columns=columns)
+        if not exists or list(self.rows.columns) != columns:
+            self.rows.reindex(columns=columns).to_csv(path, index=False)
+        self.file = open(path, 'a', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=columns, extrasaction='ignore')
+
+    def write(self, row: dict):
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def run_scoring(
+        structures_dir: str,
+        output_file: str='binding_affinity_results.csv',
+        failures_file: str='binding_affinity_failures.csv',
+        workers: int=os.cpu_count(),
+        timeout: float=600,
+        executable: str="haddock3-score",
+        seq_ids: list=None
+        ) -> dict:
+    """
+    Scores every .pdb in structures_dir that is not yet in output_file (only those in seq_ids, if given).
+    Returns:
+        dict: run summary (counts, wall time, runtime statistics).
+    """
+    results = CsvAppender(output_file, RESULT_COLUMNS)
+    failures = CsvAppender(failures_file, FAILURE_COLUMNS)
+    done = set(results.rows['seq_id'].astype(str))
+    pdb_files = sorted(f for f in os.listdir(structures_dir) if f.endswith('.pdb'))
+    if seq_ids is not None:
+        seq_ids = set(seq_ids)
+        pdb_files = [f for f in pdb_files if f.replace('.pdb', '') in seq_ids]
+    pending = [f for f in pdb_files if f.replace('.pdb', '') not in done]
+    print(f"{len(pdb_files)} structures, {len(pdb_files) - len(pending)} already scored, {len(pending)} to score with {workers} workers.")
+
+    scorer = Haddock3Scorer(executable=executable, timeout=timeout)
+    counts = {"ok": 0, "error": 0, "timeout": 0}
+    runtimes = []
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(scorer.score, os.path.join(structures_dir, f)): f for f in pending}
+        for i, future in enumerate(as_completed(futures), start=1):
+            pdb_file = futures[future]
+            result = future.result()
+            result['seq_id'] = pdb_file.replace('.pdb', '')
+            counts[result['status']] += 1
+            runtimes.append(result['runtime_s'])
+            if result['status'] == 'ok':
+                results.write(result)
+            else:
+                failures.write(result)
+            print(f"[{i}/{len(pending)}] {pdb_file}: {result['status']} in {result['runtime_s']:.1f} s")
+    except KeyboardInterrupt:
+        print("Interrupted; killing running jobs. Scored structures are saved and will be skipped on the next run.")
+        executor.shutdown(wait=False, cancel_futures=True)
+        scorer.kill_all()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        results.close()
+        failures.close()
+
+    wall_time = time.perf_counter() - start
+    summary = {
+        **counts,
+        "skipped": len(pdb_files) - len(pending),
+        "wall_time_s": wall_time,
+        "structures_per_min": 60 * len(pending) / wall_time if wall_time > 0 else 0.0,
+        "mean_runtime_s": sum(runtimes) / len(runtimes) if runtimes else 0.0,
+        "max_runtime_s": max(runtimes, default=0.0)
+    }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peleke🦋: Score predicted complexes with HADDOCK3 in parallel.")
+    parser.add_argument("--structures_dir", type=str, default='/mnt/tests/structures/predicted_complexes', help="Directory of .pdb complexes.")
+    parser.add_argument("--output_file", type=str, default='binding_affinity_results.csv', help="Results .csv (resumed if it exists).")
+    parser.add_argument("--failures_file", type=str, default='binding_affinity_failures.csv', help="Log of failed and timed-out structures.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of concurrent haddock3-score processes.")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds before a structure's job is killed.")
+    parser.add_argument("--executable", type=str, default='haddock3-score', help="haddock3-score executable (or a stand-in for testing).")
+    parser.add_argument("--select_file", type=str, default=None, help="Only score the seq_ids in this .csv (e.g., the top ranks from interface_energy.py).")
+    args = parser.parse_args()
+
+    summary = run_scoring(
+        args.structures_dir,
+        output_file=args.output_file,
+        failures_file=args.failures_file,
+        workers=args.workers,
+        timeout=args.timeout,
+        executable=args.executable,
+        seq_ids=pd.read_csv(args.select_file)['seq_id'].astype(str).tolist() if args.select_file else None
+    )
+    print(f"Scored {summary['ok']} structures ({summary['error']} errors, {summary['timeout']} timeouts, {summary['skipped']} skipped) "
+          f"in {summary['wall_time_s']:.1f} s: {summary['structures_per_min']:.1f} structures/min, "
+          f"mean {summary['mean_runtime_s']:.1f} s and max {summary['max_runtime_s']:.1f} s per structure.")
+
+
+if __name__ == "__main__":
+    main()